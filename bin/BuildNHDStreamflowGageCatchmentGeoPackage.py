@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""@package BuildNHDStreamflowGageCatchmentGeoPackage
+
+@brief Delineate the drainage area of every NHDPlus2 streamflow gage, and store the
+@brief resulting polygons in a GeoPackage.  Builds can be resumed.
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2013, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR 
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT 
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+@author Brian Miles <brian_miles@unc.edu>
+
+
+Pre conditions
+--------------
+1. Configuration file must define the following sections and values:
+   'NHDPLUS2', 'PATH_OF_NHDPLUS2_DB'
+   'NHDPLUS2', 'PATH_OF_NHDPLUS2_CATCHMENT'
+   
+   The following sections and values are optional, but speed up delineation of many gages:
+   'NHDPLUS2', 'PATH_OF_NHDPLUS2_NETWORK'
+   'NHDPLUS2', 'PATH_OF_NHDPLUS2_CATCHMENT_CACHE'
+
+Post conditions
+---------------
+1. Catchments of gages will be written to layer 'gage_catchment' of the GeoPackage named
+   by the -o option.  Gages already in the GeoPackage will be skipped.
+
+Usage:
+@code
+BuildNHDStreamflowGageCatchmentGeoPackage.py -i /path/to/config -o /path/to/catchments.gpkg
+@endcode
+
+@note EcohydroLib configuration file must be specified by environmental variable 'ECOHYDROLIB_CFG',
+or -i option must be specified. 
+"""
+import os
+import sys
+import argparse
+import ConfigParser
+
+from ecohydrolib.context import CONFIG_FILE_ENV
+from ecohydrolib.nhdplus2.gagecatchments import buildGageCatchmentGeoPackage
+
+# Handle command line options
+parser = argparse.ArgumentParser(description='Build a GeoPackage of the drainage areas of NHDPlus2 streamflow gages')
+parser.add_argument('-i', '--configfile', dest='configfile', required=False,
+                    help='The configuration file')
+parser.add_argument('-o', '--outfile', dest='outfile', required=True,
+                    help='The GeoPackage to which catchments should be written.  If the GeoPackage exists, ' +
+                    'gages already in it will be skipped.')
+parser.add_argument('-g', '--gageIds', dest='gageIds', required=False, nargs='+',
+                    help='Source_Fea (e.g. USGS site number) of gages to delineate.  If not specified, ' +
+                    'all gages in the NHDPlus2 database will be delineated.')
+parser.add_argument('-n', '--nprocesses', dest='nprocesses', required=False, type=int,
+                    help='Number of processes to use.  If not specified, one process per CPU will be used.')
+args = parser.parse_args()
+
+configFile = args.configfile
+if not configFile:
+    if not CONFIG_FILE_ENV in os.environ:
+        sys.exit("Configuration file not specified via environmental variable %s or -i option" % \
+                 (CONFIG_FILE_ENV,))
+    configFile = os.environ[CONFIG_FILE_ENV]
+config = ConfigParser.RawConfigParser()
+config.read(configFile)
+
+if not config.has_option('NHDPLUS2', 'PATH_OF_NHDPLUS2_DB'):
+    sys.exit("Config file %s does not define option %s in section %s" % \
+          (configFile, 'PATH_OF_NHDPLUS2_DB', 'NHDPLUS2'))
+if not config.has_option('NHDPLUS2', 'PATH_OF_NHDPLUS2_CATCHMENT'):
+    sys.exit("Config file %s does not define option %s in section %s" % \
+          (configFile, 'PATH_OF_NHDPLUS2_CATCHMENT', 'NHDPLUS2'))
+
+def printProgress(numDone, numGages):
+    pctComplete = (float(numDone) / float(numGages)) * 100
+    sys.stdout.write("\r\tProcessing gage %d of %d (%.0f%%)" % (numDone, numGages, pctComplete))
+    sys.stdout.flush()
+
+print("Building catchments of streamflow gages in %s ..." % (args.outfile,))
+(built, failed) = buildGageCatchmentGeoPackage(config, args.outfile, args.gageIds, 
+                                               args.nprocesses, printProgress)
+sys.stdout.write("\n")
+for (sourceFea, message) in failed:
+    sys.stderr.write("Unable to build catchment for gage %s: %s\n" % (sourceFea, message))
+print("Built %d catchments, %d gages failed" % (built, len(failed)))
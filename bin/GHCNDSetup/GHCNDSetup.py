@@ -46,16 +46,27 @@ GHCNDSetup.py -o <output_dir>
 import os, sys, errno
 import argparse
 import urllib
-import re
 from pyspatialite import dbapi2 as spatialite
 
-
-_sanitizeString = '[\'";]'
-
 SRS = int(4326)
 DB_NAME = 'GHCND.spatialite'
 URL = 'http://www1.ncdc.noaa.gov/pub/data/ghcn/daily/ghcnd-stations.txt'
 
+
+def parseStation(line):
+    """ Parse a line of fixed-width ghcnd-stations.txt (see 
+        http://www1.ncdc.noaa.gov/pub/data/ghcn/daily/readme.txt)
+        
+        @return Tuple of the form (id, name, elevation, longitude, latitude)
+    """
+    id = unicode(line[0:11].strip(), errors='replace')
+    lat = float(line[12:20])
+    lon = float(line[21:30])
+    elev = float(line[31:37])
+    name = unicode(line[41:71].strip(), errors='replace')
+    return (id, name, elev, lon, lat)
+
+
 parser = argparse.ArgumentParser(description='Build database of GHCN station metadata')
 parser.add_argument('-o', '--output', dest='outputDir', required=True,
                     help='Directory to which database named "GHCND.sqlite" should be placed')
@@ -102,32 +113,18 @@ sys.stdout.flush()
 # 2. Fetch station metadata
 sys.stdout.write("Downloading station data from NCDC (this may take a while)...")
 f = urllib.urlopen(url)
+lines = f.read().splitlines()
+f.close()
+sys.stdout.write("done\n")
 
 # 3. Insert station metadata into database
-line = f.readline()
-while line:
-    line.strip()
-    #sys.stdout.write(line)
-    id = unicode(line[:11].strip(), errors='replace')
-    id = re.sub(_sanitizeString, '', id) # A poor substitute for proper escapeing, but SQLite3 python module sucks in this regard
-    lat = float(line[12:19].strip())
-    lon = float(line[21:29].strip())
-    elev = float(line[31:36].strip())
-    name = unicode(line[41:70].strip(), errors='replace')
-    name = re.sub(_sanitizeString, '', name) # A poor substitute for proper escapeing, but SQLite3 python module sucks in this regard
-    
-    # SQLite can't handle parameter substitution within quotes (e.g. GeomFromText('POINT(:lon :lat)')
-    #    cursor.execute("INSERT INTO ghcn_station (id,name,elevation_m,coord) VALUES (:id,:name,:elevation_m,GeomFromText('POINT(:lon :lat)', :srs) )",
-    #                   {"id": id, "name": name, "elevation_m": elev, "lon": lon, "lat": lat, "srs": SRS})
-    # So we have to do it the dangerous way ...
-    sql = u"INSERT INTO ghcn_station (id,name,elevation_m,coord) VALUES ('%s','%s',%f,GeomFromText('POINT(%f %f)', %d) )" % \
-        (id, name, elev, lon, lat, SRS)
-    #print("sql to exec: %s\n" % (sql,) )
-    cursor.execute(sql)
-    
-    line = f.readline()
-    
+sys.stdout.write("Loading %d stations into database..." % (len(lines),))
+sys.stdout.flush()
+stations = [parseStation(line) for line in lines if line.strip()]
+cursor.executemany("""INSERT INTO ghcn_station (id,name,elevation_m,coord) 
+VALUES (?,?,?,MakePoint(?, ?, %d))""" % (SRS,), stations)
 conn.commit()
+
 # Index the data
 cursor.execute("""SELECT CreateSpatialIndex('ghcn_station', 'coord')""")
 conn.commit()
@@ -6,7 +6,7 @@ http://www.horizon-systems.com/NHDPlus/NHDPlusV2_home.php
 @brief Assembles regional NHDPlus V2 data into national dataset suitable for gage-
 reach based region of interest extraction
 
-@note Requires GDAL/OGR that has been built with SQLite3 support
+@note Requires GDAL/OGR 1.10 or later that has been built with SQLite3 and SpatiaLite support
 @note Requires 7z to extract data from archive files
 
 This software is provided free of charge under the New BSD License. Please see
@@ -42,8 +42,12 @@ OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 Usage:
 @code
-NHDPlusSetup.py -i <config_file> -a  <archive_dir> -o <output_dir>
+NHDPlusSetup.py -i <config_file> -a  <archive_dir> -o <output_dir> [-c] [-n <processes>] [-f]
 @endcode
+
+@note Setup is resumable.  The checksums of the inputs of each archive extracted, and of
+each dataset built, are recorded in NHDPlusV2Setup.manifest.sqlite in the output directory.
+Re-running setup only redoes steps that failed, or whose inputs have changed.
 """
 import os
 import sys
@@ -52,8 +56,26 @@ import argparse
 import subprocess
 import sqlite3
 import ConfigParser
+import multiprocessing
 
-from ecohydrolib.dbf import dbfreader
+from ecohydrolib.nhdplus2.networkindex import PlusFlowIndex
+from ecohydrolib.nhdplus2.networkindex import createPlusFlowIntervalTables
+from ecohydrolib.nhdplus2.networkindex import DownstreamIndex
+from ecohydrolib.nhdplus2.networkindex import saveNetworkSnapshot
+from ecohydrolib.spatialdata.utils import writeUnionVRT
+from ecohydrolib.nhdplus2.networkanalysis import createCatchmentEnvelopeTable
+from ecohydrolib.nhdplus2.networkanalysis import CATCHMENT_LAYER
+from ecohydrolib.nhdplus2.networkanalysis import FLOWLINE_LAYER
+from ecohydrolib.nhdplus2.tables import NHDPLUS_DBF_TABLES
+from ecohydrolib.nhdplus2.tables import beginBulkLoad
+from ecohydrolib.nhdplus2.tables import loadDBF
+from ecohydrolib.nhdplus2.tables import endBulkLoad
+from ecohydrolib.nhdplus2.columnar import COLUMNAR_TABLES
+from ecohydrolib.nhdplus2.columnar import exportTableColumns
+from ecohydrolib.nhdplus2.setupmanifest import SetupManifest
+from ecohydrolib.nhdplus2.setupmanifest import getShapefileComponents
+from ecohydrolib.nhdplus2.setupmanifest import runCommand
+from ecohydrolib.nhdplus2.setupmanifest import runSteps
 
 
 parser = argparse.ArgumentParser(description='Assemble regional NHDPLus V2 data into a national dataset')
@@ -77,6 +99,18 @@ parser.add_argument('-s3', '--skipDB', dest='skipDB', action='store_true',
 parser.add_argument('-s4', '--skipGageLoc', dest='skipGageLoc', action='store_true',
                     default=False, required=False,
                     help='Skip step where GageLoc database is created')
+parser.add_argument('-s5', '--skipFlowline', dest='skipFlowline', action='store_true',
+                    default=False, required=False,
+                    help='Skip step where regional flowline shapefiles are merged')
+parser.add_argument('-c', '--columnar', dest='columnar', action='store_true',
+                    default=False, required=False,
+                    help='Export PlusFlowlineVAA and Gage_Smooth tables to columnar files for vectorized analysis')
+parser.add_argument('-n', '--processes', dest='processes', type=int, 
+                    default=None, required=False,
+                    help='Number of processes to use; defaults to the number of CPUs')
+parser.add_argument('-f', '--force', dest='force', action='store_true',
+                    default=False, required=False,
+                    help='Redo all steps, even those whose inputs have not changed since they were completed')
 args = parser.parse_args()
 
 config = ConfigParser.RawConfigParser()
@@ -109,419 +143,242 @@ if not os.access(args.outputDir, os.W_OK):
                   args.outputDir)
 
 nhdPlusDB = os.path.join(args.outputDir, "NHDPlusDB.sqlite")
+nhdPlusNetwork = os.path.join(args.outputDir, "NHDPlusNetwork")
+nhdPlusColumns = os.path.join(args.outputDir, "NHDPlusColumns")
 
-# 0. Unpacking NHDPlus archives into output directory
-if not args.skipUnzip:
-    print("Unpacking NHDPlus archives into output directory %s" % (args.outputDir,))
+# Number of features ogr2ogr writes per transaction
+OGR_TRANSACTION_SIZE = 262144
 
-    # Get a list of zip files
-    zipFiles = subprocess.check_output("%s %s -type f -name *.7z -print" % (pathOfFind, args.archiveDir,), shell=True).split()
+# DBF files imported into NHDPlus SQLite database
+DBF_INPUTS = [name for (name, table) in NHDPLUS_DBF_TABLES]
 
-    # Unpack zip files into output directory
-    for file in zipFiles:
-        sevenZCommand = "%s x -y -o%s %s" % \
-            (pathOfSevenZip, args.outputDir, file)
-        print sevenZCommand
-        returnCode = os.system(sevenZCommand)
-        assert(returnCode == 0)
 
-# 1. Find GageLoc shapefile and convert it to a spatial SQLite DB
-if not args.skipGageLoc:
-    print("Converting GageLoc shapefile to sqlite database ...")
-    gageLocDB = os.path.join(args.outputDir, "GageLoc.sqlite")
-    gageLoc = subprocess.check_output("%s %s -type f -iname GageLoc.shp -print" % (pathOfFind, args.outputDir,), shell=True).split()
-    assert(gageLoc)
-    gageLocShp = gageLoc[0]
-    assert(os.access(gageLocShp, os.R_OK))
-    ogrCommand = '%s -gt 65536 -f "SQLite" -t_srs "EPSG:4326" %s %s' % (pathOfFind, gageLocDB, gageLocShp)
-    returnCode = os.system(ogrCommand)
-    assert(returnCode == 0) 
+def findFiles(directory, name):
+    return subprocess.check_output("%s %s -type f -iname %s -print" % (pathOfFind, directory, name), shell=True).split()
+
+
+def unpackArchive(archive, outputDir):
+    """ Unpack NHDPlus archive into output directory
+    """
+    sevenZCommand = "%s x -y -o%s %s" % \
+        (pathOfSevenZip, outputDir, archive)
+    print sevenZCommand
+    runCommand(sevenZCommand + " > /dev/null")
+
+
+def buildGageLocDB(gageLocShp, gageLocDB):
+    """ Convert GageLoc shapefile to a spatial SQLite DB
+    """
+    # Remove existing gageLocDB
+    if os.access(gageLocDB, os.F_OK):
+        os.remove(gageLocDB)
+    
+    ogrCommand = '%s -gt 65536 -f "SQLite" -t_srs "EPSG:4326" %s %s' % (pathOfOgr, gageLocDB, gageLocShp)
+    runCommand(ogrCommand)
     
     # Index fields
     sqliteCommand = "%s %s 'CREATE INDEX IF NOT EXISTS reachcode_measure_idx on GageLoc (reachcode,measure)'" % (pathOfSqlite, gageLocDB)
-    returnCode = os.system(sqliteCommand)
-    assert(returnCode == 0)
+    runCommand(sqliteCommand)
     
     sqliteCommand = "%s %s 'CREATE INDEX IF NOT EXISTS gage_loc_source_fea_idx ON GageLoc (source_fea)'" % (pathOfSqlite, gageLocDB)
-    returnCode = os.system(sqliteCommand)
-    assert(returnCode == 0)
-    #cursor.execute("""""")
-    
+    runCommand(sqliteCommand)
 
-# 2. Find catchment shapefiles
-if not args.skipCatchment:
-    conusCatchment = os.path.join(args.outputDir, "Catchment.sqlite")
-    #print conusCatchment
 
-    # Remove existing conusCatchment
-    if os.access(conusCatchment, os.F_OK):
-        os.remove(conusCatchment)
+def mergeShapefiles(shapefiles, featureDB, layerName, options):
+    """ Merge shapefiles into a SpatiaLite feature DB with a spatial index, in a single
+        pass through a union VRT
+    """
+    # Remove existing featureDB
+    if os.access(featureDB, os.F_OK):
+        os.remove(featureDB)
+    
+    vrt = "%s%svrt" % (os.path.splitext(featureDB)[0], os.extsep)
+    writeUnionVRT(vrt, layerName, 
+                  [(file, os.path.splitext(os.path.basename(file))[0]) for file in shapefiles])
+    # Promote to multi-part geometries, as SpatiaLite requires a single geometry type per layer
+    ogrCommand = '%s -gt %d -f "SQLite" -dsco SPATIALITE=YES -lco SPATIAL_INDEX=YES -nlt PROMOTE_TO_MULTI %s -nln %s %s %s' % \
+        (pathOfOgr, OGR_TRANSACTION_SIZE, options, layerName, featureDB, vrt)
+    try:
+        runCommand(ogrCommand)
+    finally:
+        os.remove(vrt)
 
-    print("Finding catchment shapefiles")
-    shapefiles = subprocess.check_output("%s %s -type f -iname Catchment.shp -print" % (pathOfFind, args.outputDir,), shell=True).split()
-    #print shapefiles
 
-    # 3. Intersect all catchment shapefiles into one shapefile for the entire CONUS
-    print("Intersecting regional catchment shapefiles in to single CONUS catchment feature dataset ...")
-    numFiles = len(shapefiles)
-    currFile = 0
-    for file in shapefiles:
-        pctComplete = (float(currFile) / float(numFiles)) * 100
-        currFile = currFile + 1
-        ogrCommand = '%s -gt 65536 -f "SQLite" -append %s %s' % (pathOfOgr, conusCatchment, file)
-        #print ogrCommand
-        sys.stdout.write("\r\tProcessing file %d of %d (%.0f%%)" % (currFile, numFiles, pctComplete))
-        sys.stdout.flush()
-        returnCode = os.system(ogrCommand)
-        assert(returnCode == 0)
-
-    pctComplete = (float(currFile) / float(numFiles)) * 100
-    sys.stdout.write("\r\tProcessing file %d of %d (%.0f%%)\n" % (currFile, numFiles, pctComplete))
-
-    # 4. Add index to CONUS catchment
-    print "Indexing CONUS shapefile (this may take a while) ..."
+def buildCatchmentDB(shapefiles, conusCatchment):
+    """ Merge all catchment shapefiles into one feature dataset for the entire CONUS
+    """
+    mergeShapefiles(shapefiles, conusCatchment, CATCHMENT_LAYER, '')
+    
+    # Add index to CONUS catchment
     sqliteCommand = "%s %s 'CREATE INDEX IF NOT EXISTS featureid_idx on catchment (featureid)'" % (pathOfSqlite, conusCatchment)
-    returnCode = os.system(sqliteCommand)
-    assert(returnCode == 0)
+    runCommand(sqliteCommand)
+    
+    createCatchmentEnvelopeTable(conusCatchment)
 
-# 5. Create NHDPlus SQLite database to store flowline and stream gage records
-if not args.skipDB:
+
+def buildFlowlineDB(shapefiles, conusFlowline):
+    """ Merge all flowline shapefiles into one feature dataset for the entire CONUS
+    """
+    # Drop Z and M values, which are not used by network analysis
+    mergeShapefiles(shapefiles, conusFlowline, FLOWLINE_LAYER, '-dim 2')
+    
+    sqliteCommand = "%s %s 'CREATE INDEX IF NOT EXISTS comid_idx on nhdflowline (comid)'" % (pathOfSqlite, conusFlowline)
+    runCommand(sqliteCommand)
+
+
+def buildNHDPlusDB(inputs, nhdPlusDB, nhdPlusNetwork):
+    """ Create NHDPlus SQLite database to store flowline and stream gage records
+    
+        @param inputs Dict mapping each of DBF_INPUTS to a list of the paths of 
+        the DBF files of that name
+        @param nhdPlusDB String representing the path of the database to create
+        @param nhdPlusNetwork String representing the path of the network snapshot to create
+    """
     # Remove existing database if it's there
     if os.access(nhdPlusDB, os.F_OK):
         os.remove(nhdPlusDB)
-    #conn = sqlite3.connect(nhdPlusDB, isolation_level=None)
     conn = sqlite3.connect(nhdPlusDB)
-    cursor = conn.cursor()
-    
-    # Create PlusFlowlineVAA table and indices
-    cursor.execute("""CREATE TABLE IF NOT EXISTS PlusFlowlineVAA
-    (ComID INTEGER,
-    Fdate DATETIME,
-    StreamLeve INTEGER,
-    StreamOrde INTEGER,
-    StreamCalc INTEGER,
-    FromNode INTEGER,
-    ToNode INTEGER,
-    Hydroseq INTEGER,
-    LevelPathI INTEGER,
-    Pathlength REAL,
-    TerminalPa INTEGER,
-    ArbolateSu REAL,
-    Divergence INTEGER,
-    StartFlag INTEGER,
-    TerminalFl INTEGER,
-    DnLevel INTEGER,
-    ThinnerCod INTEGER,
-    UpLevelPat INTEGER,
-    UpHydroseq INTEGER,
-    DnLevelPat INTEGER,
-    DnMinorHyd INTEGER,
-    DnDrainCou INTEGER,
-    DnHydroseq INTEGER,
-    FromMeas REAL,
-    ToMeas REAL,
-    ReachCode TEXT,
-    LengthKM REAL,
-    Fcode INTEGER,
-    RtnDiv INTEGER,
-    OutDiv INTEGER,
-    DivEffect INTEGER,
-    VPUIn INTEGER,
-    VPUOut INTEGER,
-    TravTime INTEGER,
-    PathTime INTEGER,
-    AreaSqKM REAL,
-    TotDASqKM REAL,
-    DivDASqKM REAL)
-    """)
-    cursor.execute("""CREATE INDEX IF NOT EXISTS PlusFlowlineVAA_Comid_idx ON PlusFlowlineVAA (ComID)""")
-    cursor.execute("""CREATE INDEX IF NOT EXISTS PlusFlowlineVAA_Reachcode_idx ON PlusFlowlineVAA (ReachCode)""")
-    cursor.execute("""CREATE INDEX IF NOT EXISTS PlusFlowlineVAA_FromMeas_idx ON PlusFlowlineVAA (FromMeas)""")
-    cursor.execute("""CREATE INDEX IF NOT EXISTS PlusFlowlineVAA_ToMeas_idx ON PlusFlowlineVAA (ToMeas)""")
-    
-    # Create PlusFlow table and indices
-    cursor.execute("""CREATE TABLE IF NOT EXISTS PlusFlow
-    (FROMCOMID INTEGER,
-    FROMHYDSEQ INTEGER,
-    FROMLVLPAT INTEGER,
-    TOCOMID INTEGER,
-    TOHYDSEQ INTEGER,
-    TOLVLPAT INTEGER,
-    NODENUMBER INTEGER,
-    DELTALEVEL INTEGER,
-    DIRECTION INTEGER,
-    GAPDISTKM REAL,
-    HasGeo TEXT,
-    TotDASqKM REAL,
-    DivDASqKM REAL)
-    """)
-    cursor.execute("""CREATE INDEX IF NOT EXISTS plusflow_from_idx ON PlusFlow (FROMCOMID)""")
-    cursor.execute("""CREATE INDEX IF NOT EXISTS plusflow_to_idx ON PlusFlow (TOCOMID)""")
-    
-    # Create Gage_Loc table and indices
-    cursor.execute("""CREATE TABLE IF NOT EXISTS Gage_Loc
-    (ComID INTEGER,
-    EventDate DATETIME, 
-    ReachCode TEXT,
-    ReachSMDat INTEGER,
-    Reachresol TEXT,
-    FeatureCom INTEGER,
-    FeatureCla INTEGER,
-    Source_Ori TEXT,
-    Source_Dat TEXT,
-    Source_Fea TEXT,
-    Featuredet TEXT,
-    Measure REAL,
-    Offset INTEGER,
-    EventType TEXT)
-    """)
-    cursor.execute("""CREATE INDEX IF NOT EXISTS gage_loc_source_fea_idx ON Gage_Loc (Source_Fea)""")
-    cursor.execute("""CREATE INDEX IF NOT EXISTS reachcode_measure_idx on Gage_Loc (ReachCode,Measure)""")
-    
-    # Create Gage_Info table
-    # Gage_Info.GageID maps to Gage_Loc.Source_Fea
-    cursor.execute("""CREATE TABLE IF NOT EXISTS Gage_Info
-    (GageID TEXT,
-    Agency_cd TEXT,
-    Station_NM TEXT,
-    State_CD TEXT,
-    State TEXT,
-    SiteStatus TEXT,
-    DA_SQ_Mile REAL,
-    Lon_Site REAL,
-    Lat_Site REAL,
-    Lon_NHD REAL,
-    Lat_NHD REAL,
-    Reviewed TEXT)
-    """)
-    cursor.execute("""CREATE INDEX IF NOT EXISTS gage_info_gageID_idx ON Gage_Info (GageID)""")
-    
-    # Create Gage_Smooth table
-    # Gage_Smooth.SITE_NO maps to Gage_Info.GageID
-    cursor.execute("""CREATE TABLE IF NOT EXISTS Gage_Smooth
-    (SITE_NO TEXT,
-    YEAR INTEGER,
-    MO INTEGER,
-    AVE REAL,
-    COMPLETERE REAL)
-    """)
-    cursor.execute("""CREATE UNIQUE INDEX IF NOT EXISTS gage_smooth_idx ON Gage_Smooth (SITE_NO, YEAR, MO)""")
-    
-    # Create NHDReachCode_Comid table and indices
-    cursor.execute("""CREATE TABLE IF NOT EXISTS NHDReachCode_Comid
-    (COMID INTEGER,
-    REACHCODE TEXT,
-    REACHSMDAT DATETIME,
-    RESOLUTION TEXT,
-    GNIS_ID INTEGER,
-    GNIS_NAME TEXT)
-    """)
-    cursor.execute("""CREATE INDEX IF NOT EXISTS NHDReachCode_Comid_Comid_idx ON NHDReachCode_Comid (COMID)""")
-    cursor.execute("""CREATE INDEX IF NOT EXISTS NHDReachCode_Comid_Reachcode_idx ON NHDReachCode_Comid (REACHCODE)""")
-    
-    # Create NHDFlowline table and indices
-    cursor.execute("""CREATE TABLE IF NOT EXISTS NHDFlowline
-    (COMID INTEGER,
-    FDATE DATETIME,
-    RESOLUTION TEXT,
-    GNIS_ID INTEGER,
-    GNIS_NAME TEXT,
-    LENGTHKM REAL,
-    REACHCODE TEXT,
-    FLOWDIR TEXT,
-    WBAREACOMI INTEGER,
-    FTYPE TEXT,
-    FCODE INTEGER,
-    SHAPE_LENG REAL,
-    ENABLED TEXT,
-    GNIS_NBR INTEGER)
-    """)
-    cursor.execute("""CREATE INDEX IF NOT EXISTS NHDFlowline_Comid_idx ON NHDReachCode_Comid (COMID)""")
-    cursor.execute("""CREATE INDEX IF NOT EXISTS NHDFlowline_Reachcode_idx ON NHDReachCode_Comid (REACHCODE)""")
-    
-    cursor.close()
     
-    # 5. Import NHDPlus data into SQLite database
-    # Find PlusFlow.dbf files, open each, import into DB
-    print("Importing regional PlusFlowlineVAA.dbf records into CONUS database (this will take a while) ...")
-    cursor = conn.cursor()
-    dbfs = subprocess.check_output("%s %s -type f -iname PlusFlowlineVAA.dbf -print" % (pathOfFind, args.outputDir,), shell=True).split()
-    numFiles = len(dbfs)
-    currFile = 0
-    for file in dbfs:
-        #print file
-        pctComplete = (float(currFile) / float(numFiles)) * 100
-        currFile = currFile + 1
-        sys.stdout.write("\r\tProcessing file %d of %d (%.0f%%)" % (currFile, numFiles, pctComplete))
-        sys.stdout.flush()
-        f = open(file, 'rb')
-        db = list(dbfreader(f))
-        f.close()
-        records = db[2:]
-        for record in records:
-            #print record
-            cursor.execute("""INSERT INTO PlusFlowlineVAA
-    (ComID,Fdate,StreamLeve,StreamOrde,StreamCalc,FromNode,ToNode,Hydroseq,LevelPathI,Pathlength,TerminalPa,ArbolateSu,Divergence,StartFlag,TerminalFl,DnLevel,ThinnerCod,UpLevelPat,UpHydroseq,DnLevelPat,DnMinorHyd,DnDrainCou,DnHydroseq,FromMeas,ToMeas,ReachCode,LengthKM,Fcode,RtnDiv,OutDiv,DivEffect,VPUIn,VPUOut,TravTime,PathTime,AreaSqKM,TotDASqKM,DivDASqKM)
-    VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)""",
-            (record[0], record[1].strftime("%Y-%m-%d %H:%M:%S"), record[2], record[3], record[4], record[5], record[6], record[7], record[8], float(record[9]), record[10], float(record[11]), record[12], record[13], record[14], record[15], record[16], record[17], record[18], record[19], record[20], record[21], record[22], float(record[23]), float(record[24]), unicode(record[25], errors='replace'), float(record[26]), record[27], record[28], record[29], record[30], record[31], record[32], float(record[33]), float(record[34]), float(record[35]), float(record[36]), float(record[37])))
-    conn.commit()
-    cursor.close()
-    
-    pctComplete = (float(currFile) / float(numFiles)) * 100
-    sys.stdout.write("\r\tProcessing file %d of %d (%.0f%%)\n" % (currFile, numFiles, pctComplete)) 
-    
-    # Find PlusFlow.dbf files, open each, import into DB
-    print("Importing regional PlusFlow.dbf records into CONUS database (this will take a while) ...")
-    cursor = conn.cursor()
-    dbfs = subprocess.check_output("%s %s -type f -iname PlusFlow.dbf -print" % (pathOfFind, args.outputDir,), shell=True).split()
-    numFiles = len(dbfs)
-    currFile = 0
-    for file in dbfs:
-        #print file
-        pctComplete = (float(currFile) / float(numFiles)) * 100
-        currFile = currFile + 1
-        sys.stdout.write("\r\tProcessing file %d of %d (%.0f%%)" % (currFile, numFiles, pctComplete))
-        sys.stdout.flush()
-        f = open(file, 'rb')
-        db = list(dbfreader(f))
-        f.close()
-        records = db[2:]
-        for record in records:
-            #print record
-            cursor.execute("""INSERT INTO PlusFlow
-    (FROMCOMID,FROMHYDSEQ,FROMLVLPAT,TOCOMID,TOHYDSEQ,TOLVLPAT,NODENUMBER,DELTALEVEL,DIRECTION,GAPDISTKM,HasGeo,TotDASqKM,DivDASqKM)
-    VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)""",
-            (record[0], record[1], record[2], record[3], record[4], record[5], record[6], record[7], record[8], float(record[9]), record[10], float(record[11]), float(record[12])))
-    conn.commit()
-    cursor.close()
-    
-    pctComplete = (float(currFile) / float(numFiles)) * 100
-    sys.stdout.write("\r\tProcessing file %d of %d (%.0f%%)\n" % (currFile, numFiles, pctComplete)) 
+    # Create tables, deferring creation of indices until all records are loaded
+    tables = [table for (name, table) in NHDPLUS_DBF_TABLES]
+    beginBulkLoad(conn, tables)
     
-    # Find NHDReachCode_Comid.dbf files, open each, import into DB    
-    print("Importing regional NHDReachCode_Comid.dbf records into CONUS database (this will take a while) ...")
-    cursor = conn.cursor()
-    dbfs = subprocess.check_output("%s %s -type f -iname NHDReachCode_Comid.dbf -print" % (pathOfFind, args.outputDir,), shell=True).split()
-    numFiles = len(dbfs)
-    currFile = 0
-    for file in dbfs:
-        #print file
+    # Import NHDPlus data into SQLite database in one transaction
+    for (name, table) in NHDPLUS_DBF_TABLES:
+        print("Importing %s records into CONUS database (this will take a while) ..." % (name,))
+        dbfs = inputs[name]
+        numFiles = len(dbfs)
+        currFile = 0
+        for file in dbfs:
+            pctComplete = (float(currFile) / float(numFiles)) * 100
+            currFile = currFile + 1
+            sys.stdout.write("\r\tProcessing file %d of %d (%.0f%%)" % (currFile, numFiles, pctComplete))
+            sys.stdout.flush()
+            loadDBF(conn, table, file)
+        
         pctComplete = (float(currFile) / float(numFiles)) * 100
-        currFile = currFile + 1
-        sys.stdout.write("\r\tProcessing file %d of %d (%.0f%%)" % (currFile, numFiles, pctComplete))
-        sys.stdout.flush()
-        f = open(file, 'rb')
-        db = list(dbfreader(f))
-        f.close()
-        records = db[2:]
-        for record in records:
-            #print record
-            cursor.execute("""INSERT INTO NHDReachCode_Comid
-    (COMID,REACHCODE,REACHSMDAT,RESOLUTION,GNIS_ID,GNIS_NAME)
-    VALUES (?,?,?,?,?,?)""",
-            (record[0], unicode(record[1], errors='replace'), record[2].strftime("%Y-%m-%d %H:%M:%S"), unicode(record[3], errors='replace'), record[4], unicode(record[5], errors='replace')))
-    conn.commit()
-    cursor.close()
+        sys.stdout.write("\r\tProcessing file %d of %d (%.0f%%)\n" % (currFile, numFiles, pctComplete))
     
-    pctComplete = (float(currFile) / float(numFiles)) * 100
-    sys.stdout.write("\r\tProcessing file %d of %d (%.0f%%)\n" % (currFile, numFiles, pctComplete)) 
+    print("Indexing CONUS database ...")
+    endBulkLoad(conn, tables)
     
-    # Find NHDFlowline.dbf files, open each, import into DB 
-    print("Importing regional NHDFlowline.dbf records into CONUS database (this will take a while) ...")
-    cursor = conn.cursor()
-    dbfs = subprocess.check_output("%s %s -type f -iname NHDFlowline.dbf -print" % (pathOfFind, args.outputDir,), shell=True).split()
-  
-    numFiles = len(dbfs)
-    currFile = 0
-    for file in dbfs:
-        #print file
-        pctComplete = (float(currFile) / float(numFiles)) * 100
-        currFile = currFile + 1
-        sys.stdout.write("\r\tProcessing file %d of %d (%.0f%%)" % (currFile, numFiles, pctComplete))
-        sys.stdout.flush()
-        f = open(file, 'rb')
-        db = list(dbfreader(f))
-        f.close()
-        records = db[2:]
-        for record in records:
-            #print record
-            # Handle case where NHDFlowline record lacks GNIS_NBR attribute
-            try:
-                GNIS_NBR = record[13]
-            except IndexError:
-                GNIS_NBR = 0
-            cursor.execute("""INSERT INTO NHDFlowline
-    (COMID,FDATE,RESOLUTION,GNIS_ID,GNIS_NAME,LENGTHKM,REACHCODE,FLOWDIR,WBAREACOMI,FTYPE,FCODE,SHAPE_LENG,ENABLED,GNIS_NBR)
-    VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)""",
-            (record[0], record[1].strftime("%Y-%m-%d %H:%M:%S"), unicode(record[2], errors='replace'), record[3], unicode(record[4], errors='replace'), float(record[5]), unicode(record[6], errors='replace'), unicode(record[7], errors='replace'), record[8], unicode(record[9], errors='replace'), record[10], float(record[11]), unicode(record[12], errors='replace'), GNIS_NBR))
-    conn.commit()
-    cursor.close()
+    # Label PlusFlow graph with depth-first intervals so that upstream queries
+    #   can be answered with range queries
+    print("Labelling PlusFlow network with upstream intervals ...")
+    index = PlusFlowIndex.fromDatabase(conn)
+    createPlusFlowIntervalTables(conn, index)
     
-    pctComplete = (float(currFile) / float(numFiles)) * 100
-    sys.stdout.write("\r\tProcessing file %d of %d (%.0f%%)\n" % (currFile, numFiles, pctComplete)) 
+    # Save network snapshot, which network analysis can memory map instead of 
+    #   reading the PlusFlow and PlusFlowlineVAA tables
+    print("Saving network snapshot to %s ..." % (nhdPlusNetwork,))
+    saveNetworkSnapshot(nhdPlusNetwork, index, DownstreamIndex.fromDatabase(conn))
+    del index
     
-    # Find GageLoc.dbf file, import into DB 
-    print("Importing national GageLoc.dbf ...")
-    cursor = conn.cursor()
-    dbf = subprocess.check_output("%s %s -type f -iname GageLoc.dbf -print" % (pathOfFind, args.outputDir,), shell=True).split()[0]
-    assert(dbf)
-    print dbf
-    f = open(dbf, 'rb')
-    db = list(dbfreader(f))
-    f.close()
-    records = db[2:]
-    for record in records:
-        #print record
-        cursor.execute("""INSERT INTO Gage_Loc
-    (ComID,EventDate,ReachCode,ReachSMDat,Reachresol,FeatureCom,FeatureCla,Source_Ori,Source_Dat,Source_Fea,Featuredet,Measure,Offset,EventType)
-    VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)""",
-        (record[0], record[1].strftime("%Y-%m-%d %H:%M:%S"), unicode(record[2], errors='replace'), record[3], unicode(record[4], errors='replace'), record[5], record[6], unicode(record[7], errors='replace'), unicode(record[8], errors='replace'), unicode(record[9], errors='replace'), unicode(record[10], errors='replace'), float(record[11]), record[12], unicode(record[13], errors='replace')))
-    conn.commit()
-    cursor.close()
-    
-    # Find GageInfo.dbf file, import into DB 
-    print("Importing national GageInfo.dbf ...")
-    cursor = conn.cursor()
-    dbf = subprocess.check_output("%s %s -type f -iname GageInfo.dbf -print" % (pathOfFind, args.outputDir,), shell=True).split()[0]
-    assert(dbf)
-    print dbf
-    f = open(dbf, 'rb')
-    db = list(dbfreader(f))
-    f.close()
-    records = db[2:]
-    for record in records:
-        #print record
-        # Handle presence of undocumented NHD2DAGE_D field (if present)
-        if len(record) > 12:
-            cursor.execute("""INSERT INTO Gage_Info
-        (GageID,Agency_cd,Station_NM,State_CD,State,SiteStatus,DA_SQ_Mile,Lon_Site,Lat_Site,Lon_NHD,Lat_NHD,Reviewed)
-        VALUES (?,?,?,?,?,?,?,?,?,?,?,?)""",
-            (unicode(record[0],errors='replace'), unicode(record[1], errors='replace'), unicode(record[2], errors='replace'), unicode(record[3], errors='replace'), unicode(record[4], errors='replace'), unicode(record[5], errors='replace'), float(record[6]), float(record[7]), float(record[8]), float(record[9]), float(record[10]), unicode(record[12], errors='replace') ))
-        else:
-            cursor.execute("""INSERT INTO Gage_Info
-        (GageID,Agency_cd,Station_NM,State_CD,State,SiteStatus,DA_SQ_Mile,Lon_Site,Lat_Site,Lon_NHD,Lat_NHD,Reviewed)
-        VALUES (?,?,?,?,?,?,?,?,?,?,?,?)""",
-            (unicode(record[0],errors='replace'), unicode(record[1], errors='replace'), unicode(record[2], errors='replace'), unicode(record[3], errors='replace'), unicode(record[4], errors='replace'), unicode(record[5], errors='replace'), float(record[6]), float(record[7]), float(record[8]), float(record[9]), float(record[10]), unicode(record[11], errors='replace') ))
-    conn.commit()
-    cursor.close()
-    
-    # Find Gage_Smooth.DBF file, import into DB 
-    print("Importing national Gage_Smooth.DBF ...")
-    cursor = conn.cursor()
-    dbf = subprocess.check_output("%s %s -type f -iname Gage_Smooth.DBF -print" % (pathOfFind, args.outputDir,), shell=True).split()[0]
-    assert(dbf)
-    print dbf
-    f = open(dbf, 'rb')
-    db = list(dbfreader(f))
-    f.close()
-    records = db[2:]
-    for record in records:
-        #print record
-        cursor.execute("""INSERT INTO Gage_Smooth
-    (SITE_NO,YEAR,MO,AVE,COMPLETERE)
-    VALUES (?,?,?,?,?)""",
-        (unicode(record[0], errors='replace'), record[1], record[2], float(record[3]), float(record[4]) ))
-    conn.commit()
-    cursor.close()
-    
-    conn.close()
\ No newline at end of file
+    conn.close()
+
+
+def exportColumns(nhdPlusDB, nhdPlusColumns):
+    """ Export tables of NHDPlus SQLite database to columnar files
+    """
+    conn = sqlite3.connect(nhdPlusDB)
+    for table in COLUMNAR_TABLES:
+        exportTableColumns(conn, table, nhdPlusColumns)
+    conn.close()
+
+
+def reportFailures(failures):
+    for key in failures.keys():
+        sys.stderr.write("Failed to build %s:\n%s\n" % (key, failures[key]))
+    if failures:
+        sys.exit("%d step(s) failed; re-run to retry only the failed steps" % (len(failures),))
+
+
+manifest = SetupManifest.fromOutputDir(args.outputDir)
+if args.force:
+    manifest.clear('unzip')
+    manifest.clear('build')
+pool = multiprocessing.Pool(args.processes)
+
+# 0. Unpacking NHDPlus archives into output directory
+if not args.skipUnzip:
+    print("Unpacking NHDPlus archives into output directory %s" % (args.outputDir,))
+
+    # Get a list of zip files
+    zipFiles = subprocess.check_output("%s %s -type f -name *.7z -print" % (pathOfFind, args.archiveDir,), shell=True).split()
+
+    # Unpack changed zip files into output directory
+    steps = []
+    for file in zipFiles:
+        checksum = manifest.getChecksum(file)
+        if manifest.isComplete('unzip', file, checksum):
+            continue
+        manifest.clear('unzip', file)
+        steps.append( (file, checksum, unpackArchive, (file, args.outputDir)) )
+    print("\t%d of %d archives are new or changed" % (len(steps), len(zipFiles)))
+    reportFailures( runSteps(manifest, 'unzip', steps, pool) )
+
+# Find inputs of each dataset, and build datasets whose inputs have changed 
+#   since they were last built.  Datasets are independent, so are built concurrently.
+print("Computing checksums of unpacked NHDPlus data ...")
+steps = []
+
+# 5. Create NHDPlus SQLite database to store flowline and stream gage records
+if not args.skipDB:
+    inputs = {}
+    for name in DBF_INPUTS:
+        inputs[name] = findFiles(args.outputDir, name)
+        assert(inputs[name])
+    checksum = manifest.getCombinedChecksum( [f for name in DBF_INPUTS for f in inputs[name]] )
+    if not manifest.isComplete('build', nhdPlusDB, checksum) or \
+       not os.access(nhdPlusDB, os.F_OK) or not os.access(nhdPlusNetwork, os.F_OK):
+        manifest.clear('build', nhdPlusDB)
+        steps.append( (nhdPlusDB, checksum, buildNHDPlusDB, (inputs, nhdPlusDB, nhdPlusNetwork)) )
+
+# 1. Find GageLoc shapefile and convert it to a spatial SQLite DB
+if not args.skipGageLoc:
+    gageLocDB = os.path.join(args.outputDir, "GageLoc.sqlite")
+    gageLoc = findFiles(args.outputDir, 'GageLoc.shp')
+    assert(gageLoc)
+    gageLocShp = gageLoc[0]
+    assert(os.access(gageLocShp, os.R_OK))
+    checksum = manifest.getCombinedChecksum( getShapefileComponents(gageLocShp) )
+    if not manifest.isComplete('build', gageLocDB, checksum) or not os.access(gageLocDB, os.F_OK):
+        manifest.clear('build', gageLocDB)
+        steps.append( (gageLocDB, checksum, buildGageLocDB, (gageLocShp, gageLocDB)) )
+
+# 2. Find catchment shapefiles and merge them into one feature dataset for the entire CONUS
+if not args.skipCatchment:
+    conusCatchment = os.path.join(args.outputDir, "Catchment.sqlite")
+    shapefiles = findFiles(args.outputDir, 'Catchment.shp')
+    checksum = manifest.getCombinedChecksum( [c for s in shapefiles for c in getShapefileComponents(s)] )
+    if not manifest.isComplete('build', conusCatchment, checksum) or not os.access(conusCatchment, os.F_OK):
+        manifest.clear('build', conusCatchment)
+        steps.append( (conusCatchment, checksum, buildCatchmentDB, (shapefiles, conusCatchment)) )
+
+# Merge flowline shapefiles into one flowline feature dataset for the entire CONUS
+if not args.skipFlowline:
+    conusFlowline = os.path.join(args.outputDir, "Flowline.sqlite")
+    shapefiles = findFiles(args.outputDir, 'NHDFlowline.shp')
+    checksum = manifest.getCombinedChecksum( [c for s in shapefiles for c in getShapefileComponents(s)] )
+    if not manifest.isComplete('build', conusFlowline, checksum) or not os.access(conusFlowline, os.F_OK):
+        manifest.clear('build', conusFlowline)
+        steps.append( (conusFlowline, checksum, buildFlowlineDB, (shapefiles, conusFlowline)) )
+
+print("Building %d dataset(s) whose inputs are new or changed (this will take a while) ..." % (len(steps),))
+for step in steps:
+    print("\t%s" % (step[0],))
+reportFailures( runSteps(manifest, 'build', steps, pool) )
+
+# Export tables from NHDPlus database, if it has changed since they were last exported
+if args.columnar:
+    checksum = manifest.getChecksum(nhdPlusDB)
+    if not manifest.isComplete('build', nhdPlusColumns, checksum):
+        manifest.clear('build', nhdPlusColumns)
+        print("Exporting NHDPlus tables to columnar files in %s ..." % (nhdPlusColumns,))
+        reportFailures( runSteps(manifest, 'build', 
+                                 [(nhdPlusColumns, checksum, exportColumns, (nhdPlusDB, nhdPlusColumns))], 
+                                 pool) )
+
+pool.close()
+pool.join()
+manifest.close()
@@ -36,7 +36,6 @@ OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 @author Brian Miles <brian_miles@unc.edu>
 """
 import os, errno
-import re
 import httplib
 from pyspatialite import dbapi2 as spatialite
 
@@ -47,6 +46,20 @@ URL_PROTO = '/pub/data/ghcn/daily/all/{station_id}.dly'
 
 _SRS = int(4326)
 _BUFF_LEN = 4096 * 10
+# Spatialite R-tree of station coordinates, created by GHCNDSetup
+_SPATIAL_INDEX = 'idx_ghcn_station_coord'
+# Half-width, in decimal degrees, of the first window searched for nearest stations
+_INITIAL_SEARCH_RADIUS = 0.25
+# Half-width of a window containing all stations
+_MAX_SEARCH_RADIUS = 360.0
+
+
+def _hasSpatialIndex(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (_SPATIAL_INDEX,))
+    hasIndex = cursor.fetchone() is not None
+    cursor.close()
+    return hasIndex
 
 
 def findStationsWithinBoundingBox(config, bbox):
@@ -76,26 +89,88 @@ def findStationsWithinBoundingBox(config, bbox):
         @endcode 
     """
     stations = []
-    pattern = re.compile("^POINT\((-?\d+\.?\d*) (-?\d+\.?\d*)\)$")
     
     ghcnDB = config.get('GHCND', 'PATH_OF_STATION_DB')
     
     conn = spatialite.connect(ghcnDB)
     cursor = conn.cursor()
-    # Spatialite/SQLite3 won't subsitute parameter strings within quotes, so we have to do it the unsafe way.  This should be okay as
-    # we are dealing with numeric values that we are converting to numeric types before building the query string.
-    sql = u"SELECT id,AsText(coord),elevation_m,name FROM ghcn_station WHERE Within(coord, BuildMbr(%f,%f,%f,%f));" %\
-    (bbox['minX'], bbox['minY'], bbox['maxX'], bbox['maxY'])
-    cursor.execute(sql)
+    sql = u"SELECT id,X(coord),Y(coord),elevation_m,name FROM ghcn_station WHERE Within(coord, BuildMbr(?,?,?,?))"
+    params = [bbox['minX'], bbox['minY'], bbox['maxX'], bbox['maxY']]
+    if _hasSpatialIndex(conn):
+        # Only test stations whose index entries overlap the bounding box.  Index entries
+        #   are rounded outward, so may extend beyond the bounding box; Within is exact.
+        sql += u" AND ROWID IN (SELECT pkid FROM %s WHERE xmax>=? AND xmin<=? AND ymax>=? AND ymin<=?)" % \
+            (_SPATIAL_INDEX,)
+        params += [bbox['minX'], bbox['maxX'], bbox['minY'], bbox['maxY']]
+    cursor.execute(sql, [float(param) for param in params])
     results = cursor.fetchall()
     conn.close()
     for result in results:
-        # Unpack the coordinates
-        match = pattern.match(result[1])
-        assert(match)
-        lon = float(match.group(1))
-        lat = float(match.group(2))
-        stations.append([result[0], lat, lon, result[2], result[3]])
+        stations.append([result[0], result[2], result[1], result[3], result[4]])
+    return stations
+
+
+def _findStationsNearestToCoordinates(conn, hasSpatialIndex, longitude, latitude, k):
+    """ Find the k stations nearest to coordinates.  If the station table has a 
+        spatial index, stations are searched for within a window around the coordinates, 
+        which is doubled in size until it contains the k nearest stations.
+        
+        @return List of tuples of the form (station_id, longitude, latitude, 
+        elevation_meters, name, distance), ordered by distance
+    """
+    longitude = float(longitude)
+    latitude = float(latitude)
+    cursor = conn.cursor()
+    sql = u"SELECT id,X(coord),Y(coord),elevation_m,name,Distance(MakePoint(?, ?, %d), coord) AS dist FROM ghcn_station" % \
+        (_SRS,)
+    if not hasSpatialIndex:
+        cursor.execute(sql + u" ORDER BY dist ASC LIMIT ?", (longitude, latitude, k))
+        stations = cursor.fetchall()
+        cursor.close()
+        return stations
+    
+    sql += u" WHERE ROWID IN (SELECT pkid FROM %s WHERE xmin<=? AND xmax>=? AND ymin<=? AND ymax>=?) ORDER BY dist ASC LIMIT ?" % \
+        (_SPATIAL_INDEX,)
+    radius = _INITIAL_SEARCH_RADIUS
+    while True:
+        cursor.execute(sql, (longitude, latitude, 
+                             longitude + radius, longitude - radius, latitude + radius, latitude - radius, k))
+        stations = cursor.fetchall()
+        # Stations outside of the window are further away than radius, so the 
+        #   stations found are nearest if the furthest of them is within radius.
+        if (len(stations) == k and stations[-1][5] <= radius) or radius >= _MAX_SEARCH_RADIUS:
+            break
+        radius *= 2
+    cursor.close()
+    return stations
+
+
+def findStationsNearestToCoordinates(config, coordinates, k=1):
+    """ Find the stations nearest to each of a set of coordinates using the spatial 
+        index of the station database.  Distances are measured in decimal degrees.
+        
+        @param config ConfigParser containing the section 'GHCND' and option 
+        'PATH_OF_STATION_DB'
+        @param coordinates List of tuples of the form (longitude, latitude), in WGS84
+        @param k Integer representing the number of stations to find for each coordinate
+        
+        @return List, with one item per coordinate, of lists of up to k tuples of 
+        the form (station_id, longitude, latitude, elevation_meters, name, distance),
+        ordered by distance.
+        
+        @code
+        from ecohydrolib.climatedata.ghcndquery import findStationsNearestToCoordinates
+        centroids = [(-76.7443397486, 39.2955590994), (-79.0558, 35.9132)]
+        nearest = [stations[0] for stations in findStationsNearestToCoordinates(config, centroids)]
+        @endcode
+    """
+    ghcnDB = config.get('GHCND', 'PATH_OF_STATION_DB')
+    
+    conn = spatialite.connect(ghcnDB)
+    hasSpatialIndex = _hasSpatialIndex(conn)
+    stations = [_findStationsNearestToCoordinates(conn, hasSpatialIndex, longitude, latitude, k) \
+                for (longitude, latitude) in coordinates]
+    conn.close()
     return stations
 
 
@@ -124,25 +199,9 @@ def findStationNearestToCoordinates(config, longitude, latitude):
         getClimateDataForStation(config, outputDir, outfileName, nearest[0])
         @endcode
     """
-    ghcnDB = config.get('GHCND', 'PATH_OF_STATION_DB')
-    
-    conn = spatialite.connect(ghcnDB)
-    cursor = conn.cursor()
-    # Spatialite/SQLite3 won't subsitute parameter strings within quotes, so we have to do it the unsafe way.  This should be okay as
-    # we are dealing with numeric values that we are converting to numeric types before building the query string.
-    sql = u"SELECT id,AsText(coord),elevation_m,name,Distance(GeomFromText('POINT(%f %f)', %d), coord) as dist FROM ghcn_station order by dist asc limit 1" %\
-    (float(longitude), float(latitude), _SRS)
-    cursor.execute(sql)
-    nearest = cursor.fetchone()
-    conn.close()
-    if nearest:
-        # Unpack the coordinates
-        pattern = re.compile("^POINT\((-?\d+\.\d+) (-?\d+\.\d+)\)$")
-        match = pattern.match(nearest[1])
-        assert(match)
-        lon = float(match.group(1))
-        lat = float(match.group(2))
-        return (nearest[0], lon, lat, nearest[2], nearest[3], nearest[4])
+    stations = findStationsNearestToCoordinates(config, [(longitude, latitude)])[0]
+    if stations:
+        return tuple(stations[0])
     return None
     
 
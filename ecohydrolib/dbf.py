@@ -37,95 +37,179 @@ OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 import struct, datetime, decimal, itertools
 
-def dbfreader(f):
+import numpy as np
+
+# Number of records dbfarray decodes at a time
+DECODE_CHUNK_SIZE = 65536
+# Number of records dbfreader reads from the file at a time
+READ_BLOCK_SIZE = 1024
+# Number of records dbfwriter formats before writing them
+WRITE_BLOCK_SIZE = 4096
+# Number of records dbfwritearrays formats before writing them
+ARRAY_WRITE_BLOCK_SIZE = 65536
+# Widest integer field dbfarray decodes arithmetically (larger fields may overflow int64)
+MAX_INTEGER_FIELD_SIZE = 18
+
+def _decodeNumeric(value):
+    value = value.replace('\0', '').lstrip()
+    if value == '':
+        return 0
+    return int(value)
+
+def _decodeDecimal(value):
+    value = value.replace('\0', '').lstrip()
+    if value == '':
+        return 0
+    return decimal.Decimal(value)
+
+def _decodeDate(value):
+    value = value.lstrip() # Catch empty fields
+    if value != '':
+        y, m, d = int(value[:4]), int(value[4:6]), int(value[6:8])
+        return datetime.date(y, m, d)
+    return datetime.date(1900, 1, 1) # An empty date
+
+def _decodeLogical(value):
+    return (value in 'YyTt' and 'T') or (value in 'NnFf' and 'F') or '?'
+
+def _decodeCharacter(value):
+    return value.strip()
+
+def _getDecoder(typ, deci):
+    if typ == "N":
+        if deci:
+            return _decodeDecimal
+        return _decodeNumeric
+    elif typ == 'D':
+        return _decodeDate
+    elif typ == 'L':
+        return _decodeLogical
+    elif typ == 'F':
+        return float
+    elif typ == 'C':
+        return _decodeCharacter
+    return None
+
+
+def _selectFields(fields, fieldnames):
+    """ Select fields by name, and determine their offsets within records
+    
+        @return List of tuples of the form (name, type, size, decimal places, offset)
+        
+        @raise KeyError if a field in fieldnames is not in fields
+    """
+    offset = 1 # Deletion flag
+    byName = {}
+    for (name, typ, size, deci) in fields:
+        byName[name] = (name, typ, size, deci, offset)
+        offset += size
+    if fieldnames is None:
+        fieldnames = [field[0] for field in fields]
+    try:
+        return [byName[name] for name in fieldnames]
+    except KeyError, e:
+        raise KeyError("DBF file has no field %s" % (e.args[0],))
+
+
+def dbfreader(f, fieldnames=None, start=0, stop=None):
     """ Returns an iterator over records in a Xbase DBF file.
 
         @param f A file descriptor
+        @param fieldnames List of names of fields to read, in the order they should be
+        returned; if None, all fields will be read.  Only the bytes of these fields are
+        decoded.
+        @param start Integer representing the index of the first record to read
+        @param stop Integer representing the index of the record after the last record 
+        to read; if None, records will be read to the end of the file
         @return An iterator of records in the file
     
         The first row returned contains the field names.
         The second row contains field specs: (type, size, decimal places).
         Subsequent rows contain the data records.
-        If a record is marked as deleted, it is skipped.
+        If a record is marked as deleted, it is skipped.  Record indices count deleted
+        records, so that a file can be split into ranges of records by offset (see 
+        dbfranges).
     
-        File should be opened for binary reads.
+        File should be opened for binary reads.  If start is not 0, the file must 
+        support seek.
+        
+        @raise KeyError if a field in fieldnames is not in the file
     """
     # See DBF format spec at:
     #     http://www.pgts.com.au/download/public/xbase.htm#DBF_STRUCT
 
-    numrec, lenheader = struct.unpack('<xxxxLH22x', f.read(32))    
-    numfields = (lenheader - 33) // 32
-
-    fields = []
-    for fieldno in xrange(numfields):
-        name, typ, size, deci = struct.unpack('<11sc4xBB14x', f.read(32))
-        name = name.replace('\0', '')       # eliminate NULs from string   
-        fields.append((name, typ, size, deci))
-    yield [field[0] for field in fields]
-    yield [tuple(field[1:]) for field in fields]
+    numrec, lenheader, lenrecord, fields = dbfheader(f)
+    selected = _selectFields(fields, fieldnames)
+    yield [field[0] for field in selected]
+    yield [tuple(field[1:4]) for field in selected]
 
     terminator = f.read(1)
     assert terminator == '\r'
 
-    fields.insert(0, ('DeletionFlag', 'C', 1, 0))
-    fmt = ''.join(['%ds' % fieldinfo[2] for fieldinfo in fields])
     #fmt = ''.join(['%ds' % (fieldinfo[2] + (fieldinfo[3] * 256)) for fieldinfo in fields]) # Support fields with lengths greater than 255?
-    fmtsiz = struct.calcsize(fmt)
-    for i in xrange(numrec):
-        record = struct.unpack(fmt, f.read(fmtsiz))
-        if record[0] != ' ':
-            continue                        # deleted record
-        result = []
-        for (name, typ, size, deci), value in itertools.izip(fields, record):
-            if name == 'DeletionFlag':
-                continue
-            if typ == "N":
-                value = value.replace('\0', '').lstrip()
-                if value == '':
-                    value = 0
-                elif deci:
-                    value = decimal.Decimal(value)
-                else:
-                    value = int(value)
-            elif typ == 'D':
-                value = value.lstrip() # Catch empty fields
-                if value != '':
-                    y, m, d = int(value[:4]), int(value[4:6]), int(value[6:8])
-                    value = datetime.date(y, m, d)
-                else:
-                    value = datetime.date(1900, 1, 1) # An empty date
-            elif typ == 'L':
-                value = (value in 'YyTt' and 'T') or (value in 'NnFf' and 'F') or '?'
-            elif typ == 'F':
-                value = float(value)
-            elif typ == 'C':
-                #value = value.lstrip()
-                value = value.strip()
-            result.append(value)
-        yield result
+    lenrecord = max(lenrecord, sum([field[2] for field in fields]) + 1)
+    if stop is None or stop > numrec:
+        stop = numrec
+    if start > 0:
+        f.seek(lenheader + start * lenrecord)
+    
+    # Decode only the bytes of selected fields
+    slices = [(_getDecoder(typ, deci), offset, offset + size) for (name, typ, size, deci, offset) in selected]
+    i = start
+    while i < stop:
+        numRecords = min(READ_BLOCK_SIZE, stop - i)
+        block = f.read(numRecords * lenrecord)
+        for recordStart in xrange(0, numRecords * lenrecord, lenrecord):
+            if block[recordStart] != ' ':
+                continue                        # deleted record
+            yield [decode(block[recordStart+begin:recordStart+end]) for (decode, begin, end) in slices]
+        i += numRecords
 
 
-def dbfwriter(f, fieldnames, fieldspecs, records):
-    """ Return a string suitable for writing directly to a binary dbf file.
+def dbfchunks(f, chunksize, fieldnames=None, start=0, stop=None):
+    """ Returns an iterator over chunks of records in a Xbase DBF file, for streaming 
+        records with bounded memory.
+        
+        @param f A file descriptor
+        @param chunksize Integer representing the maximum number of records per chunk
+        @param fieldnames List of names of fields to read (see dbfreader)
+        @param start Integer representing the index of the first record to read
+        @param stop Integer representing the index of the record after the last record 
+        to read; if None, records will be read to the end of the file
+        @return An iterator of chunks of records in the file
+        
+        The first item returned contains the field names.
+        The second item contains field specs: (type, size, decimal places).
+        Subsequent items are lists of up to chunksize records.
+    """
+    records = dbfreader(f, fieldnames, start, stop)
+    yield records.next()
+    yield records.next()
+    chunk = list(itertools.islice(records, chunksize))
+    while chunk:
+        yield chunk
+        chunk = list(itertools.islice(records, chunksize))
 
-        @param f File descriptor, should be open for writing in a binary mode.
-        @param fieldnames List of field names, should be no longer than ten characters and not include \x00.
-        @param fieldspecs List of field specifications, in the form (type, size, deci) where
-            type is one of:
-                C for ascii character data
-                M for ascii character memo data (real memo fields not supported)
-                D for datetime objects
-                N for ints or decimal objects
-                L for logical values 'T', 'F', or '?'
-            size is the field width
-            deci is the number of decimal places in the provided decimal object
-        @param records An iterable over the records (sequences of field values).
+
+def dbfranges(f, numparts):
+    """ Split the records of a Xbase DBF file into contiguous ranges, so that 
+        the records of one file can be read by several processes (see dbfreader)
+        
+        @param f A file descriptor, positioned at the start of the file
+        @param numparts Integer representing the number of ranges to split the file into
+        @return List of tuples of the form (start, stop).  Ranges hold similar numbers
+        of records, including deleted records.
     """
-    # header info
+    numrec = dbfheader(f)[0]
+    numparts = max(1, min(numparts, numrec))
+    bounds = [(numrec * part) // numparts for part in xrange(numparts + 1)]
+    return zip(bounds[:-1], bounds[1:])
+
+
+def _writeheader(f, fieldnames, fieldspecs, numrec):
     ver = 3
     now = datetime.datetime.now()
     yr, mon, day = now.year-1900, now.month, now.day
-    numrec = len(records)
     numfields = len(fieldspecs)
     lenheader = numfields * 32 + 33
     lenrecord = sum(field[1] for field in fieldspecs) + 1
@@ -140,24 +224,385 @@ def dbfwriter(f, fieldnames, fieldspecs, records):
 
     # terminator
     f.write('\r')
+    return lenrecord
+
+
+def _getFormatter(typ, size):
+    if typ == "N":
+        def format(value):
+            value = str(value).rjust(size, ' ')
+            assert len(value) == size
+            return value
+    elif typ == 'D':
+        def format(value):
+            return value.strftime('%Y%m%d')
+    elif typ == 'L':
+        def format(value):
+            return str(value)[0].upper()
+    else:
+        def format(value):
+            value = str(value)[:size].ljust(size, ' ')
+            assert len(value) == size
+            return value
+    return format
+
+
+def dbfwriter(f, fieldnames, fieldspecs, records):
+    """ Return a string suitable for writing directly to a binary dbf file.
+
+        @param f File descriptor, should be open for writing in a binary mode.
+        @param fieldnames List of field names, should be no longer than ten characters and not include \x00.
+        @param fieldspecs List of field specifications, in the form (type, size, deci) where
+            type is one of:
+                C for ascii character data
+                M for ascii character memo data (real memo fields not supported)
+                D for datetime objects
+                N for ints or decimal objects
+                L for logical values 'T', 'F', or '?'
+            size is the field width
+            deci is the number of decimal places in the provided decimal object
+        @param records An iterable over the records (sequences of field values).  If 
+            records has no length (e.g. a generator), f must support seek and tell, as 
+            the number of records will be written to the header once all records have 
+            been written.
+        
+        Records are formatted into buffers of WRITE_BLOCK_SIZE records, which are 
+        written with a single write.  To write columns held in numpy arrays, see 
+        dbfwritearrays.
+    """
+    # header info
+    try:
+        numrec = len(records)
+    except TypeError:
+        numrec = None
+        headerStart = f.tell()
+    _writeheader(f, fieldnames, fieldspecs, numrec or 0)
 
     # records
+    formatters = [_getFormatter(typ, size) for (typ, size, deci) in fieldspecs]
+    count = 0
+    buf = []
     for record in records:
-        f.write(' ')                        # deletion flag
-        for (typ, size, deci), value in itertools.izip(fieldspecs, record):
-            if typ == "N":
-                value = str(value).rjust(size, ' ')
-            elif typ == 'D':
-                value = value.strftime('%Y%m%d')
-            elif typ == 'L':
-                value = str(value)[0].upper()
-            else:
-                value = str(value)[:size].ljust(size, ' ')
-            assert len(value) == size
-            f.write(value)
+        buf.append(' ')                        # deletion flag
+        buf.extend([format(value) for format, value in itertools.izip(formatters, record)])
+        count += 1
+        if count % WRITE_BLOCK_SIZE == 0:
+            f.write(''.join(buf))
+            buf = []
+    f.write(''.join(buf))
 
     # End of file
     f.write('\x1A')
+    
+    if numrec is None:
+        # Patch number of records in header
+        end = f.tell()
+        f.seek(headerStart + 4)
+        f.write(struct.pack('<L', count))
+        f.seek(end)
+    else:
+        assert count == numrec
+
+
+def _toCharMatrix(values):
+    """ View an array of fixed-width strings as a 2-D array of characters """
+    values = np.ascontiguousarray(values)
+    return values.view(np.uint8).reshape(len(values), values.dtype.itemsize)
+
+
+def _justify(name, values, size, right):
+    """ Justify strings in a field of size characters, padding with spaces
+    
+        @return 2-D numpy array of characters with size columns
+        
+        @raise ValueError if a value is longer than size
+    """
+    chars = _toCharMatrix(values)
+    lengths = (chars != 0).sum(axis=1)
+    if (lengths > size).any():
+        raise ValueError("Values of field %s do not fit in %d characters" % (name, size))
+    out = np.empty((len(chars), size), dtype=np.uint8)
+    out.fill(ord(' '))
+    valid = chars != 0
+    columns = np.arange(chars.shape[1])[np.newaxis, :]
+    if right:
+        columns = columns + (size - lengths)[:, np.newaxis]
+    else:
+        columns = np.repeat(columns, len(chars), axis=0)
+    out[np.nonzero(valid)[0], columns[valid]] = chars[valid]
+    return out
+
+
+def _formatIntegers(name, values, size):
+    """ Right justify integers in a field of size characters
+    
+        @return 2-D numpy array of characters with size columns
+        
+        @raise ValueError if a value is not an integer
+    """
+    values = np.asarray(values)
+    if values.dtype.kind == 'f':
+        # Do not silently truncate fractional values
+        integral = np.isfinite(values)
+        integral[integral] = np.floor(values[integral]) == values[integral]
+        if not integral.all():
+            raise ValueError("Values of field %s are not integers" % (name,))
+    values = values.astype(np.int64)
+    out = np.empty((len(values), size), dtype=np.uint8)
+    out.fill(ord(' '))
+    negative = values < 0
+    remainder = np.abs(values)
+    numDigits = np.zeros(len(values), dtype=np.int64)
+    for position in xrange(size - 1, -1, -1):
+        write = (remainder > 0) | (position == size - 1)
+        out[write, position] = ord('0') + (remainder[write] % 10)
+        numDigits += write
+        remainder //= 10
+    if (remainder > 0).any() or (numDigits[negative] >= size).any():
+        raise ValueError("Values of field %s do not fit in %d characters" % (name, size))
+    out[np.flatnonzero(negative), size - 1 - numDigits[negative]] = ord('-')
+    return out
+
+
+def _formatDates(values):
+    """ Format dates as YYYYMMDD.  NaT is written as a blank date.
+    
+        @return 2-D numpy array of characters with 8 columns
+    """
+    values = np.asarray(values, dtype='datetime64[D]')
+    months = values.astype('datetime64[M]')
+    years = values.astype('datetime64[Y]').astype(np.int64) + 1970
+    days = (values - months).astype(np.int64) + 1
+    months = months.astype(np.int64) % 12 + 1
+    out = np.empty((len(values), 8), dtype=np.uint8)
+    for (column, number, width) in [(0, years, 4), (4, months, 2), (6, days, 2)]:
+        for i in xrange(width):
+            out[:, column + i] = ord('0') + (number // 10 ** (width - 1 - i)) % 10
+    out[np.isnat(values)] = ord(' ')
+    return out
+
+
+def _formatColumn(name, values, typ, size, deci):
+    """ Format a batch of values of a field for writing to a DBF file
+    
+        @return 2-D numpy array of characters with size columns
+        
+        @raise ValueError if a value is too wide for the field
+    """
+    if typ in 'NF':
+        if deci:
+            return _justify(name, np.char.mod('%%.%df' % (deci,), np.asarray(values, dtype=np.float64)), 
+                            size, True)
+        return _formatIntegers(name, values, size)
+    elif typ == 'D':
+        return _formatDates(values)
+    elif typ == 'L':
+        chars = _toCharMatrix(np.asarray(values).astype('S1')).copy()
+        lower = (chars >= ord('a')) & (chars <= ord('z'))
+        chars[lower] -= ord('a') - ord('A')
+        chars[chars == 0] = ord(' ')
+        return chars
+    # Truncate character data to field width
+    return _justify(name, np.asarray(values).astype('S%d' % (size,)), size, False)
+
+
+def dbfwritearrays(f, fieldnames, fieldspecs, columns):
+    """ Write columns of numpy arrays to a binary dbf file.  Values are formatted a 
+        column at a time, and records are assembled into large buffers before being
+        written, so this is much faster than dbfwriter for large numbers of records.
+
+        @param f File descriptor, should be open for writing in a binary mode.
+        @param fieldnames List of field names, should be no longer than ten characters and not include \x00.
+        @param fieldspecs List of field specifications, in the form (type, size, deci) 
+            (see dbfwriter).  N and F fields with decimal places are written with deci 
+            decimal places; N and F fields without decimal places must contain integers;
+            D fields are read as numpy datetime64.
+        @param columns List of numpy arrays (or sequences), one per field, each of the
+            same length, or a numpy structured array with fields named in fieldnames.
+        
+        @raise ValueError if columns are of different lengths, if a value is too wide 
+        for its field, or if a value of a field without decimal places is not an integer
+    """
+    if isinstance(columns, np.ndarray) and columns.dtype.names:
+        columns = [columns[name] for name in fieldnames]
+    numrec = len(columns[0]) if columns else 0
+    for column in columns:
+        if len(column) != numrec:
+            raise ValueError("Columns must be of the same length")
+    
+    lenrecord = _writeheader(f, fieldnames, fieldspecs, numrec)
+    
+    # records
+    for start in xrange(0, numrec, ARRAY_WRITE_BLOCK_SIZE):
+        stop = min(start + ARRAY_WRITE_BLOCK_SIZE, numrec)
+        buf = np.empty((stop - start, lenrecord), dtype=np.uint8)
+        buf.fill(ord(' '))                    # deletion flag and padding
+        offset = 1
+        for name, (typ, size, deci), column in itertools.izip(fieldnames, fieldspecs, columns):
+            buf[:, offset:offset+size] = _formatColumn(name, column[start:stop], typ, size, deci)
+            offset += size
+        f.write(buf.tostring())
+    
+    # End of file
+    f.write('\x1A')
+
+
+def dbfheader(f):
+    """ Read the header of an Xbase DBF file.
+    
+        @param f A file descriptor, positioned at the start of the file
+        @return A tuple (numrec, lenheader, lenrecord, fields), where fields is a list of
+        tuples of the form (name, type, size, decimal places).  Records begin lenheader 
+        bytes from the start of the file.
+    """
+    numrec, lenheader, lenrecord = struct.unpack('<xxxxLHH20x', f.read(32))
+    numfields = (lenheader - 33) // 32
+
+    fields = []
+    for fieldno in xrange(numfields):
+        name, typ, size, deci = struct.unpack('<11sc4xBB14x', f.read(32))
+        name = name.replace('\0', '')       # eliminate NULs from string   
+        fields.append((name, typ, size, deci))
+    return (numrec, lenheader, lenrecord, fields)
+
+
+def dbfrecords(f, mmap=True):
+    """ Returns the undecoded records of an Xbase DBF file as a numpy structured array.
+    
+        @param f A file name, or a file descriptor opened for binary reads
+        @param mmap Boolean, True if the records should be memory mapped rather than read
+        @return A tuple (fields, records), where fields is a list of tuples of the form
+        (name, type, size, decimal places), and records is a numpy structured array with
+        one fixed-width string field per DBF field, preceded by 'DeletionFlag'.  Records
+        marked as deleted are included.
+    """
+    if isinstance(f, basestring):
+        fp = open(f, 'rb')
+    else:
+        fp = f
+        fp.seek(0)
+    try:
+        numrec, lenheader, lenrecord, fields = dbfheader(fp)
+        names = ['DeletionFlag']
+        formats = ['S1']
+        offsets = [0]
+        offset = 1
+        for (name, typ, size, deci) in fields:
+            names.append(name)
+            formats.append('S%d' % size)
+            offsets.append(offset)
+            offset += size
+        dtype = np.dtype({'names': names, 'formats': formats, 'offsets': offsets, 
+                          'itemsize': max(lenrecord, offset)})
+        if mmap:
+            records = np.memmap(fp, dtype=dtype, mode='r', offset=lenheader, shape=(numrec,))
+        else:
+            fp.seek(lenheader)
+            records = np.frombuffer(fp.read(numrec * dtype.itemsize), dtype=dtype)
+    finally:
+        if fp is not f:
+            fp.close()
+    return (fields, records)
+
+
+def _getArrayType(typ, size, deci):
+    if typ == 'N':
+        if deci or size > MAX_INTEGER_FIELD_SIZE:
+            return np.float64
+        return np.int64
+    elif typ == 'F':
+        return np.float64
+    elif typ == 'D':
+        return 'datetime64[D]'
+    elif typ == 'L':
+        return 'S1'
+    return 'S%d' % size
+
+
+def _decodeDigits(chars):
+    """ Decode right-aligned integers from a 2-D array of ASCII characters.  Characters 
+        other than digits and '-' are ignored, so blank fields decode as 0.
+    """
+    isDigit = (chars >= ord('0')) & (chars <= ord('9'))
+    digits = np.where(isDigit, chars - ord('0'), 0).astype(np.int64)
+    # Place value of each digit is the number of digits to its right
+    places = np.cumsum(isDigit[:, ::-1], axis=1)[:, ::-1] - isDigit
+    values = (digits * (10 ** np.minimum(places, MAX_INTEGER_FIELD_SIZE))).sum(axis=1)
+    negative = (chars == ord('-')).any(axis=1)
+    values[negative] = -values[negative]
+    return values
+
+
+def _decodeField(raw, typ, size, deci):
+    """ Decode a batch of values of a DBF field
+    
+        @param raw numpy array of fixed-width strings holding the values of the field
+        @return numpy array of decoded values, with the type given by _getArrayType
+    """
+    if typ == 'C':
+        return np.char.strip(raw)
+    elif typ == 'L':
+        values = np.empty(raw.shape, dtype='S1')
+        values.fill('?')
+        first = np.char.lstrip(raw).astype('S1')
+        values[np.char.find('YyTt', first) >= 0] = 'T'
+        values[np.char.find('NnFf', first) >= 0] = 'F'
+        values[first == ''] = '?'
+        return values
+    
+    chars = np.ascontiguousarray(raw).view(np.uint8).reshape(len(raw), raw.dtype.itemsize)
+    if typ == 'D':
+        # Empty dates decode as 1900-01-01, as in dbfreader
+        digits = chars.astype(np.int64) - ord('0')
+        empty = (chars[:, 0] == ord(' ')) | (chars[:, 0] == 0)
+        digits[empty] = [1, 9, 0, 0, 0, 1, 0, 1]
+        years = digits[:, 0] * 1000 + digits[:, 1] * 100 + digits[:, 2] * 10 + digits[:, 3]
+        months = digits[:, 4] * 10 + digits[:, 5]
+        days = digits[:, 6] * 10 + digits[:, 7]
+        return ((years - 1970).astype('datetime64[Y]') + (months - 1).astype('timedelta64[M]')).astype('datetime64[D]') + \
+            (days - 1).astype('timedelta64[D]')
+    elif typ == 'N' and not deci and size <= MAX_INTEGER_FIELD_SIZE:
+        return _decodeDigits(chars)
+    
+    # Floating point, possibly with exponents; blank fields decode as 0
+    values = np.char.strip(np.char.replace(raw, '\0', ''))
+    values[values == ''] = '0'
+    return values.astype(np.float64)
+
+
+def dbfarray(f, fieldnames=None, mmap=True, chunksize=DECODE_CHUNK_SIZE):
+    """ Returns the records of an Xbase DBF file as a numpy structured array.
+    
+        Records are memory mapped and decoded chunksize records at a time using 
+        vectorized operations, which is much faster, and uses much less memory, than
+        dbfreader for large files.  Numeric fields are decoded as int64 (fields without
+        decimal places) or float64 (rather than decimal.Decimal), date fields as 
+        datetime64[D], logical fields as 'T', 'F', or '?', and character fields as 
+        strings stripped of surrounding white space.  As in dbfreader, blank numeric 
+        fields decode as 0 and blank dates as 1900-01-01.  Records marked as deleted 
+        are skipped.
+
+        @param f A file name, or a file descriptor opened for binary reads
+        @param fieldnames List of names of fields to decode; if None, all fields will be decoded
+        @param mmap Boolean, True if the file should be memory mapped rather than read
+        @param chunksize Integer representing the number of records to decode at a time
+        @return A tuple (fieldspecs, records), where fieldspecs is a list of tuples of the
+        form (type, size, decimal places) for the decoded fields, and records is a numpy 
+        structured array with one field per decoded DBF field
+        
+        @raise KeyError if a field in fieldnames is not in the file
+    """
+    fields, raw = dbfrecords(f, mmap)
+    fields = [field[:4] for field in _selectFields(fields, fieldnames)]
+    
+    keep = np.flatnonzero(raw['DeletionFlag'] == ' ')
+    dtype = np.dtype([(name, _getArrayType(typ, size, deci)) for (name, typ, size, deci) in fields])
+    records = np.empty(len(keep), dtype=dtype)
+    for start in xrange(0, len(keep), chunksize):
+        rows = keep[start:start+chunksize]
+        for (name, typ, size, deci) in fields:
+            records[name][start:start+len(rows)] = _decodeField(raw[name][rows], typ, size, deci)
+    return ([field[1:] for field in fields], records)
 
 
 # -------------------------------------------------------
@@ -0,0 +1,319 @@
+"""@package ecohydrolib.nhdplus2.catchmentcache
+
+@brief On-disk cache of dissolved NHDPlus V2 catchment polygons, keyed by the
+ComID of the outlet reach of the catchment and NHDPlus version.  Polygons are 
+stored as WKB in an SQLite3 database, and are discarded when the catchment 
+features they were dissolved from change.
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2013, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+@author Brian Miles <brian_miles@unc.edu>
+"""
+import os
+import errno
+import time
+import sqlite3
+
+from shapely.wkb import loads, dumps
+
+
+DEFAULT_NHDPLUS2_VERSION = 'NHDPlusV21'
+DEFAULT_MAX_SIZE_MB = 1024
+# Seconds to wait for another process to release its lock on the cache database
+DEFAULT_TIMEOUT = 60.0
+# Number of cache hits whose access times are written to the cache database at once
+ACCESS_FLUSH_SIZE = 256
+
+# Paths of cache databases whose schema has been created by this process
+_schemaCreated = set()
+
+
+class CatchmentCache(object):
+    """ Cache of dissolved catchment polygons, with least-recently-used eviction
+        once the total size of cached polygons exceeds a maximum size.  The cache 
+        may be shared by several processes.
+        
+        @code
+        from ecohydrolib.nhdplus2.catchmentcache import CatchmentCache
+        cache = CatchmentCache.fromConfig(config)
+        try:
+            polygon = cache.get(8888888)
+        finally:
+            cache.close()
+        @endcode
+    """
+    def __init__(self, path, version=DEFAULT_NHDPLUS2_VERSION, maxSizeMB=DEFAULT_MAX_SIZE_MB,
+                 timeout=DEFAULT_TIMEOUT, source=None):
+        """ Constructor for CatchmentCache.  The cache database will be created
+            if it does not exist.
+        
+            @param path String representing the path of the SQLite3 cache database
+            @param version String representing the NHDPlus version of cached polygons
+            @param maxSizeMB Float representing the maximum size, in megabytes, of 
+            polygons to store in the cache
+            @param timeout Float representing the number of seconds to wait for other
+            processes writing to the cache
+            @param source String representing the path of the catchment features that 
+            cached polygons are dissolved from.  If the path, size or modification time 
+            of source differ from those recorded in the cache, cached polygons of this 
+            version will be discarded.
+            
+            @raise IOError(errno.EACCES) if the cache database is not writable
+        """
+        path = os.path.abspath(path)
+        if os.path.exists(path):
+            if not os.access(path, os.W_OK):
+                raise IOError(errno.EACCES, "The catchment cache at %s is not writable" %
+                              path)
+        elif not os.access(os.path.dirname(path), os.W_OK):
+            raise IOError(errno.EACCES, "Not allowed to create catchment cache %s" % 
+                          path)
+        self.path = path
+        self.version = version
+        self.maxSize = int(maxSizeMB * 1024 * 1024)
+        # Access times of cache hits not yet written to the cache database
+        self.accessed = {}
+        
+        # Transactions are begun explicitly so that writers take the lock up front
+        self.conn = sqlite3.connect(self.path, timeout=timeout, isolation_level=None)
+        if self.path not in _schemaCreated:
+            self._createSchema()
+            _schemaCreated.add(self.path)
+        if source is not None:
+            self._checkSource(source)
+    
+    def _createSchema(self):
+        cursor = self.conn.cursor()
+        # Write-ahead logging lets processes read the cache while another writes to it
+        cursor.execute("""PRAGMA journal_mode""")
+        if cursor.fetchone()[0].lower() != 'wal':
+            cursor.execute("""PRAGMA journal_mode=WAL""")
+        cursor.execute("""CREATE TABLE IF NOT EXISTS DissolvedCatchment
+        (ComID INTEGER,
+        Version TEXT,
+        Size INTEGER,
+        LastAccess REAL,
+        Geometry BLOB,
+        PRIMARY KEY (ComID, Version))
+        """)
+        cursor.execute("""CREATE INDEX IF NOT EXISTS DissolvedCatchment_LastAccess_idx ON DissolvedCatchment (LastAccess)""")
+        cursor.execute("""CREATE TABLE IF NOT EXISTS CatchmentSource
+        (Version TEXT PRIMARY KEY,
+        Path TEXT,
+        Size INTEGER,
+        ModTime REAL)
+        """)
+        cursor.close()
+    
+    def _getSource(self, cursor):
+        cursor.execute("""SELECT Path,Size,ModTime FROM CatchmentSource WHERE Version=?""", 
+                       (self.version,))
+        result = cursor.fetchone()
+        if result is None:
+            return None
+        return tuple(result)
+    
+    def _checkSource(self, source):
+        """ Discard cached polygons if they were dissolved from catchment features other
+            than source
+        """
+        source = os.path.abspath(source)
+        st = os.stat(source)
+        signature = (source, st.st_size, st.st_mtime)
+        cursor = self.conn.cursor()
+        if self._getSource(cursor) != signature:
+            try:
+                cursor.execute("""BEGIN IMMEDIATE""")
+                # Another process may have discarded polygons while we waited for the lock
+                if self._getSource(cursor) != signature:
+                    cursor.execute("""DELETE FROM DissolvedCatchment WHERE Version=?""", (self.version,))
+                    cursor.execute("""INSERT OR REPLACE INTO CatchmentSource (Version,Path,Size,ModTime) 
+                    VALUES (?,?,?,?)""", (self.version,) + signature)
+                cursor.execute("""COMMIT""")
+            except:
+                self._rollback(cursor)
+                raise
+        cursor.close()
+        
+    @classmethod
+    def fromConfig(cls, config):
+        """ Open the cache named in a configuration file
+        
+            @param config A Python ConfigParser containing the following sections and options:
+                'NHDPLUS2', 'PATH_OF_NHDPLUS2_CATCHMENT_CACHE' (absolute path of cache database)
+                'NHDPLUS2', 'NHDPLUS2_VERSION' (optional, NHDPlus version of cached polygons)
+                'NHDPLUS2', 'NHDPLUS2_CATCHMENT_CACHE_MAX_MB' (optional, maximum size of cache)
+                'NHDPLUS2', 'PATH_OF_NHDPLUS2_CATCHMENT' (optional, absolute path to NHD 
+                catchment SQLite3 spatial DB that cached polygons are dissolved from)
+            
+            @return CatchmentCache
+            
+            @raise ConfigParser.NoSectionError
+            @raise ConfigParser.NoOptionError
+        """
+        path = config.get('NHDPLUS2', 'PATH_OF_NHDPLUS2_CATCHMENT_CACHE')
+        version = DEFAULT_NHDPLUS2_VERSION
+        if config.has_option('NHDPLUS2', 'NHDPLUS2_VERSION'):
+            version = config.get('NHDPLUS2', 'NHDPLUS2_VERSION')
+        maxSizeMB = DEFAULT_MAX_SIZE_MB
+        if config.has_option('NHDPLUS2', 'NHDPLUS2_CATCHMENT_CACHE_MAX_MB'):
+            maxSizeMB = config.getfloat('NHDPLUS2', 'NHDPLUS2_CATCHMENT_CACHE_MAX_MB')
+        source = None
+        if config.has_option('NHDPLUS2', 'PATH_OF_NHDPLUS2_CATCHMENT'):
+            source = config.get('NHDPLUS2', 'PATH_OF_NHDPLUS2_CATCHMENT')
+        return cls(path, version, maxSizeMB, source=source)
+    
+    def close(self):
+        """ Record access times of cache hits, and close the cache database
+        """
+        try:
+            self.flush()
+        finally:
+            self.conn.close()
+    
+    def flush(self):
+        """ Record access times of cache hits in the cache database.  Access times are 
+            only used to choose polygons to evict, so they are discarded if the cache 
+            database remains locked by other processes.
+        """
+        if not self.accessed:
+            return
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute("""BEGIN IMMEDIATE""")
+            self._updateLastAccess(cursor)
+            cursor.execute("""COMMIT""")
+        except sqlite3.OperationalError:
+            self._rollback(cursor)
+            self.accessed = {}
+        cursor.close()
+    
+    def _updateLastAccess(self, cursor):
+        cursor.executemany("""UPDATE DissolvedCatchment SET LastAccess=? WHERE ComID=? AND Version=?""",
+                           [(t, c, self.version) for (c, t) in self.accessed.iteritems()])
+        self.accessed = {}
+    
+    def _rollback(self, cursor):
+        try:
+            cursor.execute("""ROLLBACK""")
+        except sqlite3.OperationalError:
+            # No transaction was begun
+            pass
+    
+    def getComIDs(self, candidates=None):
+        """ Get ComIDs of catchments in the cache
+        
+            @param candidates Iterable of integers representing the ComIDs to look for;
+            if None, ComIDs of all catchments in the cache will be returned
+        
+            @return Set of integers representing ComIDs
+        """
+        cursor = self.conn.cursor()
+        if candidates is None:
+            cursor.execute("""SELECT ComID FROM DissolvedCatchment WHERE Version=?""", (self.version,))
+            comIDs = set([row[0] for row in cursor])
+            cursor.close()
+            return comIDs
+        
+        cursor.execute("""CREATE TEMP TABLE IF NOT EXISTS CandidateComID (ComID INTEGER PRIMARY KEY)""")
+        try:
+            cursor.execute("""BEGIN""")
+            cursor.executemany("""INSERT OR IGNORE INTO CandidateComID (ComID) VALUES (?)""",
+                               ((c,) for c in candidates))
+            cursor.execute("""SELECT d.ComID FROM CandidateComID c 
+            JOIN DissolvedCatchment d ON d.ComID=c.ComID AND d.Version=?""", (self.version,))
+            comIDs = set([row[0] for row in cursor])
+            cursor.execute("""DELETE FROM CandidateComID""")
+            cursor.execute("""COMMIT""")
+        except:
+            self._rollback(cursor)
+            raise
+        finally:
+            cursor.close()
+        return comIDs
+    
+    def get(self, comID):
+        """ Get dissolved catchment polygon for a reach.  The access time of the polygon
+            is recorded in the cache database with those of other cache hits, 
+            see ACCESS_FLUSH_SIZE.
+        
+            @param comID Integer representing ComID of the outlet reach of the catchment
+            
+            @return Shapely geometry, or None if the catchment is not cached
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("""SELECT Geometry FROM DissolvedCatchment WHERE ComID=? AND Version=?""",
+                       (comID, self.version))
+        result = cursor.fetchone()
+        cursor.close()
+        if None == result:
+            return None
+        self.accessed[comID] = time.time()
+        if len(self.accessed) >= ACCESS_FLUSH_SIZE:
+            self.flush()
+        return loads( str(result[0]) )
+    
+    def put(self, comID, geometry):
+        """ Store dissolved catchment polygon for a reach, evicting least-recently-used
+            polygons as needed.  Polygons larger than the cache will not be stored.
+        
+            @param comID Integer representing ComID of the outlet reach of the catchment
+            @param geometry Shapely geometry of the dissolved catchment
+        """
+        wkb = dumps(geometry)
+        size = len(wkb)
+        if size > self.maxSize:
+            return
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute("""BEGIN IMMEDIATE""")
+            self._updateLastAccess(cursor)
+            cursor.execute("""DELETE FROM DissolvedCatchment WHERE ComID=? AND Version=?""",
+                           (comID, self.version))
+            cursor.execute("""SELECT TOTAL(Size) FROM DissolvedCatchment""")
+            totalSize = cursor.fetchone()[0]
+            if totalSize + size > self.maxSize:
+                # Evict least-recently-used polygons
+                cursor.execute("""SELECT ComID,Version,Size FROM DissolvedCatchment ORDER BY LastAccess ASC""")
+                evict = []
+                for (c, v, s) in cursor.fetchall():
+                    if totalSize + size <= self.maxSize:
+                        break
+                    evict.append( (c, v) )
+                    totalSize -= s
+                cursor.executemany("""DELETE FROM DissolvedCatchment WHERE ComID=? AND Version=?""", evict)
+            cursor.execute("""INSERT INTO DissolvedCatchment (ComID,Version,Size,LastAccess,Geometry) 
+            VALUES (?,?,?,?,?)""", (comID, self.version, size, time.time(), sqlite3.Binary(wkb)))
+            cursor.execute("""COMMIT""")
+        except:
+            self._rollback(cursor)
+            raise
+        finally:
+            cursor.close()
@@ -0,0 +1,287 @@
+"""@package ecohydrolib.nhdplus2.columnar
+
+@brief Export NHDPlus tables to typed columnar files, and memory map them for 
+vectorized analysis
+
+Each table is exported to a directory holding one numpy .npy file per column.
+INTEGER and REAL columns are stored as int64 and float64, TEXT columns as 
+fixed-width UTF-8 byte strings, and DATETIME columns as datetime64[s].  For
+example, to find reaches draining more than 1000 square kilometers:
+
+@code
+vaa = ColumnTable.open(columnsDir, 'PlusFlowlineVAA')
+comIDs = vaa['ComID'][ vaa['TotDASqKM'] > 1000.0 ]
+@endcode
+
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2013, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+@author Brian Miles <brian_miles@unc.edu>
+"""
+import os
+import errno
+
+import numpy as np
+
+from ecohydrolib.nhdplus2.tables import INTEGER
+from ecohydrolib.nhdplus2.tables import REAL
+from ecohydrolib.nhdplus2.tables import TEXT
+from ecohydrolib.nhdplus2.tables import DATETIME
+from ecohydrolib.nhdplus2.tables import PLUSFLOWLINEVAA
+from ecohydrolib.nhdplus2.tables import GAGE_SMOOTH
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+COLUMNAR_VERSION = 1
+COLUMNAR_VERSION_FILENAME = 'VERSION'
+# Tables exported by NHDPlusV2Setup
+COLUMNAR_TABLES = [PLUSFLOWLINEVAA, GAGE_SMOOTH]
+# Number of rows to read from the database at a time
+EXPORT_CHUNK_SIZE = 100000
+
+_DTYPES = {INTEGER: np.int64,
+           REAL: np.float64,
+           DATETIME: 'datetime64[s]'}
+
+
+def exportTableColumns(conn, table, path, parquet=False):
+    """ Export a table of the NHDPlus SQLite database to a directory of .npy files,
+        one per column.  Rows are read EXPORT_CHUNK_SIZE at a time and written directly 
+        to memory mapped output files, so memory use does not grow with the size of 
+        the table.  NULL INTEGER, REAL, and TEXT values are stored as 0, 0.0, and '', 
+        NULL DATETIME values as NaT.
+    
+        @param conn sqlite3.Connection to the NHDPlus SQLite database
+        @param table ecohydrolib.nhdplus2.tables.TableSpec of the table to export
+        @param path String representing the path of the directory to which tables are 
+        exported.  Columns will be written to a sub-directory named for the table; 
+        existing column files will be replaced.
+        @param parquet Boolean, True if the table should also be written to a Parquet 
+        file named for the table (requires pyarrow)
+        
+        @return Integer representing the number of rows exported
+        
+        @raise Exception if parquet is True and pyarrow is not installed
+    """
+    if parquet and pyarrow is None:
+        raise Exception("pyarrow must be installed to export tables to Parquet")
+    
+    tablePath = os.path.join(path, table.name)
+    if not os.path.isdir(tablePath):
+        os.makedirs(tablePath)
+    # Remove version first so that a partially written table will not be opened
+    versionPath = os.path.join(tablePath, COLUMNAR_VERSION_FILENAME)
+    if os.path.exists(versionPath):
+        os.unlink(versionPath)
+    
+    numRows = conn.execute("SELECT COUNT(*) FROM %s" % (table.name,)).fetchone()[0]
+    
+    # Determine types of columns, and the SQL to select each
+    dtypes = []
+    selects = []
+    for column in table.columns:
+        if column.type == TEXT:
+            width = conn.execute("SELECT MAX(LENGTH(CAST(%s AS BLOB))) FROM %s" % \
+                                 (column.name, table.name)).fetchone()[0]
+            # MAX is NULL if the table is empty
+            dtypes.append("S%d" % (max(width or 0, 1),))
+            selects.append("IFNULL(%s,'')" % (column.name,))
+        elif column.type == DATETIME:
+            dtypes.append(_DTYPES[column.type])
+            selects.append(column.name)
+        elif column.type == REAL:
+            dtypes.append(_DTYPES[column.type])
+            selects.append("IFNULL(%s,0.0)" % (column.name,))
+        else:
+            dtypes.append(_DTYPES[column.type])
+            selects.append("IFNULL(%s,0)" % (column.name,))
+    
+    arrays = []
+    for (column, dtype) in zip(table.columns, dtypes):
+        columnPath = os.path.join(tablePath, column.name + os.extsep + 'npy')
+        if numRows == 0:
+            # Empty arrays cannot be memory mapped
+            array = np.zeros(0, dtype=dtype)
+            np.save(columnPath, array)
+        else:
+            array = np.lib.format.open_memmap(columnPath, mode='w+', dtype=dtype, shape=(numRows,))
+        arrays.append(array)
+    
+    cursor = conn.execute("SELECT %s FROM %s ORDER BY ROWID" % (','.join(selects), table.name))
+    start = 0
+    rows = cursor.fetchmany(EXPORT_CHUNK_SIZE)
+    while rows:
+        end = start + len(rows)
+        for (i, column) in enumerate(table.columns):
+            values = [row[i] for row in rows]
+            if column.type == TEXT:
+                values = [value.encode('utf-8') for value in values]
+            arrays[i][start:end] = values
+        start = end
+        rows = cursor.fetchmany(EXPORT_CHUNK_SIZE)
+    cursor.close()
+    assert(start == numRows)
+    
+    for array in arrays:
+        if isinstance(array, np.memmap):
+            array.flush()
+    
+    if parquet:
+        parquetTable = pyarrow.Table.from_arrays([pyarrow.array(np.asarray(array)) for array in arrays],
+                                                 [column.name for column in table.columns])
+        pyarrow.parquet.write_table(parquetTable, os.path.join(path, table.name + os.extsep + 'parquet'))
+    del arrays
+    
+    versionFile = open(versionPath, 'w')
+    versionFile.write("%d\n" % (COLUMNAR_VERSION,))
+    versionFile.close()
+    
+    return numRows
+
+
+class ColumnTable(object):
+    """ Table of NHDPlus records exported by exportTableColumns.  Columns are numpy 
+        arrays, loaded (or memory mapped) the first time they are accessed, which can 
+        be filtered with vectorized operations. 
+    """
+    def __init__(self, path, mmap=True):
+        """ Constructor for ColumnTable
+        
+            @param path String representing the path of the directory holding the 
+            columns of the table
+            @param mmap Boolean, True if columns should be memory mapped rather than read
+            
+            @raise IOError(errno.EACCES) if the table is not readable
+            @raise IOError(errno.ENOENT) if the table is incomplete or is of a different 
+            version
+        """
+        if not os.access(path, os.R_OK):
+            raise IOError(errno.EACCES, "The column table at %s is not readable" %
+                          path)
+        versionPath = os.path.join(path, COLUMNAR_VERSION_FILENAME)
+        version = None
+        if os.path.exists(versionPath):
+            versionFile = open(versionPath, 'r')
+            version = versionFile.read().strip()
+            versionFile.close()
+        if version != str(COLUMNAR_VERSION):
+            raise IOError(errno.ENOENT, "No column table of version %d found at %s" %
+                          (COLUMNAR_VERSION, path))
+        
+        self.path = path
+        self.name = os.path.basename(os.path.normpath(path))
+        self._mmapMode = None
+        if mmap:
+            self._mmapMode = 'r'
+        self._files = {}
+        for filename in os.listdir(path):
+            (name, ext) = os.path.splitext(filename)
+            if ext == os.extsep + 'npy':
+                self._files[name.upper()] = (name, os.path.join(path, filename))
+        self._columns = {}
+    
+    @classmethod
+    def fromConfig(cls, config, tableName, mmap=True):
+        """ Open an exported table of the NHDPlus database
+        
+            @param config A Python ConfigParser containing the following sections and options:
+                'NHDPLUS2', 'PATH_OF_NHDPLUS2_COLUMNS' (absolute path to directory NHDPlus 
+                tables were exported to by NHDPlusV2Setup)
+            @param tableName String representing the name of the table
+            @param mmap Boolean, True if columns should be memory mapped rather than read
+            
+            @return ColumnTable
+            
+            @raise ConfigParser.NoSectionError
+            @raise ConfigParser.NoOptionError
+        """
+        return cls.open(config.get('NHDPLUS2', 'PATH_OF_NHDPLUS2_COLUMNS'), tableName, mmap)
+    
+    @classmethod
+    def open(cls, path, tableName, mmap=True):
+        """ Open a table exported by exportTableColumns
+        
+            @param path String representing the path of the directory tables were 
+            exported to
+            @param tableName String representing the name of the table
+            @param mmap Boolean, True if columns should be memory mapped rather than read
+            
+            @return ColumnTable
+        """
+        return cls(os.path.join(path, tableName), mmap)
+    
+    def getColumnNames(self):
+        return sorted([name for (name, filepath) in self._files.values()])
+    
+    def __contains__(self, columnName):
+        return columnName.upper() in self._files
+    
+    def __getitem__(self, columnName):
+        """ Get a column.  Column names are compared without regard to case.
+        
+            @param columnName String representing the name of the column
+            
+            @return numpy array of the values of the column
+            
+            @raise KeyError if the table has no such column
+        """
+        key = columnName.upper()
+        column = self._columns.get(key)
+        if column is None:
+            try:
+                (name, filepath) = self._files[key]
+            except KeyError:
+                raise KeyError("Table %s has no column %s" % (self.name, columnName))
+            column = np.load(filepath, mmap_mode=self._mmapMode)
+            self._columns[key] = column
+        return column
+    
+    def __len__(self):
+        if not self._files:
+            return 0
+        return len(self[self._files.keys()[0]])
+    
+    def select(self, mask, columnNames=None):
+        """ Select rows of the table
+        
+            @param mask numpy boolean array, or array of row indices, selecting rows
+            @param columnNames List of strings representing the names of the columns to 
+            select; if None, all columns will be selected
+            
+            @return Dict mapping column name to a numpy array of the values of the 
+            selected rows
+        """
+        if columnNames is None:
+            columnNames = self.getColumnNames()
+        return dict([(name, self[name][mask]) for name in columnNames])
@@ -0,0 +1,171 @@
+"""@package ecohydrolib.nhdplus2.database
+
+@brief Pooled, read-only handles to the NHDPlus2 SQLite3 database
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2013, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+@author Brian Miles <brian_miles@unc.edu>
+"""
+import os
+import errno
+import sqlite3
+import threading
+import contextlib
+import Queue
+
+DEFAULT_POOL_SIZE = 4
+DEFAULT_MMAP_SIZE_MB = 1024
+DEFAULT_CACHE_SIZE_MB = 64
+# Number of compiled statements each connection keeps for re-use
+CACHED_STATEMENTS = 128
+
+_databases = {}
+_databasesLock = threading.Lock()
+
+
+class NHDPlusDatabase(object):
+    """ Long-lived handle to the NHDPlus2 SQLite3 database holding a pool of
+        read-only connections.  Connections are tuned for read-mostly workloads 
+        (memory mapped I/O, a larger page cache) and cache compiled statements, 
+        so repeated queries are not re-prepared.
+        
+        Network analysis functions accept an NHDPlusDatabase in place of opening 
+        a new connection to the database for each call.
+        
+        @code
+        from ecohydrolib.nhdplus2.database import NHDPlusDatabase
+        db = NHDPlusDatabase.fromConfig(config)
+        with db.connection() as conn:
+            comID = getComIdForStreamGage(conn, reachcode, measure)
+        @endcode
+    """
+    def __init__(self, path, poolSize=DEFAULT_POOL_SIZE, 
+                 mmapSizeMB=DEFAULT_MMAP_SIZE_MB, cacheSizeMB=DEFAULT_CACHE_SIZE_MB):
+        """ Constructor for NHDPlusDatabase.  Connections are opened as they are 
+            needed.
+        
+            @param path String representing the path of the NHDPlus2 SQLite3 database
+            @param poolSize Integer representing the maximum number of idle connections to keep open
+            @param mmapSizeMB Integer representing the maximum number of megabytes of the
+            database to memory map
+            @param cacheSizeMB Integer representing the size, in megabytes, of the page cache 
+            of each connection
+            
+            @raise IOError(errno.EACCES) if the database is not readable
+        """
+        if not os.access(path, os.R_OK):
+            raise IOError(errno.EACCES, "The database at %s is not readable" %
+                          path)
+        self.path = os.path.abspath(path)
+        self.mmapSize = int(mmapSizeMB * 1024 * 1024)
+        self.cacheSize = int(cacheSizeMB * 1024)
+        self.pid = os.getpid()
+        self._pool = Queue.Queue(poolSize)
+    
+    @classmethod
+    def fromConfig(cls, config):
+        """ Get the database handle shared by all callers in this process for the 
+            database named in a configuration file
+        
+            @param config A Python ConfigParser containing the following sections and options:
+                'NHDPLUS2', 'PATH_OF_NHDPLUS2_DB' (absolute path to NHDPlus2 SQLite3 database)
+            
+            @return NHDPlusDatabase
+            
+            @raise ConfigParser.NoSectionError
+            @raise ConfigParser.NoOptionError
+            @raise IOError(errno.EACCES) if NHDPlus2 DB is not readable
+        """
+        nhddbPath = config.get('NHDPLUS2', 'PATH_OF_NHDPLUS2_DB')
+        if not os.access(nhddbPath, os.R_OK):
+            raise IOError(errno.EACCES, "The database at %s is not readable" %
+                          nhddbPath)
+        key = (os.path.abspath(nhddbPath), os.getpid())
+        with _databasesLock:
+            db = _databases.get(key)
+            if db is None:
+                db = cls(nhddbPath)
+                _databases[key] = db
+        return db
+    
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, 
+                               cached_statements=CACHED_STATEMENTS)
+        conn.execute("PRAGMA query_only=ON")
+        conn.execute("PRAGMA mmap_size=%d" % (self.mmapSize,))
+        conn.execute("PRAGMA cache_size=-%d" % (self.cacheSize,))
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+    
+    def getConnection(self):
+        """ Get a connection from the pool, opening a new connection if none are idle.
+            Connections must be returned by calling releaseConnection.
+        
+            @return sqlite3.Connection
+        """
+        if os.getpid() != self.pid:
+            # Connections must not be shared with a parent process
+            self._pool = Queue.Queue(self._pool.maxsize)
+            self.pid = os.getpid()
+        try:
+            return self._pool.get_nowait()
+        except Queue.Empty:
+            return self._connect()
+    
+    def releaseConnection(self, conn):
+        """ Return a connection to the pool.  The connection will be closed if
+            the pool is full.
+        
+            @param conn sqlite3.Connection obtained from getConnection
+        """
+        try:
+            self._pool.put_nowait(conn)
+        except Queue.Full:
+            conn.close()
+    
+    @contextlib.contextmanager
+    def connection(self):
+        """ Context manager yielding a pooled connection
+        """
+        conn = self.getConnection()
+        try:
+            yield conn
+        finally:
+            self.releaseConnection(conn)
+    
+    def close(self):
+        """ Close idle connections.  Connections in use will be closed when released 
+            if the pool is full.
+        """
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except Queue.Empty:
+                break
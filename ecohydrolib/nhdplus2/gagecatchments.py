@@ -0,0 +1,269 @@
+"""@package ecohydrolib.nhdplus2.gagecatchments
+
+@brief Build GeoPackages of the dissolved drainage areas of NHDPlus V2 streamflow gages
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2013, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+@author Brian Miles <brian_miles@unc.edu>
+"""
+import os
+import sys
+import errno
+import signal
+import multiprocessing
+
+import ogr
+from shapely.wkb import dumps
+
+from ecohydrolib.spatialdata.utils import OGR_GPKG_DRIVER_NAME
+from ecohydrolib.nhdplus2.database import NHDPlusDatabase
+from ecohydrolib.nhdplus2.catchmentcache import CatchmentCache
+from ecohydrolib.nhdplus2.networkanalysis import loadPlusFlowIndex
+from ecohydrolib.nhdplus2.networkanalysis import openCatchmentLayer
+from ecohydrolib.nhdplus2.networkanalysis import getCatchmentPolygonForComid
+from ecohydrolib.nhdplus2.networkanalysis import getStreamGagesBySourceFea
+
+GAGE_CATCHMENT_LAYER = 'gage_catchment'
+# Number of catchments to write per transaction
+COMMIT_INTERVAL = 100
+# Seconds to wait for each result from the pool before waiting again, so that 
+#   KeyboardInterrupt is delivered while waiting
+RESULT_POLL_INTERVAL = 1.0
+
+# Per-process state of pool workers, see _initWorker
+_worker = {}
+
+
+def buildGageCatchmentGeoPackage(config, outputPath, sourceFeas=None, processes=None, 
+                                 progress=None):
+    """ Delineate and dissolve the drainage area of each of a set of streamflow gages, 
+        and store the resulting polygons in a layer of a GeoPackage with a spatial index.
+        Gages already in the GeoPackage are skipped, so that an interrupted build can 
+        be resumed.
+        
+        @note The layer, named GAGE_CATCHMENT_LAYER, has fields source_fea, reachcode, 
+        measure and comid, and uses the spatial reference of the catchment features.
+        
+        @note The PlusFlow index is loaded once, before worker processes are started, 
+        and is shared by them.  Configuring a network snapshot is recommended, so that 
+        the index is memory mapped rather than built from the NHDPlus2 DB.
+        
+        @param config A Python ConfigParser containing the following sections and options:
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_DB' (absolute path to SQLite3 DB of NHDFlow data)
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_CATCHMENT' (absolute path to NHD catchment SQLite3 spatial DB)
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_NETWORK' (optional, absolute path of network snapshot 
+            directory, see loadPlusFlowIndex)
+        @param outputPath String representing the path of the GeoPackage, which will be
+        created if it does not exist
+        @param sourceFeas List of strings representing source_fea of gages to delineate;
+        if None, all gages in Gage_Loc will be delineated
+        @param processes Integer representing the number of processes to use; if None, 
+        one process per CPU will be used
+        @param progress Function called with the number of gages processed and the 
+        number of gages to process after each gage is processed
+        
+        @return A tuple (built, failed), where built is the number of catchments written, 
+        and failed is a list of (source_fea, message) tuples for gages that could not be 
+        delineated
+        
+        @raise ConfigParser.NoSectionError
+        @raise ConfigParser.NoOptionError
+        @raise IOError(errno.EACCES) if the GeoPackage is not writable
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    assert(type(processes) == int)
+    assert(processes > 0)
+    
+    (poCatchmentDS, poCatchmentLayer) = openCatchmentLayer(config)
+    (poDS, poLayer) = _openGageCatchmentLayer(outputPath, poCatchmentLayer.GetSpatialRef())
+    poCatchmentDS = None
+    
+    # Find gages not yet in the GeoPackage
+    done = set()
+    poResult = poDS.ExecuteSQL("SELECT source_fea FROM %s" % (GAGE_CATCHMENT_LAYER,))
+    feature = poResult.GetNextFeature()
+    while feature:
+        done.add(feature.GetFieldAsString(0))
+        feature.Destroy()
+        feature = poResult.GetNextFeature()
+    poDS.ReleaseResultSet(poResult)
+    
+    if sourceFeas is None:
+        with NHDPlusDatabase.fromConfig(config).connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""SELECT DISTINCT Source_Fea FROM Gage_Loc""")
+            sourceFeas = [row[0] for row in cursor]
+            cursor.close()
+    # Skip gages already built, and gages listed more than once
+    pending = []
+    for sourceFea in sourceFeas:
+        if sourceFea not in done:
+            pending.append(sourceFea)
+            done.add(sourceFea)
+    sourceFeas = pending
+    
+    tasks = []
+    failed = []
+    for (sourceFea, gage) in zip(sourceFeas, getStreamGagesBySourceFea(config, sourceFeas)):
+        if gage is None:
+            failed.append( (sourceFea, "Gage not found") )
+        elif gage[2] < 0:
+            failed.append( (sourceFea, "No reach found for gage") )
+        else:
+            tasks.append( (sourceFea, gage[0], gage[1], gage[2]) )
+    
+    built = 0
+    # Gages that failed before delineation count towards progress
+    numGages = len(sourceFeas)
+    # Build the index once; forked workers share it copy-on-write rather than 
+    #   each reading PlusFlow
+    index = loadPlusFlowIndex(config)
+    pool = multiprocessing.Pool(processes, _initWorker, (config, index))
+    poLayer.StartTransaction()
+    try:
+        for (task, wkb, message) in _iterResults(pool.imap_unordered(_getGageCatchment, tasks)):
+            if wkb is None:
+                failed.append( (task[0], message) )
+            else:
+                _writeGageCatchment(poLayer, task, wkb)
+                built += 1
+                if built % COMMIT_INTERVAL == 0:
+                    poLayer.CommitTransaction()
+                    poLayer.StartTransaction()
+            if progress:
+                progress(built + len(failed), numGages)
+        poLayer.CommitTransaction()
+    except:
+        # Discard outstanding gages rather than waiting for them to be delineated; 
+        #   catchments already committed are kept so that the build can be resumed
+        (excType, excValue, excTraceback) = sys.exc_info()
+        pool.terminate()
+        pool.join()
+        try:
+            poLayer.RollbackTransaction()
+        except Exception:
+            pass
+        raise excType, excValue, excTraceback
+    pool.close()
+    pool.join()
+    poDS = None
+    
+    return (built, failed)
+
+
+def _openGageCatchmentLayer(outputPath, srs):
+    """ Open, creating if needed, the gage catchment layer of a GeoPackage
+    
+        @return A tuple (ogr.DataSource, ogr.Layer)
+    """
+    outputPath = os.path.abspath(outputPath)
+    ogr.UseExceptions()
+    if os.path.exists(outputPath):
+        if not os.access(outputPath, os.W_OK):
+            raise IOError(errno.EACCES, "The GeoPackage at %s is not writable" % (outputPath,))
+        poDS = ogr.Open(outputPath, True)
+    else:
+        if not os.access(os.path.dirname(outputPath), os.W_OK):
+            raise IOError(errno.EACCES, "Not allowed to create GeoPackage %s" % (outputPath,))
+        poDriver = ogr.GetDriverByName(OGR_GPKG_DRIVER_NAME)
+        assert(poDriver)
+        poDS = poDriver.CreateDataSource(outputPath)
+    assert(poDS != None)
+    
+    poLayer = poDS.GetLayerByName(GAGE_CATCHMENT_LAYER)
+    if poLayer is None:
+        poLayer = poDS.CreateLayer(GAGE_CATCHMENT_LAYER, srs, ogr.wkbMultiPolygon,
+                                   ['SPATIAL_INDEX=YES'])
+        poLayer.CreateField(ogr.FieldDefn('source_fea', ogr.OFTString))
+        poLayer.CreateField(ogr.FieldDefn('reachcode', ogr.OFTString))
+        poLayer.CreateField(ogr.FieldDefn('measure', ogr.OFTReal))
+        poLayer.CreateField(ogr.FieldDefn('comid', ogr.OFTInteger))
+        poDS.ExecuteSQL("CREATE UNIQUE INDEX IF NOT EXISTS %s_source_fea_idx ON %s (source_fea)" % \
+                        (GAGE_CATCHMENT_LAYER, GAGE_CATCHMENT_LAYER))
+    assert(poLayer)
+    return (poDS, poLayer)
+
+
+def _writeGageCatchment(poLayer, gage, wkb):
+    (sourceFea, reachcode, measure, comID) = gage
+    feature = ogr.Feature(poLayer.GetLayerDefn())
+    feature.SetField('source_fea', str(sourceFea))
+    feature.SetField('reachcode', str(reachcode))
+    feature.SetField('measure', float(measure))
+    feature.SetField('comid', int(comID))
+    feature.SetGeometry( ogr.ForceToMultiPolygon(ogr.CreateGeometryFromWkb(wkb)) )
+    poLayer.CreateFeature(feature)
+    feature.Destroy()
+
+
+def _iterResults(results):
+    """ Iterate over the results of Pool.imap_unordered.  Waiting without a timeout
+        cannot be interrupted in Python 2.
+    """
+    while True:
+        try:
+            yield results.next(RESULT_POLL_INTERVAL)
+        except multiprocessing.TimeoutError:
+            continue
+        except StopIteration:
+            return
+
+
+def _initWorker(config, index):
+    # Leave handling of interrupts to the parent, which terminates the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _worker['config'] = config
+    _worker['index'] = index
+    _worker['catchmentLayer'] = openCatchmentLayer(config)
+    # Each worker keeps the catchment cache open rather than opening it for every gage
+    _worker['cache'] = None
+    if config.has_option('NHDPLUS2', 'PATH_OF_NHDPLUS2_CATCHMENT_CACHE'):
+        _worker['cache'] = CatchmentCache.fromConfig(config)
+
+
+def _getGageCatchment(gage):
+    """ Delineate the catchment of a gage in a pool worker
+    
+        @param gage Tuple (source_fea, reachcode, measure, comID)
+        
+        @return A tuple (gage, wkb, message), where wkb is the WKB of the catchment polygon,
+        or None if the catchment could not be delineated, in which case message describes
+        the error
+    """
+    try:
+        polygon = getCatchmentPolygonForComid(_worker['config'], gage[3], _worker['index'],
+                                              catchmentLayer=_worker['catchmentLayer'],
+                                              cache=_worker['cache'])
+        if polygon.is_empty:
+            return (gage, None, "No catchment features found for ComID %d" % (gage[3],))
+        return (gage, dumps(polygon), None)
+    except Exception as e:
+        return (gage, None, str(e))
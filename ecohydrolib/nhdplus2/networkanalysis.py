@@ -39,30 +39,59 @@ import errno
 import time
 import sqlite3
 import re
+import collections
+import math
+import multiprocessing
 
+import numpy as np
 import ogr
 from shapely.geometry import Polygon
 from shapely.wkb import loads, dumps
 from shapely.ops import *
 
 from ecohydrolib.spatialdata.utils import OGR_SHAPEFILE_DRIVER_NAME
+from ecohydrolib.spatialdata.utils import OGR_GPKG_DRIVER_NAME
 from ecohydrolib.spatialdata.utils import OGR_DRIVERS
-from ecohydrolib.spatialdata.utils import getBoundingBoxForShapefile
-from ecohydrolib.spatialdata.utils import deleteShapefile
+from ecohydrolib.spatialdata.utils import getBoundingBoxForExtent
+from ecohydrolib.nhdplus2.networkindex import PlusFlowIndex
+from ecohydrolib.nhdplus2.networkindex import UpstreamReachCache
+from ecohydrolib.nhdplus2.networkindex import DownstreamIndex
+from ecohydrolib.nhdplus2.networkindex import getFlowlineAttributes
+from ecohydrolib.nhdplus2.networkindex import loadNetworkSnapshot
+from ecohydrolib.nhdplus2.networkindex import DIVERGENCE_ROUTING_MAIN
+from ecohydrolib.nhdplus2.networkindex import DIVERGENCE_ROUTING_EQUAL
+from ecohydrolib.nhdplus2.networkindex import DIVERGENCE_ROUTING_NONE
+from ecohydrolib.nhdplus2.catchmentcache import CatchmentCache
+from ecohydrolib.nhdplus2.database import NHDPlusDatabase
 
 OGR_UPDATE_MODE = False
 NORTH = 0
 EAST = 90
-UPSTREAM_SEARCH_THRESHOLD = 998
+# Temporary table of reaches joined against catchment features
+REACH_TABLE = 'nhdplus2_reach'
+REACH_INSERT_SIZE = 500
+# Maximum number of gages to look up per query; must be less than SQLITE_MAX_VARIABLE_NUMBER
+GAGE_QUERY_SIZE = 500
+# Table of envelopes of catchment features, see createCatchmentEnvelopeTable
+CATCHMENT_ENVELOPE_TABLE = 'catchment_envelope'
+CATCHMENT_LAYER = 'catchment'
+FLOWLINE_LAYER = 'nhdflowline'
+FLOWLINE_WRITE_BATCH_SIZE = 1000
+UNION_MIN_PARTITION_SIZE = 1000
 
+# Per-process cache of upstream reaches, shared by all searches and keyed by the network searched
+_upstreamReachCache = UpstreamReachCache()
 
-def getNHDReachcodeAndMeasureForGageSourceFea(config, source_fea):
+
+def getNHDReachcodeAndMeasureForGageSourceFea(config, source_fea, db=None):
     """ Get NHD Reachcode and measure along reach for a 
         streamflow gage identified by a source_fea (e.g. USGS Site Number)
     
         @param config A Python ConfigParser containing the following sections and options:
             'NHDPLUS2', 'PATH_OF_NHDPLUS2_DB' (absolute path to NHDPlus2 SQLite3 database)
         @param source_fea String representing source_fea of GageLoc gage
+        @param db NHDPlusDatabase to query; if None, the database shared by all callers 
+        in this process for the database named in config will be used
          
         @return A tuple(string, float) representing the reachcode and measure; None if no gage was found.
         
@@ -70,17 +99,12 @@ def getNHDReachcodeAndMeasureForGageSourceFea(config, source_fea):
         @raise ConfigParser.NoOptionError
         @raise IOError(errno.EACCES) if NHDPlus2 DB is not readable
     """
-    nhddbPath = config.get('NHDPLUS2', 'PATH_OF_NHDPLUS2_DB')
-    if not os.access(nhddbPath, os.R_OK):
-        raise IOError(errno.EACCES, "The database at %s is not readable" %
-                      nhddbPath)
-    nhddbPath = os.path.abspath(nhddbPath)
-    
-    conn = sqlite3.connect(nhddbPath)
-    
-    cursor = conn.cursor()
-    cursor.execute("""SELECT ReachCode,Measure FROM Gage_Loc WHERE Source_Fea=?""", (source_fea,))
-    result = cursor.fetchone()
+    db = _getNHDPlusDatabase(config, db)
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""SELECT ReachCode,Measure FROM Gage_Loc WHERE Source_Fea=?""", (source_fea,))
+        result = cursor.fetchone()
+        cursor.close()
     if None == result:
         return None
     
@@ -90,6 +114,54 @@ def getNHDReachcodeAndMeasureForGageSourceFea(config, source_fea):
     return (reachcode, measure)
 
 
+def getStreamGagesBySourceFea(config, sourceFeas, db=None):
+    """ Get NHD reachcode, measure along reach, ComID and lat/lon of many streamflow 
+        gages identified by source_fea (e.g. USGS Site Number) from the Gage_Loc, 
+        PlusFlowlineVAA and Gage_Info tables of the NHDPlus2 database
+        
+        @note Locations are Gage_Info.Lon_NHD and Gage_Info.Lat_NHD, the location of gages
+        on NHD flowlines, in NAD83 geographic coordinates, which differ from WGS84 
+        (EPSG:4326) coordinates by less than the precision of NHDPlus.
+    
+        @param config A Python ConfigParser containing the following sections and options:
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_DB' (absolute path to NHDPlus2 SQLite3 database)
+        @param sourceFeas List of strings representing source_fea of GageLoc gages
+        @param db NHDPlusDatabase to query; if None, the database shared by all callers 
+        in this process for the database named in config will be used
+         
+        @return A list, in the same order as sourceFeas, of tuples (reachcode, measure, comID, 
+        x, y); comID is -1 if no reach was found for the gage, x and y are None if the gage 
+        is not in Gage_Info.  None for gages that were not found.
+        
+        @raise ConfigParser.NoSectionError
+        @raise ConfigParser.NoOptionError
+        @raise IOError(errno.EACCES) if NHDPlus2 DB is not readable
+    """
+    sourceFeas = list(sourceFeas)
+    uniqueSourceFeas = list(set(sourceFeas))
+    gages = {}
+    
+    db = _getNHDPlusDatabase(config, db)
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        for start in xrange(0, len(uniqueSourceFeas), GAGE_QUERY_SIZE):
+            chunk = uniqueSourceFeas[start:start+GAGE_QUERY_SIZE]
+            cursor.execute("""SELECT g.Source_Fea,g.ReachCode,g.Measure,p.ComID,i.Lon_NHD,i.Lat_NHD
+FROM Gage_Loc AS g
+LEFT JOIN PlusFlowlineVAA AS p ON p.ReachCode=g.ReachCode AND g.Measure>=p.FromMeas AND g.Measure<=p.ToMeas
+LEFT JOIN Gage_Info AS i ON i.GageID=g.Source_Fea
+WHERE g.Source_Fea IN (%s)""" % (','.join(['?'] * len(chunk)),), chunk)
+            for (sourceFea, reachcode, measure, comID, x, y) in cursor:
+                gage = gages.get(sourceFea)
+                if gage is None or (gage[2] == -1 and comID is not None):
+                    if comID is None:
+                        comID = -1
+                    gages[sourceFea] = (reachcode, measure, comID, x, y)
+        cursor.close()
+    
+    return [gages.get(sourceFea) for sourceFea in sourceFeas]
+
+
 def getLocationForStreamGageByGageSourceFea(config, source_fea):
     """ Get lat/lon, in WGS84 (EPSG:4326), from gage point layer (Gage_Loc) for
         gage identified by a source_fea (e.g. USGS Site Number)
@@ -172,6 +244,51 @@ def getLocationForStreamGage(config, whereFilter):
     return None
     
 
+def loadPlusFlowIndex(config, db=None):
+    """ Build an in-memory index of the PlusFlow table of the NHDPlus2 DB.  The index
+        can be passed to network analysis functions to avoid issuing an SQL query
+        for each reach visited when searching for upstream reaches.
+        
+        @note If a network snapshot is configured, the index will be memory mapped from
+        the snapshot instead of being built from the NHDPlus2 DB.
+    
+        @param config A Python ConfigParser containing the following sections and options:
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_DB' (absolute path to NHDPlus2 SQLite3 database)
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_NETWORK' (optional, absolute path of network snapshot 
+            directory, see saveNetworkSnapshot)
+        @param db NHDPlusDatabase to query; if None, the database shared by all callers 
+        in this process for the database named in config will be used
+         
+        @return PlusFlowIndex
+        
+        @raise ConfigParser.NoSectionError
+        @raise ConfigParser.NoOptionError
+        @raise IOError(errno.EACCES) if NHDPlus2 DB is not readable
+    """
+    if config.has_option('NHDPLUS2', 'PATH_OF_NHDPLUS2_NETWORK'):
+        return loadNetworkSnapshot(config.get('NHDPLUS2', 'PATH_OF_NHDPLUS2_NETWORK'))[0]
+    
+    db = _getNHDPlusDatabase(config, db)
+    with db.connection() as conn:
+        index = PlusFlowIndex.fromDatabase(conn)
+    
+    return index
+
+
+def _getNHDPlusDatabase(config, db=None):
+    """ Get the NHDPlus2 database to query
+    
+        @param config A Python ConfigParser containing the following sections and options:
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_DB' (absolute path to NHDPlus2 SQLite3 database)
+        @param db NHDPlusDatabase to use; if None, the database named in config
+        
+        @return NHDPlusDatabase
+    """
+    if db is not None:
+        return db
+    return NHDPlusDatabase.fromConfig(config)
+
+
 def getComIdForStreamGage(conn, reachcode, measure):
     """ Uses NHDFlowline and/or NHDReachCode_ComID table(s) to lookup the ComID associated with a stream gage
         identified by reach code and measure.
@@ -203,14 +320,17 @@ AND g.ReachCode=? AND g.Measure=?""", (reachcode, measure))
     return comID
 
 
-def getPlusFlowPredecessors(conn, comID):
+def getPlusFlowPredecessors(conn, comID, index=None):
     """ Get the immediate predecessors of the NHDPlus2 PlusFlow feature of comID
     
         @param conn A connection an SQLite3 database
         @param comdID String representing the ComID of the reach whose immediate predecessor reaches are to be discovered
+        @param index PlusFlowIndex to use instead of querying the PlusFlow table; if None, conn will be queried
         
         @return A list of immediate predecessor nodes in the NHDPlus2 PlusFlow graph
     """
+    if index is not None:
+        return index.getPredecessors(comID)
     immediatePredecessors = []
     cursor = conn.cursor()
     cursor.execute("""SELECT FROMCOMID FROM PlusFlow WHERE TOCOMID=?""", (comID,))
@@ -219,8 +339,74 @@ def getPlusFlowPredecessors(conn, comID):
     return immediatePredecessors
 
 
+def clearUpstreamReachCache():
+    """ Clear the per-process cache of upstream reaches, releasing its memory
+    """
+    _upstreamReachCache.clear()
+
+
+def _getDatabaseSource(conn):
+    """ Get the path of the main database of a connection, which identifies the network 
+        searched in the upstream reach cache
+    
+        @return String representing the path, or None if the database is in memory
+    """
+    cursor = conn.cursor()
+    cursor.execute("""PRAGMA database_list""")
+    source = None
+    for (seq, name, filename) in cursor:
+        if name == 'main' and filename:
+            source = filename
+    cursor.close()
+    return source
+
+
+def _searchUpstreamReaches(comID, getPredecessors, source):
+    """ Search for all stream reaches upstream of a given reach using an explicit stack.
+        Upstream reaches of comID are cached; the search does not continue upstream
+        of reaches whose upstream reaches are already cached.
+    
+        @param comID The ComID of the reach whose upstream reaches are to be discovered
+        @param getPredecessors Function taking a ComID and returning a list of the 
+        ComIDs of its immediate predecessors
+        @param source Hashable identifying the network searched in the upstream reach 
+        cache; if None, the cache will not be used
+        
+        @return A list containing integers representing comIDs of upstream reaches
+    """
+    if source is not None:
+        cached = _upstreamReachCache.get(source, comID)
+        if cached is not None:
+            return cached.tolist()
+    
+    upstreamReaches = []
+    visited = set([comID])
+    stack = [comID]
+    while stack:
+        for u in getPredecessors(stack.pop()):
+            # ComID 0 denotes a headwater reach
+            if u == 0 or u in visited:
+                continue
+            visited.add(u)
+            upstreamReaches.append(u)
+            subtree = None
+            if source is not None:
+                subtree = _upstreamReachCache.get(source, u)
+            if subtree is None:
+                stack.append(u)
+                continue
+            for s in subtree.tolist():
+                if s not in visited:
+                    visited.add(s)
+                    upstreamReaches.append(s)
+    
+    if source is not None:
+        _upstreamReachCache.put(source, comID, upstreamReaches)
+    return upstreamReaches
+
+
 def getUpstreamReachesSQL(conn, comID, allUpstreamReaches):
-    """ Recursively searches PlusFlow table in an SQLite database for all stream reaches
+    """ Searches PlusFlow table in an SQLite database for all stream reaches
         upstream of a given reach.
     
         @note This method has no return value. Upstream reaches discovered are appended to allUpstreamReaches list.
@@ -229,23 +415,312 @@ def getUpstreamReachesSQL(conn, comID, allUpstreamReaches):
         @param comID The ComID of the reach whose upstream reaches are to be discovered
         @param allUpstreamReaches A list containing integers representing comIDs of upstream reaches
     """
-    upstream_reaches = getPlusFlowPredecessors(conn, comID)
-    if len(upstream_reaches) == 0:
-        return
+    allUpstreamReaches.extend( _searchUpstreamReaches(comID, 
+                                                      lambda c: getPlusFlowPredecessors(conn, c),
+                                                      _getDatabaseSource(conn)) )
+
+
+def getUpstreamReaches(conn, comID, index=None):
+    """ Get all stream reaches upstream of a given reach.
+    
+        @param conn A connection to an SQLite3 database; not used if index is specified
+        @param comID The ComID of the reach whose upstream reaches are to be discovered
+        @param index PlusFlowIndex to search instead of querying the PlusFlow table; if None, 
+        conn will be searched using getUpstreamReachesSQL
+        
+        @return A list containing integers representing comIDs of upstream reaches
+    """
+    if index is not None:
+        source = ('PlusFlowIndex', index.identity)
+        upstreamReaches = _upstreamReachCache.get(source, comID)
+        if upstreamReaches is None:
+            upstreamReaches = index.getUpstreamReaches(comID)
+            _upstreamReachCache.put(source, comID, upstreamReaches)
+        return upstreamReaches.tolist()
+    upstreamReaches = []
+    getUpstreamReachesSQL(conn, comID, upstreamReaches)
+    return upstreamReaches
+
+
+def getUpstreamReachesStoppingAt(conn, comID, stopComIDs, index=None):
+    """ Get stream reaches upstream of a given reach, not searching upstream of
+        reaches in a given set.
+    
+        @param conn A connection to an SQLite3 database; not used if index is specified
+        @param comID The ComID of the reach whose upstream reaches are to be discovered
+        @param stopComIDs A set of ComIDs of reaches upstream of which the search will stop
+        @param index PlusFlowIndex to search instead of querying the PlusFlow table
+        
+        @return A tuple (list, list) containing the ComIDs of upstream reaches not in 
+        stopComIDs, and the ComIDs of upstream reaches in stopComIDs at which the search 
+        stopped
+    """
+    stopComIDs = set(stopComIDs)
+    stopComIDs.discard(comID)
+    if not stopComIDs:
+        return (getUpstreamReaches(conn, comID, index), [])
+    
+    if index is not None:
+        row = index.getRow(comID)
+        if row < 0:
+            return ([], [])
+        stop = np.zeros(len(index), dtype=np.bool_)
+        stopRows = [index.getRow(c) for c in stopComIDs]
+        stop[[r for r in stopRows if r >= 0]] = True
+        (upstream, stopped) = index.searchUpstreamRows(np.array([row]), stop)
+        upstream = upstream[~stop[upstream]]
+        return ([int(c) for c in index.comIDs[upstream]], 
+                [int(c) for c in index.comIDs[stopped]])
+    
+    upstreamReaches = []
+    stoppedReaches = []
+    visited = set([comID])
+    stack = [comID]
+    while stack:
+        for u in getPlusFlowPredecessors(conn, stack.pop()):
+            # ComID 0 denotes a headwater reach
+            if u == 0 or u in visited:
+                continue
+            visited.add(u)
+            if u in stopComIDs:
+                stoppedReaches.append(u)
+            else:
+                upstreamReaches.append(u)
+                stack.append(u)
+    return (upstreamReaches, stoppedReaches)
+
+
+def getUpstreamReachesForGages(config, gages, index=None, db=None):
+    """ Get the reaches upstream of each of a set of streamflow gages in one pass.
+        Reaches upstream of gages nested within the drainage area of another gage 
+        are only searched once.
+    
+        @param config A Python ConfigParser containing the following sections and options:
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_DB' (absolute path to NHDPlus2 SQLite3 database)
+        @param gages A list of gages, each either an integer representing the ComID of the gage
+        reach, or a tuple(string, float) representing the reachcode and measure of the gage
+        @param index PlusFlowIndex to search for upstream reaches; if None, an index will be 
+        built from the NHDPlus2 DB
+        @param db NHDPlusDatabase to query; if None, the database shared by all callers 
+        in this process for the database named in config will be used
+        
+        @return A list, in the same order as gages, of sorted numpy arrays of the ComIDs of the
+        gage reach and all reaches upstream of it.  The array will be empty for gages whose 
+        reach could not be found.
+        
+        @raise ConfigParser.NoSectionError
+        @raise ConfigParser.NoOptionError
+        @raise IOError(errno.EACCES) if NHDPlus2 DB is not readable
+    """
+    comIDs = _getComIDsForGages(config, gages, db)
+    
+    if index is None:
+        index = loadPlusFlowIndex(config, db)
+    
+    rows = [index.getRow(comID) for comID in comIDs]
+    results = index.getUpstreamRowsForRows([r for r in rows if r >= 0])
+    
+    upstreamReaches = []
+    for (comID, row) in zip(comIDs, rows):
+        if row >= 0:
+            upstreamReaches.append( index.comIDs[results[row]] )
+        elif comID > 0:
+            # Reach has no neighbors in the PlusFlow graph
+            upstreamReaches.append( np.array([comID], dtype=np.int64) )
+        else:
+            upstreamReaches.append( np.zeros(0, dtype=np.int64) )
+    
+    return upstreamReaches
+
+
+def _getComIDsForGages(config, gages, db=None):
+    """ Resolve ComIDs of gages identified by reachcode and measure
+    
+        @param config A Python ConfigParser containing the following sections and options:
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_DB' (absolute path to NHDPlus2 SQLite3 database)
+        @param gages A list of gages, each either an integer representing the ComID of the gage
+        reach, or a tuple(string, float) representing the reachcode and measure of the gage
+        @param db NHDPlusDatabase to query
+        
+        @return A list of integers representing ComIDs of gage reaches, -1 for gages whose 
+        reach could not be found
+    """
+    comIDs = []
+    conn = None
+    for gage in gages:
+        if isinstance(gage, tuple):
+            if conn is None:
+                db = _getNHDPlusDatabase(config, db)
+                conn = db.getConnection()
+            comIDs.append( getComIdForStreamGage(conn, gage[0], gage[1]) )
+        else:
+            comIDs.append( int(gage) )
+    if conn is not None:
+        db.releaseConnection(conn)
+    return comIDs
+
+
+def loadDownstreamIndex(config, db=None):
+    """ Build an in-memory index of the downstream reach of each reach in the 
+        NHDPlus2 DB.  The index can be passed to downstream network analysis functions 
+        to avoid issuing an SQL query for each reach visited.
+        
+        @note If a network snapshot is configured, the index will be memory mapped from
+        the snapshot instead of being built from the NHDPlus2 DB.
+    
+        @param config A Python ConfigParser containing the following sections and options:
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_DB' (absolute path to NHDPlus2 SQLite3 database)
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_NETWORK' (optional, absolute path of network snapshot 
+            directory, see saveNetworkSnapshot)
+        @param db NHDPlusDatabase to query; if None, the database shared by all callers 
+        in this process for the database named in config will be used
+         
+        @return DownstreamIndex
+        
+        @raise ConfigParser.NoSectionError
+        @raise ConfigParser.NoOptionError
+        @raise IOError(errno.EACCES) if NHDPlus2 DB is not readable
+    """
+    if config.has_option('NHDPLUS2', 'PATH_OF_NHDPLUS2_NETWORK'):
+        return loadNetworkSnapshot(config.get('NHDPLUS2', 'PATH_OF_NHDPLUS2_NETWORK'))[1]
     
-    if len(upstream_reaches) == 1 and upstream_reaches[0] == 0:
-        # We're at a headwater reach
-        return
+    db = _getNHDPlusDatabase(config, db)
+    with db.connection() as conn:
+        index = DownstreamIndex.fromDatabase(conn)
+    
+    return index
+
 
-    # Foreach reach upstream of this reach
-    for u in upstream_reaches:
-        # Record the upstream reach
-        allUpstreamReaches.append(u)
-        # Find reaches upstream of it
-        getUpstreamReachesSQL(conn, u, allUpstreamReaches)
+def getDownstreamPathsForGages(config, gages, index=None, db=None):
+    """ Get the flow path from each of a set of streamflow gages to its terminal reach.
+        Flow paths follow the main path at divergences.
+    
+        @param config A Python ConfigParser containing the following sections and options:
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_DB' (absolute path to NHDPlus2 SQLite3 database)
+        @param gages A list of gages, each either an integer representing the ComID of the gage
+        reach, or a tuple(string, float) representing the reachcode and measure of the gage
+        @param index DownstreamIndex to search; if None, an index will be built from the 
+        NHDPlus2 DB
+        @param db NHDPlusDatabase to query; if None, the database shared by all callers 
+        in this process for the database named in config will be used
+        
+        @return A list, in the same order as gages, of tuples of numpy arrays (ComIDs, lengths).
+        ComIDs are ordered from the gage reach to the terminal reach; lengths[i] is the 
+        cumulative length, in kilometers, of reaches 0 through i.  Both arrays are empty 
+        for gages whose reach could not be found.
+        
+        @raise ConfigParser.NoSectionError
+        @raise ConfigParser.NoOptionError
+        @raise IOError(errno.EACCES) if NHDPlus2 DB is not readable
+    """
+    comIDs = _getComIDsForGages(config, gages, db)
+    if index is None:
+        index = loadDownstreamIndex(config, db)
+    return index.getDownstreamPaths(comIDs)
 
 
-def getFirstOrderUpstreamReachesNotInSet(config, comID, comIdsInSet, maxdepth=30):
+def getNetworkDistancesForGages(config, gages, index=None, db=None):
+    """ Get the in-channel distances between each pair of a set of streamflow gages.  
+        Distances are measured between the downstream ends of gage reaches along their 
+        flow paths to the confluence where the paths meet.
+    
+        @param config A Python ConfigParser containing the following sections and options:
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_DB' (absolute path to NHDPlus2 SQLite3 database)
+        @param gages A list of gages, each either an integer representing the ComID of the gage
+        reach, or a tuple(string, float) representing the reachcode and measure of the gage
+        @param index DownstreamIndex to search; if None, an index will be built from the 
+        NHDPlus2 DB
+        @param db NHDPlusDatabase to query; if None, the database shared by all callers 
+        in this process for the database named in config will be used
+        
+        @return Symmetric numpy array of shape (len(gages), len(gages)) of distances in 
+        kilometers.  Distances between gages that do not share a flow path, or whose 
+        reach could not be found, are NaN.
+        
+        @raise ConfigParser.NoSectionError
+        @raise ConfigParser.NoOptionError
+        @raise IOError(errno.EACCES) if NHDPlus2 DB is not readable
+    """
+    comIDs = _getComIDsForGages(config, gages, db)
+    if index is None:
+        index = loadDownstreamIndex(config, db)
+    return index.getNetworkDistances(comIDs)
+
+
+def accumulateUpstreamAttributes(config, values, divergenceRouting=DIVERGENCE_ROUTING_MAIN,
+                                index=None, db=None):
+    """ Accumulate attributes of every reach in the PlusFlow network over all reaches 
+        upstream of it, in a single pass in topological order (see PlusFlowIndex.accumulate)
+    
+        @code
+        # Drainage area and total stream length
+        (comIDs, totals) = accumulateUpstreamAttributes(config, ['AreaSqKM', 'LengthKM'])
+        # Total stream length by stream order
+        index = loadPlusFlowIndex(config)
+        with NHDPlusDatabase.fromConfig(config).connection() as conn:
+            (lengths, orders) = getFlowlineAttributes(conn, index, ['LengthKM', 'StreamOrde']).T
+        values = np.column_stack([lengths * (orders == o) for o in xrange(1, 11)])
+        (comIDs, totals) = accumulateUpstreamAttributes(config, values, index=index)
+        @endcode
+    
+        @param config A Python ConfigParser containing the following sections and options:
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_DB' (absolute path to NHDPlus2 SQLite3 database)
+        @param values Either a list of strings representing names of numeric PlusFlowlineVAA
+        columns to accumulate (e.g. ['AreaSqKM', 'LengthKM']), or a numpy array of shape 
+        (len(index), k) of values indexed by the rows of index
+        @param divergenceRouting String representing how accumulated values are routed 
+        at divergences: DIVERGENCE_ROUTING_MAIN to route all to the main path (as for 
+        DivDASqKM), DIVERGENCE_ROUTING_EQUAL to split equally among the paths, or 
+        DIVERGENCE_ROUTING_NONE to route all to every path
+        @param index PlusFlowIndex of the network; if None, an index will be built from 
+        the NHDPlus2 DB
+        @param db NHDPlusDatabase to query; if None, the database shared by all callers 
+        in this process for the database named in config will be used
+        
+        @return A tuple (comIDs, accumulated), where comIDs is a numpy array of the ComIDs
+        of reaches in the PlusFlow network, and accumulated is a numpy array of shape 
+        (len(comIDs), k) of accumulated values in the same order
+        
+        @raise ConfigParser.NoSectionError
+        @raise ConfigParser.NoOptionError
+        @raise IOError(errno.EACCES) if NHDPlus2 DB is not readable
+        @raise ValueError if divergenceRouting is not known
+    """
+    if not divergenceRouting in (DIVERGENCE_ROUTING_MAIN, DIVERGENCE_ROUTING_EQUAL, 
+                                 DIVERGENCE_ROUTING_NONE):
+        raise ValueError("Divergence routing '%s' is not known" % (divergenceRouting,))
+    if index is None:
+        index = loadPlusFlowIndex(config, db)
+    
+    divergence = None
+    if isinstance(values, np.ndarray):
+        values = values.reshape((len(index), -1))
+    else:
+        columns = list(values)
+        if divergenceRouting == DIVERGENCE_ROUTING_MAIN:
+            columns.append('Divergence')
+        db = _getNHDPlusDatabase(config, db)
+        with db.connection() as conn:
+            values = getFlowlineAttributes(conn, index, columns)
+        if divergenceRouting == DIVERGENCE_ROUTING_MAIN:
+            divergence = values[:,-1]
+            values = values[:,:-1]
+    
+    if divergenceRouting == DIVERGENCE_ROUTING_MAIN:
+        if divergence is None:
+            db = _getNHDPlusDatabase(config, db)
+            with db.connection() as conn:
+                divergence = getFlowlineAttributes(conn, index, ['Divergence'])[:,0]
+        fractions = index.getMainPathDivergenceFractions(divergence)
+    elif divergenceRouting == DIVERGENCE_ROUTING_EQUAL:
+        fractions = index.getEqualDivergenceFractions()
+    else:
+        fractions = None
+    
+    return (index.comIDs, index.accumulate(values, fractions))
+
+
+def getFirstOrderUpstreamReachesNotInSet(config, comID, comIdsInSet, maxdepth=30, index=None, db=None):
     """ Search for upstream reaches downstream of reaches in the specified set.
     
         @param config A Python ConfigParser containing the following
@@ -256,30 +731,28 @@ def getFirstOrderUpstreamReachesNotInSet(config, comID, comIdsInSet, maxdepth=30
         are to be discovered
         @param comIdsInSet A set containing candidate comids
         @param upstreamReaches List containing integers representing comIDs of upstream reaches in set comIdsInSet
-        @param maxdepth Integer representing maximum depth of recursion
+        @param maxdepth Integer representing maximum depth of search
+        @param index PlusFlowIndex to search instead of querying the PlusFlow table
+        @param db NHDPlusDatabase to query; if None, the database shared by all callers 
+        in this process for the database named in config will be used
         
         @return Set containing first order upstream reaches in set
         
         @raise ConfigParser.NoSectionError
         @raise ConfigParser.NoOptionError
     """
-    nhddbPath = config.get('NHDPLUS2', 'PATH_OF_NHDPLUS2_DB')
-    if not os.access(nhddbPath, os.R_OK):
-        raise IOError(errno.EACCES, "The database at %s is not readable" %
-                      nhddbPath)
-    nhddbPath = os.path.abspath(nhddbPath)
-    
-    # Connect to DB
-    conn = sqlite3.connect(nhddbPath)
+    db = _getNHDPlusDatabase(config, db)
     
     upstreamReaches = set()
     depth = 0
-    getFirstOrderUpstreamReachesNotInSetSQL(conn, comID, comIdsInSet, upstreamReaches, depth, maxdepth)
+    with db.connection() as conn:
+        getFirstOrderUpstreamReachesNotInSetSQL(conn, comID, comIdsInSet, upstreamReaches, depth, maxdepth, index)
     return list(upstreamReaches)
 
 
-def getFirstOrderUpstreamReachesNotInSetSQL(conn, comID, comIdsInSet, upstreamReaches, depth, maxdepth):
-    """ Recursively search for upstream reaches downstream of reaches in the specified set.
+def getFirstOrderUpstreamReachesNotInSetSQL(conn, comID, comIdsInSet, upstreamReaches, depth, maxdepth, index=None):
+    """ Search for upstream reaches downstream of reaches in the specified set.  Reaches 
+        are searched breadth-first, so that each reach is visited once, at its minimum depth.
     
         @param conn An sqlite3 connection to a database that has NHDPlus2 tables
         @param comID The ComID of the reach whose upstream reaches downstream of those in the set
@@ -287,34 +760,32 @@ def getFirstOrderUpstreamReachesNotInSetSQL(conn, comID, comIdsInSet, upstreamRe
         @param comIdsInSet A set containing candidate comids
         @param upstreamReaches Set containing integers representing comIDs of upstream reaches in set comIdsInSet
         @param depth Integer current depth
-        @param maxdepth Integer representing maximum depth of recursion
+        @param maxdepth Integer representing maximum depth of search
+        @param index PlusFlowIndex to search instead of querying the PlusFlow table
         
     """
-    if depth > maxdepth:
-        return
-    
-    upstream_reaches = getPlusFlowPredecessors(conn, comID)
-    if len(upstream_reaches) == 0:
-        return
-    
-    if len(upstream_reaches) == 1 and upstream_reaches[0] == 0:
-        # We're at a headwater reach
-        return
-
-    # Foreach reach upstream of this reach
-    for u in upstream_reaches:
-        #print("\timmediate upstream: %s" % (type(u),) )
-        # Return if upstream reach is in set
-        if u in comIdsInSet:
-            return
-        else:
+    visited = set([comID])
+    queue = collections.deque([(comID, depth)])
+    while queue:
+        (c, d) = queue.popleft()
+        if d > maxdepth:
+            continue
+        for u in getPlusFlowPredecessors(conn, c, index):
+            # ComID 0 denotes a headwater reach
+            if u == 0:
+                continue
+            # Stop searching upstream of this reach if upstream reach is in set
+            if u in comIdsInSet:
+                break
             # Keep looking in other upstream branches for first order reaches in set
             upstreamReaches.add(u)
-            getFirstOrderUpstreamReachesNotInSetSQL(conn, u, comIdsInSet, upstreamReaches, depth + 1, maxdepth)
+            if u not in visited:
+                visited.add(u)
+                queue.append( (u, d + 1) )
 
 
 
-def getFirstOrderUpstreamReachesInSet(config, comID, comIdsInSet, maxdepth=30):
+def getFirstOrderUpstreamReachesInSet(config, comID, comIdsInSet, maxdepth=30, index=None, db=None):
     """ Search for first-order upstream reaches in the specified set.
     
         @param config A Python ConfigParser containing the following
@@ -324,142 +795,264 @@ def getFirstOrderUpstreamReachesInSet(config, comID, comIdsInSet, maxdepth=30):
         @param comID The ComID of the reach whose first-order upstream reaches are to be discovered
         @param comIdsInSet A set containing candidate comids
         @param upstreamReaches List containing integers representing comIDs of upstream reaches in set comIdsInSet
-        @param maxdepth Integer representing maximum depth of recursion
+        @param maxdepth Integer representing maximum depth of search
+        @param index PlusFlowIndex to search instead of querying the PlusFlow table
+        @param db NHDPlusDatabase to query; if None, the database shared by all callers 
+        in this process for the database named in config will be used
         
         @return Set containing first order upstream reaches in set
         
         @raise ConfigParser.NoSectionError
         @raise ConfigParser.NoOptionError
     """
-    nhddbPath = config.get('NHDPLUS2', 'PATH_OF_NHDPLUS2_DB')
-    if not os.access(nhddbPath, os.R_OK):
-        raise IOError(errno.EACCES, "The database at %s is not readable" %
-                      nhddbPath)
-    nhddbPath = os.path.abspath(nhddbPath)
-    
-    # Connect to DB
-    conn = sqlite3.connect(nhddbPath)
+    db = _getNHDPlusDatabase(config, db)
     
     upstreamReaches = set()
     depth = 0
-    getFirstOrderUpstreamReachesInSetSQL(conn, comID, comIdsInSet, upstreamReaches, depth, maxdepth)
+    with db.connection() as conn:
+        getFirstOrderUpstreamReachesInSetSQL(conn, comID, comIdsInSet, upstreamReaches, depth, maxdepth, index)
     return list(upstreamReaches)
 
 
-def getFirstOrderUpstreamReachesInSetSQL(conn, comID, comIdsInSet, upstreamReaches, depth, maxdepth):
-    """ Recursively search for first-order upstream reaches in the specified set.
+def getFirstOrderUpstreamReachesInSetSQL(conn, comID, comIdsInSet, upstreamReaches, depth, maxdepth, index=None):
+    """ Search for first-order upstream reaches in the specified set.  Reaches are
+        searched breadth-first, so that each reach is visited once, at its minimum depth.
     
         @param conn An sqlite3 connection to a database that has NHDPlus2 tables
         @param comID The ComID of the reach whose first-order upstream reaches are to be discovered
         @param comIdsInSet A set containing candidate comids
         @param upstreamReaches Set containing integers representing comIDs of upstream reaches in set comIdsInSet
         @param depth Integer current depth
-        @param maxdepth Integer representing maximum depth of recursion
+        @param maxdepth Integer representing maximum depth of search
+        @param index PlusFlowIndex to search instead of querying the PlusFlow table
         
     """
-    if depth > maxdepth:
-        return
-    
-    upstream_reaches = getPlusFlowPredecessors(conn, comID)
-    if len(upstream_reaches) == 0:
-        return
-    
-    if len(upstream_reaches) == 1 and upstream_reaches[0] == 0:
-        # We're at a headwater reach
-        return
-
-    # Foreach reach upstream of this reach
-    for u in upstream_reaches:
-        #print("\timmediate upstream: %s" % (type(u),) )
-        # Record the upstream reach if it is in set
-        if u in comIdsInSet:
-            upstreamReaches.add(u)
-        else:
-            # Keep looking in other upstream branches for first order reaches in set
-            getFirstOrderUpstreamReachesInSetSQL(conn, u, comIdsInSet, upstreamReaches, depth + 1, maxdepth)
+    visited = set([comID])
+    queue = collections.deque([(comID, depth)])
+    while queue:
+        (c, d) = queue.popleft()
+        if d > maxdepth:
+            continue
+        for u in getPlusFlowPredecessors(conn, c, index):
+            # ComID 0 denotes a headwater reach
+            if u == 0:
+                continue
+            # Record the upstream reach if it is in set
+            if u in comIdsInSet:
+                upstreamReaches.add(u)
+            elif u not in visited:
+                # Keep looking in other upstream branches for first order reaches in set
+                visited.add(u)
+                queue.append( (u, d + 1) )
 
         
-def getBoundingBoxForCatchmentsForGage(config, outputDir, reachcode, measure, deleteIntermediateFiles=True):
+def getBoundingBoxForCatchmentsForGage(config, outputDir, reachcode, measure, deleteIntermediateFiles=True,
+                                       index=None, db=None):
     """ Get bounding box coordinates (in WGS 84) for the drainage area associated with a given NHD 
         (National Hydrography Dataset) streamflow gage identified by a reach code and measure.
         
+        @note If the catchment feature DB contains an envelope table (see createCatchmentEnvelopeTable),
+        the bounding box will be computed from the envelopes of catchment features without 
+        reading their geometries.
+        
         @param config A Python ConfigParser containing the following sections and options:
-            'GDAL/OGR' and option 'PATH_OF_OGR2OGR' (absolute path of ogr2ogr binary)
             'NHDPLUS2' and option 'PATH_OF_NHDPLUS2_DB' (absolute path to SQLite3 DB of NHDFlow data)
             'NHDPLUS2', 'PATH_OF_NHDPLUS2_CATCHMENT' (absolute path to NHD catchment SQLite3 spatial DB)
-        @param outputDir String representing the absolute/relative path of the directory into which output rasters should be written
+        @param outputDir Unused, retained for compatibility
         @param reachcode String representing NHD streamflow gage 
         @param measure Float representing the measure along reach where Stream Gage is located 
             in percent from downstream end of the one or more NHDFlowline features that are 
             assigned to the ReachCode (see NHDPlusV21 GageLoc table)
-        @param deleteIntermediateFiles A boolean, True if intermediate files generated from the analysis should be deleted
+        @param deleteIntermediateFiles Unused, retained for compatibility
+        @param index PlusFlowIndex to search for upstream reaches instead of querying the PlusFlow table
+        @param db NHDPlusDatabase to query; if None, the database shared by all callers 
+        in this process for the database named in config will be used
          
         @return A dictionary with keys: minX, minY, maxX, maxY, srs. The key srs is set to 'EPSG:4326' (WGS 84)
         
         @raise ConfigParser.NoSectionError
         @raise ConfigParser.NoOptionError
-        @raise IOError(errno.ENOTDIR) if outputDir is not a directory
-        @raise IOError(errno.EACCESS) if outputDir is not writable
+        @raise Exception if no reach or no catchment features are found for the gage
     """
-    nhddbPath = config.get('NHDPLUS2', 'PATH_OF_NHDPLUS2_DB')
-    if not os.access(nhddbPath, os.R_OK):
-        raise IOError(errno.EACCES, "The database at %s is not readable" %
-                      nhddbPath)
-    nhddbPath = os.path.abspath(nhddbPath)
+    db = _getNHDPlusDatabase(config, db)
+    with db.connection() as conn:
+        comID = getComIdForStreamGage(conn, reachcode, measure)
+        #sys.stderr.write("Gage with reachcode %s, measure %f has ComID %d" % (reachcode, measure, comID))
+        if comID == -1:
+            raise Exception("No reach found for gage with reachcode %s, measure %f" % 
+                            (reachcode, float(measure)))
         
-    catchmentFeatureDBPath = config.get('NHDPLUS2', 'PATH_OF_NHDPLUS2_CATCHMENT')
-    if not os.access(catchmentFeatureDBPath, os.R_OK):
-        raise IOError(errno.EACCES, "The catchment feature DB at %s is not readable" %
-                      catchmentFeatureDBPath)
-    catchmentFeatureDBPath = os.path.abspath(catchmentFeatureDBPath)
+        # Get upstream reaches
+        upstream_reaches = getUpstreamReaches(conn, comID, index)
     
-    ogrCmdPath = config.get('GDAL/OGR', 'PATH_OF_OGR2OGR')
-    if not os.access(ogrCmdPath, os.X_OK):
-        raise IOError(errno.EACCES, "The ogr2ogr binary at %s is not executable" %
-                      ogrCmdPath)
-    ogrCmdPath = os.path.abspath(ogrCmdPath)
+    # Reduce envelopes of upstream catchments
+    (poDS, poLayer) = openCatchmentLayer(config)
+    extent = _getCatchmentExtentForReaches(poDS, poLayer, [comID] + upstream_reaches)
     
-    if not os.path.isdir(outputDir):
-        raise IOError(errno.ENOTDIR, "Output directory %s is not a directory" % (outputDir,))
-    if not os.access(outputDir, os.W_OK):
-        raise IOError(errno.EACCES, "Not allowed to write to output directory %s" % (outputDir,))
-    outputDir = os.path.abspath(outputDir)
+    return getBoundingBoxForExtent(extent, poLayer.GetSpatialRef())
+
+
+def createCatchmentEnvelopeTable(catchmentFeatureDBPath):
+    """ Create a table of the envelopes of catchment features in a catchment feature DB.
+        Existing envelopes will be replaced.
     
-    # Connect to DB
-    conn = sqlite3.connect(nhddbPath)
+        @param catchmentFeatureDBPath String representing the path of the NHD catchment 
+        SQLite3 spatial DB
+        
+        @note If the catchment features have a SpatiaLite or GeoPackage spatial index,
+        envelopes are copied from the R-tree of the spatial index, without reading 
+        catchment geometries.  R-tree bounds are single-precision, and are rounded 
+        outward, so envelopes may be very slightly larger than the features.
+        
+        @return Integer representing the number of envelopes stored
+    """
+    conn = sqlite3.connect(catchmentFeatureDBPath)
+    spatialIndex = _getSpatialIndex(conn, CATCHMENT_LAYER)
+    if spatialIndex is not None:
+        (rtree, idColumn, minX, maxX, minY, maxY) = spatialIndex
+        conn.execute("DROP TABLE IF EXISTS %s" % (CATCHMENT_ENVELOPE_TABLE,))
+        conn.execute("""CREATE TABLE %s
+(featureid INTEGER PRIMARY KEY,
+minx REAL,
+maxx REAL,
+miny REAL,
+maxy REAL)""" % (CATCHMENT_ENVELOPE_TABLE,))
+        # Merge envelopes of features sharing a featureid
+        cursor = conn.execute("""INSERT INTO %s 
+SELECT c.featureid, MIN(r.%s), MAX(r.%s), MIN(r.%s), MAX(r.%s)
+FROM %s AS c JOIN %s AS r ON r.%s=c.ROWID
+GROUP BY c.featureid""" % \
+            (CATCHMENT_ENVELOPE_TABLE, minX, maxX, minY, maxY, CATCHMENT_LAYER, rtree, idColumn))
+        numEnvelopes = cursor.rowcount
+        conn.commit()
+        conn.close()
+        return numEnvelopes
+    conn.close()
     
-    comID = getComIdForStreamGage(conn, reachcode, measure)
-    #sys.stderr.write("Gage with reachcode %s, measure %f has ComID %d" % (reachcode, measure, comID))
+    # Read envelopes of catchment features
+    envelopes = {}
+    ogr.UseExceptions()
+    poDS = ogr.Open(catchmentFeatureDBPath, OGR_UPDATE_MODE)
+    if not poDS:
+        raise Exception("Unable to open catchment feature database %s" % (catchmentFeatureDBPath,))
+    assert(poDS.GetLayerCount() > 0)
+    poLayer = poDS.GetLayerByName(CATCHMENT_LAYER)
+    if poLayer is None:
+        poLayer = poDS.GetLayer(0)
+    assert(poLayer)
+    poLayer.ResetReading()
+    inFeature = poLayer.GetNextFeature()
+    while inFeature:
+        geom = inFeature.GetGeometryRef()
+        if geom is not None:
+            featureid = inFeature.GetFieldAsInteger('featureid')
+            (minX, maxX, minY, maxY) = geom.GetEnvelope()
+            envelope = envelopes.get(featureid)
+            if envelope is not None:
+                # Merge envelopes of features sharing a featureid
+                (minX, maxX, minY, maxY) = (min(minX, envelope[0]), max(maxX, envelope[1]),
+                                            min(minY, envelope[2]), max(maxY, envelope[3]))
+            envelopes[featureid] = (minX, maxX, minY, maxY)
+        inFeature.Destroy()
+        inFeature = poLayer.GetNextFeature()
+    poDS = None
     
-    # Get upstream reaches
-    upstream_reaches = []
-    getUpstreamReachesSQL(conn, comID, upstream_reaches)
-    #sys.stderr.write("Upstream reaches: ")
-    #sys.stderr.write(upstream_reaches)
+    # Store envelopes
+    conn = sqlite3.connect(catchmentFeatureDBPath)
+    cursor = conn.cursor()
+    cursor.execute("DROP TABLE IF EXISTS %s" % (CATCHMENT_ENVELOPE_TABLE,))
+    cursor.execute("""CREATE TABLE %s
+(featureid INTEGER PRIMARY KEY,
+minx REAL,
+maxx REAL,
+miny REAL,
+maxy REAL)""" % (CATCHMENT_ENVELOPE_TABLE,))
+    cursor.executemany("INSERT INTO %s VALUES (?,?,?,?,?)" % (CATCHMENT_ENVELOPE_TABLE,),
+                       ((k,) + v for (k, v) in envelopes.iteritems()))
+    conn.commit()
+    conn.close()
+    
+    return len(envelopes)
+
+
+def _getSpatialIndex(conn, tableName):
+    """ Find the R-tree of the SpatiaLite or GeoPackage spatial index of a feature table
+    
+        @param conn sqlite3.Connection to a spatial DB
+        @param tableName String representing the name of the feature table
+        
+        @return Tuple of the form (rtreeName, idColumn, minXColumn, maxXColumn, minYColumn, 
+        maxYColumn), or None if the table has no spatial index.  idColumn holds the 
+        ROWID of the feature.
+    """
+    tables = set([row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")])
+    if 'geometry_columns' in tables:
+        # SpatiaLite
+        try:
+            rows = conn.execute("SELECT f_geometry_column FROM geometry_columns " \
+                                "WHERE lower(f_table_name)=lower(?) AND spatial_index_enabled=1",
+                                (tableName,)).fetchall()
+        except sqlite3.OperationalError:
+            # Not a SpatiaLite DB (e.g. a DB written by the OGR SQLite driver)
+            rows = []
+        for row in rows:
+            rtree = "idx_%s_%s" % (tableName, row[0])
+            if rtree in tables:
+                return (rtree, 'pkid', 'xmin', 'xmax', 'ymin', 'ymax')
+    if 'gpkg_extensions' in tables:
+        # GeoPackage
+        rows = conn.execute("SELECT column_name FROM gpkg_extensions " \
+                            "WHERE lower(table_name)=lower(?) AND extension_name='gpkg_rtree_index'",
+                            (tableName,)).fetchall()
+        for row in rows:
+            rtree = "rtree_%s_%s" % (tableName, row[0])
+            if rtree in tables:
+                return (rtree, 'id', 'minx', 'maxx', 'miny', 'maxy')
+    return None
+
+
+def unionGeometries(geometries, processes=1):
+    """ Union geometries using a cascaded union, which is much faster than 
+        unioning geometries one at a time.
     
-    # Extract polygons for upstream catchments
-    catchmentOut = os.path.join(outputDir, "catchment-%s.shp" % time.time())
-    ogrCommand = "%s -s_srs EPSG:4326 -t_srs EPSG:4326  -f 'ESRI Shapefile' -sql 'SELECT * FROM catchment WHERE featureid=%s" % (ogrCmdPath, comID) # NHDPlusV2
-    for reach in upstream_reaches:
-        ogrCommand = ogrCommand + " OR featureid=%s" % reach # NHDPlusV2
-    ogrCommand = ogrCommand +"' " + catchmentOut + " " + catchmentFeatureDBPath  
-    #sys.stderr.write("ogr command: %s" % ogrCommand)
-    os.system(ogrCommand)
+        @param geometries List of Shapely geometries to union
+        @param processes Integer representing the number of processes to use.  If greater 
+        than 1, geometries will be partitioned into spatially contiguous groups, each group
+        will be unioned in a separate process, and the results will be unioned.
+        
+        @return Shapely geometry representing the union of geometries
+    """
+    numGeometries = len(geometries)
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    assert(type(processes) == int)
+    assert(processes > 0)
+    if processes == 1 or numGeometries < processes * UNION_MIN_PARTITION_SIZE:
+        return unary_union(geometries)
     
-    bbox = getBoundingBoxForShapefile(catchmentOut)
+    # Partition geometries into vertical strips of adjacent geometries, ordered by centroid
+    geometries = sorted(geometries, key=lambda g: (g.centroid.x, g.centroid.y))
+    partitionSize = int(math.ceil(float(numGeometries) / processes))
+    tasks = []
+    for i in xrange(0, numGeometries, partitionSize):
+        tasks.append( [dumps(g) for g in geometries[i:i+partitionSize]] )
     
-    # Clean-up temporary shapefile/ancillary files
-    if deleteIntermediateFiles:
-        deleteShapefile(catchmentOut)
+    pool = multiprocessing.Pool( processes )
+    results = pool.map(_unionWKBGeometries, tasks)
+    pool.close()
+    pool.join()
     
-    conn.close()
+    return unary_union( [loads(r) for r in results] )
+
 
-    return bbox
+def _unionWKBGeometries(wkbs):
+    return dumps( unary_union( [loads(w) for w in wkbs] ) )
 
 
 def getCatchmentFeaturesForReaches(config, outputDir,
                                    catchmentFilename, reaches,
-                                   format=OGR_SHAPEFILE_DRIVER_NAME):
+                                   format=OGR_SHAPEFILE_DRIVER_NAME,
+                                   processes=1, simplifyTolerances=None):
     """ Get features (in WGS 84) for the drainage area associated with a
         set of NHD (National Hydrography Dataset) stream reaches.
         
@@ -467,6 +1060,8 @@ def getCatchmentFeaturesForReaches(config, outputDir,
         sections and options:
             'PATH_OF_NHDPLUS2_CATCHMENT' (absolute path to
             NHD catchment shapefile)
+            'NHDPLUS2', 'NHDPLUS2_CATCHMENT_SIMPLIFY_TOLERANCES' (optional, comma-separated
+            list of tolerances at which to write simplified catchment features)
         @param outputDir String representing the absolute/relative
         path of the directory into which output rasters should be
         written
@@ -474,6 +1069,12 @@ def getCatchmentFeaturesForReaches(config, outputDir,
         save catchment features to.  The appropriate extension will be added to the file name
         @param reaches List representing catchment features to be output
         @param format String representing OGR driver to use
+        @param processes Integer representing the number of processes to use to union
+        catchment features (see unionGeometries)
+        @param simplifyTolerances List of floats representing tolerances, in units of the 
+        spatial reference of the catchment features, at which to also write simplified 
+        catchment features (see writeSimplifiedCatchmentFeatures); if None, tolerances will
+        be read from config
         
         @return String representing the name of the dataset in outputDir created to hold
         the features
@@ -496,12 +1097,23 @@ def getCatchmentFeaturesForReaches(config, outputDir,
         RuntimeError: TopologyException: found non-noded intersection between LINESTRING (-77.9145 37.0768, -77.9147 37.0768) and LINESTRING (-77.9147 37.0768, -77.9145 37.0768) at -77.914621661942761 37.076822779115943
     
     """
-    catchmentFeatureDBPath = config.get('NHDPLUS2', 'PATH_OF_NHDPLUS2_CATCHMENT')
-    if not os.access(catchmentFeatureDBPath, os.R_OK):
-        raise IOError(errno.EACCES, "The catchment feature DB at %s is not readable" %
-                      catchmentFeatureDBPath)
-    catchmentFeatureDBPath = os.path.abspath(catchmentFeatureDBPath)
+    (name, catchmentFilepath) = _getCatchmentOutputPath(outputDir, catchmentFilename, format)
+    (poDS, poLayer) = openCatchmentLayer(config)
     
+    polygon = _getCatchmentPolygonForReaches(poDS, poLayer, reaches, processes=processes)
+    _writeCatchmentPolygon(poLayer, catchmentFilepath, polygon, format)
+    writeSimplifiedCatchmentFeatures(poLayer, outputDir, catchmentFilename, polygon, format,
+                                     _getSimplifyTolerances(config, simplifyTolerances))
+        
+    return name
+
+
+def _getCatchmentOutputPath(outputDir, catchmentFilename, format):
+    """ Check output directory and format of catchment dataset
+    
+        @return A tuple (string, string) representing the name and path of the 
+        catchment dataset
+    """
     if not os.path.isdir(outputDir):
         raise IOError(errno.ENOTDIR, "Output directory %s is not a directory" % (outputDir,))
     if not os.access(outputDir, os.W_OK):
@@ -513,16 +1125,288 @@ def getCatchmentFeaturesForReaches(config, outputDir,
     
     catchmentFilename ="%s%s%s" % ( catchmentFilename, os.extsep, OGR_DRIVERS[format] )
     catchmentFilepath = os.path.join(outputDir, catchmentFilename)
+    return (catchmentFilename, catchmentFilepath)
+
+
+def openCatchmentLayer(config):
+    """ Open catchment feature layer
+    
+        @param config A Python ConfigParser containing the following sections and options:
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_CATCHMENT' (absolute path to NHD catchment SQLite3 spatial DB)
+    
+        @return A tuple (ogr.DataSource, ogr.Layer).  The data source must be kept 
+        referenced for as long as the layer is used.
+    """
+    catchmentFeatureDBPath = config.get('NHDPLUS2', 'PATH_OF_NHDPLUS2_CATCHMENT')
+    return _openFeatureLayer(catchmentFeatureDBPath, 'catchment', CATCHMENT_LAYER)
+
+
+def openFlowlineLayer(config):
+    """ Open flowline feature layer
+    
+        @param config A Python ConfigParser containing the following sections and options:
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_FLOWLINE' (absolute path to NHD flowline SQLite3 spatial DB)
+    
+        @return A tuple (ogr.DataSource, ogr.Layer).  The data source must be kept 
+        referenced for as long as the layer is used.
+    """
+    flowlineFeatureDBPath = config.get('NHDPLUS2', 'PATH_OF_NHDPLUS2_FLOWLINE')
+    return _openFeatureLayer(flowlineFeatureDBPath, 'flowline', FLOWLINE_LAYER)
+
+
+def _openFeatureLayer(featureDBPath, description, layerName):
+    if not os.access(featureDBPath, os.R_OK):
+        raise IOError(errno.EACCES, "The %s feature DB at %s is not readable" %
+                      (description, featureDBPath))
+    featureDBPath = os.path.abspath(featureDBPath)
     
     # Open input layer
     ogr.UseExceptions()
-    poDS = ogr.Open(catchmentFeatureDBPath, OGR_UPDATE_MODE)
+    poDS = ogr.Open(featureDBPath, OGR_UPDATE_MODE)
     if not poDS:
-        raise Exception("Unable to open catchment feature database %s" (catchmentFeatureDBPath,))
+        raise Exception("Unable to open %s feature database %s" % (description, featureDBPath))
     assert(poDS.GetLayerCount() > 0)
-    poLayer = poDS.GetLayer(0)
+    # Feature DBs may also hold non-spatial tables (e.g. catchment envelopes)
+    poLayer = poDS.GetLayerByName(layerName)
+    if poLayer is None:
+        poLayer = poDS.GetLayer(0)
     assert(poLayer)
+    return (poDS, poLayer)
+
+
+def _loadReachTable(poDS, reaches):
+    """ Replace the contents of the temporary table of reaches in a feature DB
     
+        @param poDS ogr.DataSource of catchment or flowline feature SQLite3 DB
+        @param reaches List representing reaches to be stored
+    """
+    poDS.ExecuteSQL("CREATE TEMP TABLE IF NOT EXISTS %s (comid INTEGER PRIMARY KEY)" % (REACH_TABLE,))
+    poDS.ExecuteSQL("DELETE FROM %s" % (REACH_TABLE,))
+    numReaches = len(reaches)
+    for start in xrange(0, numReaches, REACH_INSERT_SIZE):
+        values = ','.join(["(%d)" % (int(reach),) for reach in reaches[start:start+REACH_INSERT_SIZE]])
+        poDS.ExecuteSQL("INSERT OR IGNORE INTO %s (comid) VALUES %s" % (REACH_TABLE, values))
+
+
+def _hasCatchmentEnvelopeTable(poDS):
+    poResult = poDS.ExecuteSQL("SELECT name FROM sqlite_master WHERE type='table' AND name='%s'" % \
+                               (CATCHMENT_ENVELOPE_TABLE,))
+    hasTable = poResult.GetFeatureCount() > 0
+    poDS.ReleaseResultSet(poResult)
+    return hasTable
+
+
+def _getCatchmentExtentForReaches(poDS, poLayer, reaches):
+    """ Get the extent of catchment features for reaches
+    
+        @param poDS ogr.DataSource of catchment feature SQLite3 DB
+        @param poLayer ogr.Layer of catchment features in poDS
+        @param reaches List representing catchment features whose extent is to be determined
+        
+        @return Tuple of the form (minX, maxX, minY, maxY) in the spatial reference of poLayer
+        
+        @raise Exception if no catchment features are found for reaches
+    """
+    if _hasCatchmentEnvelopeTable(poDS):
+        _loadReachTable(poDS, reaches)
+        poResult = poDS.ExecuteSQL("SELECT MIN(e.minx), MAX(e.maxx), MIN(e.miny), MAX(e.maxy) " \
+                                   "FROM %s AS e JOIN %s AS r ON e.featureid=r.comid" % \
+                                   (CATCHMENT_ENVELOPE_TABLE, REACH_TABLE))
+        feature = poResult.GetNextFeature()
+        extent = None
+        # The aggregates are NULL if no envelopes matched
+        if feature is not None:
+            if all([feature.IsFieldSet(i) for i in xrange(4)]):
+                extent = tuple([feature.GetFieldAsDouble(i) for i in xrange(4)])
+            feature.Destroy()
+        poDS.ReleaseResultSet(poResult)
+    else:
+        extent = _reduceCatchmentEnvelopes(poDS, poLayer, reaches)
+    
+    if extent is None:
+        raise Exception("No catchment features found for reach %s or its upstream reaches" %
+                        (reaches[0] if reaches else None,))
+    return extent
+
+
+def _reduceCatchmentEnvelopes(poDS, poLayer, reaches):
+    """ Reduce the envelopes of the geometries of catchment features for reaches
+    
+        @return Tuple of the form (minX, maxX, minY, maxY), or None if no catchment 
+        features were found
+    """
+    extent = None
+    poResult = _selectCatchmentFeatures(poDS, poLayer, reaches)
+    inFeature = poResult.GetNextFeature()
+    while inFeature:
+        envelope = inFeature.GetGeometryRef().GetEnvelope()
+        if extent is None:
+            extent = envelope
+        else:
+            extent = (min(extent[0], envelope[0]), max(extent[1], envelope[1]),
+                      min(extent[2], envelope[2]), max(extent[3], envelope[3]))
+        inFeature.Destroy()
+        inFeature = poResult.GetNextFeature()
+    poDS.ReleaseResultSet(poResult)
+    return extent
+
+
+def _selectCatchmentFeatures(poDS, poLayer, reaches):
+    """ Select catchment features for reaches by joining the catchment feature layer 
+        against a temporary table of reaches
+    
+        @param poDS ogr.DataSource of catchment feature SQLite3 DB
+        @param poLayer ogr.Layer of catchment features in poDS
+        @param reaches List representing catchment features to be selected
+        
+        @return ogr.Layer of selected features.  Must be released by calling 
+        poDS.ReleaseResultSet when no longer needed. 
+    """
+    return _selectFeaturesForReaches(poDS, poLayer, reaches, 'featureid')
+
+
+def _selectFeaturesForReaches(poDS, poLayer, reaches, comIDField):
+    """ Select features for reaches by joining a feature layer against a temporary
+        table of reaches
+    
+        @param poDS ogr.DataSource of feature SQLite3 DB
+        @param poLayer ogr.Layer of features in poDS
+        @param reaches List representing ComIDs of features to be selected
+        @param comIDField String representing the name of the field of poLayer
+        holding the ComID of each feature
+        
+        @return ogr.Layer of selected features.  Must be released by calling 
+        poDS.ReleaseResultSet when no longer needed. 
+    """
+    _loadReachTable(poDS, reaches)
+    return poDS.ExecuteSQL("SELECT c.* FROM %s AS c JOIN %s AS r ON c.%s=r.comid" % \
+                           (poLayer.GetName(), REACH_TABLE, comIDField))
+
+
+def _getCatchmentPolygonForReaches(poDS, poLayer, reaches, geometries=None, processes=1):
+    """ Dissolve catchment features for reaches into a single polygon
+    
+        @param poDS ogr.DataSource of catchment feature SQLite3 DB
+        @param poLayer ogr.Layer of catchment features in poDS
+        @param reaches List representing catchment features to be dissolved
+        @param geometries List of additional Shapely geometries to dissolve 
+        @param processes Integer representing the number of processes to use to union
+        catchment features (see unionGeometries)
+        
+        @return Shapely Polygon containing only the exterior of the dissolved features
+    """
+    # Collect geometries of catchment features
+    if geometries is None:
+        geometries = []
+    else:
+        geometries = list(geometries)
+    poResult = _selectCatchmentFeatures(poDS, poLayer, reaches)
+    inFeature = poResult.GetNextFeature()
+    while inFeature:
+        geometries.append( loads( inFeature.GetGeometryRef().ExportToWkb() ) )
+        inFeature.Destroy()
+        inFeature = poResult.GetNextFeature()
+    poDS.ReleaseResultSet(poResult)
+    
+    # Union all catchment geometries at once
+    outGeom = unionGeometries(geometries, processes)
+    
+    # Create a new polygon that only contains exterior points
+    if outGeom.is_empty:
+        newPolygon = Polygon()
+    else:
+        outGeom = ogr.ForceToPolygon( ogr.CreateGeometryFromWkb( dumps(outGeom) ) )
+        polygon = loads( outGeom.ExportToWkb() )
+        if polygon.exterior:
+            coords = polygon.exterior.coords
+            newPolygon = Polygon(coords)
+        else:
+            newPolygon = Polygon()
+    
+    return newPolygon
+
+
+def simplifyCatchmentPolygon(polygon, tolerances):
+    """ Simplify a catchment polygon at each of a set of tolerances, preserving topology
+        (i.e. simplified polygons are valid and do not collapse)
+    
+        @param polygon Shapely Polygon to simplify
+        @param tolerances List of floats representing tolerances, in units of the 
+        coordinates of polygon; all points of each simplified polygon will be within 
+        tolerance of polygon
+        
+        @return List of simplified Shapely Polygons, ordered from the smallest to the 
+        largest tolerance
+    """
+    return [polygon.simplify(tolerance, preserve_topology=True) for tolerance in sorted(tolerances)]
+
+
+def getSimplifiedCatchmentFilename(catchmentFilename, level):
+    """ Get the name of a simplified catchment dataset written by writeSimplifiedCatchmentFeatures
+    
+        @param catchmentFilename String representing name of full resolution catchment 
+        dataset, without extension
+        @param level Integer representing the level of simplification, starting at 1 for 
+        the smallest tolerance
+        
+        @return String representing name of simplified catchment dataset, without extension 
+    """
+    return "%s_simplified%d" % (catchmentFilename, level)
+
+
+def writeSimplifiedCatchmentFeatures(poLayer, outputDir, catchmentFilename, polygon, format, 
+                                     tolerances):
+    """ Write a pyramid of simplified catchment features alongside a full resolution 
+        catchment dataset.  The dataset for the nth smallest tolerance will be named
+        getSimplifiedCatchmentFilename(catchmentFilename, n).  Consumers that only need
+        an extent or an overview can read a coarse level instead of the full resolution
+        dataset.
+    
+        @param poLayer ogr.Layer of catchment features
+        @param outputDir String representing the absolute/relative path of the directory 
+        into which simplified features should be written
+        @param catchmentFilename String representing name of full resolution catchment 
+        dataset, without extension
+        @param polygon Shapely Polygon to simplify
+        @param format String representing OGR driver to use
+        @param tolerances List of floats representing tolerances, in units of the 
+        spatial reference of poLayer (see simplifyCatchmentPolygon)
+        
+        @return List of strings representing the names of the datasets in outputDir created
+        to hold the simplified features, ordered from the smallest to the largest tolerance
+    """
+    names = []
+    for (level, simplified) in enumerate(simplifyCatchmentPolygon(polygon, tolerances)):
+        (name, filepath) = _getCatchmentOutputPath(outputDir, 
+                                                   getSimplifiedCatchmentFilename(catchmentFilename, level + 1),
+                                                   format)
+        _writeCatchmentPolygon(poLayer, filepath, simplified, format)
+        names.append(name)
+    return names
+
+
+def _getSimplifyTolerances(config, simplifyTolerances=None):
+    """ Get tolerances at which to simplify catchment features
+    
+        @return List of floats, empty if catchment features should not be simplified
+    """
+    if simplifyTolerances is not None:
+        return simplifyTolerances
+    if config.has_option('NHDPLUS2', 'NHDPLUS2_CATCHMENT_SIMPLIFY_TOLERANCES'):
+        tolerances = config.get('NHDPLUS2', 'NHDPLUS2_CATCHMENT_SIMPLIFY_TOLERANCES')
+        return [float(t) for t in tolerances.split(',') if t.strip()]
+    return []
+
+
+def _writeCatchmentPolygon(poLayer, catchmentFilepath, polygon, format):
+    """ Write catchment polygon to a new dataset with the spatial reference and
+        fields of the catchment feature layer
+        
+        @param poLayer ogr.Layer of catchment features
+        @param catchmentFilepath String representing path of dataset to create
+        @param polygon Shapely Polygon to write
+        @param format String representing OGR driver to use
+    """
     # Create output data source
     poDriver = ogr.GetDriverByName(format)
     assert(poDriver)
@@ -540,78 +1424,34 @@ def getCatchmentFeaturesForReaches(config, outputDir,
         fieldDefn = layerDefn.GetFieldDefn(i)
         poOLayer.CreateField(fieldDefn)
         i = i + 1
-
-    # Create single geometry to hold catchment polygon in output shapefile
-    outGeom = ogr.Geometry( poOLayer.GetGeomType() )
-#    polygon = Polygon()
-
-    # Copy features, unioning them as we go
-    numReaches = len(reaches)
-    # Copy features in batches of UPSTREAM_SEARCH_THRESHOLD to overcome limit in 
-    #   OGR driver for input layer
-    start = 0
-    end = UPSTREAM_SEARCH_THRESHOLD
-    while end < numReaches:
-        whereFilter = "featureid=%s" % (reaches[start],)
-        for reach in reaches[start+1:end]:
-            whereFilter = whereFilter + " OR featureid=%s" % (reach,)
-        # Copy features
-        assert(poLayer.SetAttributeFilter(whereFilter) == 0)
-        inFeature = poLayer.GetNextFeature()
-        # Union geometry of input feature to output feature
-        while inFeature:
-#            inGeom = inFeature.GetGeometryRef().SimplifyPreserveTopology(0.0001)
-            inGeom = inFeature.GetGeometryRef()
-            outGeom = outGeom.Union( inGeom )
-#            polygon = polygon.union( loads( inGeom.ExportToWkb() ) )
-#            polygon = cascaded_union( [polygon, loads( inGeom.ExportToWkb() )] )
-            inFeature.Destroy()
-            inFeature = poLayer.GetNextFeature() 
-        start = end
-        end = end + UPSTREAM_SEARCH_THRESHOLD
-    # Copy remaining features
-    whereFilter = "featureid=%s" % (reaches[start],)
-    for reach in reaches[start+1:end]:
-        whereFilter = whereFilter + " OR featureid=%s" % (reach,)
-    # Copy features
-    poLayer.SetAttributeFilter(whereFilter)
-    assert(poLayer.SetAttributeFilter(whereFilter) == 0)
-    inFeature = poLayer.GetNextFeature()
-    while inFeature:
-#        inGeom = inFeature.GetGeometryRef().SimplifyPreserveTopology(0.0001)
-        inGeom = inFeature.GetGeometryRef()
-        outGeom = outGeom.Union( inGeom )
-#        polygon = polygon.union( loads( inGeom.ExportToWkb() ) )
-#        polygon = cascaded_union( [polygon, loads( inGeom.ExportToWkb() )] )
-        inFeature.Destroy()
-        inFeature = poLayer.GetNextFeature()
-    
-    # Create a new polygon that only contains exterior points
-    outGeom = ogr.ForceToPolygon( outGeom )
-    polygon = loads( outGeom.ExportToWkb() )
-    if polygon.exterior:
-        coords = polygon.exterior.coords
-        newPolygon = Polygon(coords)
-    else:
-        newPolygon = Polygon()
     
     # Write new feature to output feature data source
     outFeat = ogr.Feature( poOLayer.GetLayerDefn() )
-    outFeat.SetGeometry( ogr.CreateGeometryFromWkb( dumps(newPolygon) ) )
+    outFeat.SetGeometry( ogr.CreateGeometryFromWkb( dumps(polygon) ) )
     poOLayer.CreateFeature(outFeat)
-        
-    return catchmentFilename
 
 
 def getCatchmentFeaturesForComid(config, outputDir,
                                 catchmentFilename, comID,
-                                format=OGR_SHAPEFILE_DRIVER_NAME):
+                                format=OGR_SHAPEFILE_DRIVER_NAME,
+                                index=None, processes=1, db=None, simplifyTolerances=None):
     """ Get features (in WGS 84) for the drainage area associated with a
         given NHD (National Hydrography Dataset) stream reach.
+        
+        @note If a catchment cache is configured, the dissolved catchment polygon will be
+        read from, or stored in, the cache.  Cached catchments upstream of comID are used
+        in place of their member catchment features.
          
         @param config A Python ConfigParser containing the following
         sections and options:
-            'NHDPLUS2',
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_DB' (absolute path to
+            SQLite3 DB of NHDFlow data)
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_CATCHMENT' (absolute path to
+            NHD catchment SQLite3 spatial DB)
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_CATCHMENT_CACHE' (optional, absolute path
+            to SQLite3 DB of cached catchment polygons, see CatchmentCache.fromConfig)
+            'NHDPLUS2', 'NHDPLUS2_CATCHMENT_SIMPLIFY_TOLERANCES' (optional, comma-separated
+            list of tolerances at which to write simplified catchment features)
         @param outputDir String representing the absolute/relative
         path of the directory into which output rasters should be
         written
@@ -620,6 +1460,16 @@ def getCatchmentFeaturesForComid(config, outputDir,
         @param comID String representing comid of stream reach whose upstream
         catchment area is to be determined
         @param format String representing OGR driver to use
+        @param index PlusFlowIndex to search for upstream reaches instead of querying 
+        the PlusFlow table.  If specified, the NHDPlus2 DB will not be opened.
+        @param processes Integer representing the number of processes to use to union
+        catchment features (see unionGeometries)
+        @param db NHDPlusDatabase to query; if None, the database shared by all callers 
+        in this process for the database named in config will be used
+        @param simplifyTolerances List of floats representing tolerances, in units of the 
+        spatial reference of the catchment features, at which to also write simplified 
+        catchment features (see writeSimplifiedCatchmentFeatures); if None, tolerances will
+        be read from config
         
         @return String representing the name of the dataset in outputDir created to hold
         the features
@@ -631,30 +1481,113 @@ def getCatchmentFeaturesForComid(config, outputDir,
         @raise Exception if output format is not known
         
     """
-    nhddbPath = config.get('NHDPLUS2', 'PATH_OF_NHDPLUS2_DB')
-    if not os.access(nhddbPath, os.R_OK):
-        raise IOError(errno.EACCES, "The database at %s is not readable" %
-                      nhddbPath)
-    nhddbPath = os.path.abspath(nhddbPath)
+    (name, catchmentFilepath) = _getCatchmentOutputPath(outputDir, catchmentFilename, format)
+    catchmentLayer = openCatchmentLayer(config)
     
-    # Connect to DB
-    conn = sqlite3.connect(nhddbPath)
+    polygon = getCatchmentPolygonForComid(config, comID, index, processes, db, catchmentLayer)
+    _writeCatchmentPolygon(catchmentLayer[1], catchmentFilepath, polygon, format)
+    writeSimplifiedCatchmentFeatures(catchmentLayer[1], outputDir, catchmentFilename, polygon, format,
+                                     _getSimplifyTolerances(config, simplifyTolerances))
     
-    # Get upstream reaches
-    reaches = [comID]
-    getUpstreamReachesSQL(conn, comID, reaches)
-    #sys.stderr.write("Upstream reaches: ")
-    #sys.stderr.write(upstream_reaches)
-    conn.close()
+    return name
+
+
+def getCatchmentPolygonForComid(config, comID, index=None, processes=1, db=None, 
+                                catchmentLayer=None, cache=None):
+    """ Get the dissolved polygon of the drainage area associated with a given 
+        NHD (National Hydrography Dataset) stream reach.
+        
+        @note If a catchment cache is configured, the dissolved catchment polygon will be
+        read from, or stored in, the cache.  Cached catchments upstream of comID are used
+        in place of their member catchment features.
+         
+        @param config A Python ConfigParser containing the following
+        sections and options:
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_DB' (absolute path to
+            SQLite3 DB of NHDFlow data)
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_CATCHMENT' (absolute path to
+            NHD catchment SQLite3 spatial DB)
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_CATCHMENT_CACHE' (optional, absolute path
+            to SQLite3 DB of cached catchment polygons, see CatchmentCache.fromConfig)
+        @param comID String representing comid of stream reach whose upstream
+        catchment area is to be determined
+        @param index PlusFlowIndex to search for upstream reaches instead of querying 
+        the PlusFlow table.  If specified, the NHDPlus2 DB will not be opened.
+        @param processes Integer representing the number of processes to use to union
+        catchment features (see unionGeometries)
+        @param db NHDPlusDatabase to query; if None, the database shared by all callers 
+        in this process for the database named in config will be used
+        @param catchmentLayer Tuple (ogr.DataSource, ogr.Layer) of catchment features, as
+        returned by openCatchmentLayer; if None, the catchment layer will be opened
+        @param cache CatchmentCache to use instead of opening the catchment cache named 
+        in config for this call
+        
+        @return Shapely Polygon, in the spatial reference of the catchment features, 
+        containing only the exterior of the drainage area
+         
+        @raise ConfigParser.NoSectionError
+        @raise ConfigParser.NoOptionError
+    """
+    if catchmentLayer is None:
+        catchmentLayer = openCatchmentLayer(config)
+    (poDS, poLayer) = catchmentLayer
     
-    return getCatchmentFeaturesForReaches(config, outputDir,
-                                   catchmentFilename, reaches,
-                                   format)
+    if cache is None and not config.has_option('NHDPLUS2', 'PATH_OF_NHDPLUS2_CATCHMENT_CACHE'):
+        # Get upstream reaches
+        reaches = [comID]
+        if index is not None:
+            reaches.extend( getUpstreamReaches(None, comID, index) )
+        else:
+            db = _getNHDPlusDatabase(config, db)
+            with db.connection() as conn:
+                getUpstreamReachesSQL(conn, comID, reaches)
+            #sys.stderr.write("Upstream reaches: ")
+            #sys.stderr.write(upstream_reaches)
+        
+        return _getCatchmentPolygonForReaches(poDS, poLayer, reaches, processes=processes)
+    
+    closeCache = cache is None
+    if closeCache:
+        cache = CatchmentCache.fromConfig(config)
+    try:
+        polygon = cache.get(comID)
+        if polygon is None:
+            # Get upstream reaches, using the cached polygons of catchments upstream of comID
+            #   in place of their member reaches
+            conn = None
+            if index is None:
+                db = _getNHDPlusDatabase(config, db)
+                conn = db.getConnection()
+            try:
+                allUpstreamReaches = getUpstreamReaches(conn, comID, index)
+                (upstreamReaches, cachedReaches) = (allUpstreamReaches, [])
+                # Only look up the upstream reaches in the cache
+                cachedComIDs = cache.getComIDs(allUpstreamReaches)
+                if cachedComIDs:
+                    (upstreamReaches, cachedReaches) = getUpstreamReachesStoppingAt(conn, comID, 
+                                                                                    cachedComIDs, index)
+            finally:
+                if conn is not None:
+                    db.releaseConnection(conn)
+            
+            geometries = [cache.get(c) for c in cachedReaches]
+            if None in geometries:
+                # Another process evicted a cached catchment; use its member reaches instead
+                (upstreamReaches, geometries) = (allUpstreamReaches, [])
+            reaches = [comID] + upstreamReaches
+            polygon = _getCatchmentPolygonForReaches(poDS, poLayer, reaches, geometries, processes)
+            cache.put(comID, polygon)
+    finally:
+        if closeCache:
+            cache.close()
+    
+    return polygon
 
  
 def getCatchmentFeaturesForGage(config, outputDir,
                                 catchmentFilename, reachcode, measure, 
-                                format=OGR_SHAPEFILE_DRIVER_NAME):
+                                format=OGR_SHAPEFILE_DRIVER_NAME,
+                                index=None, processes=1, db=None, simplifyTolerances=None):
     """ Get features (in WGS 84) for the drainage area associated with a
         given NHD (National Hydrography Dataset) streamflow gage
         identified by a reach code and measure.
@@ -682,6 +1615,16 @@ def getCatchmentFeaturesForGage(config, outputDir,
         end of the one or more NHDFlowline features that are
         assigned to the ReachCode (see NHDPlusV21 GageLoc table)
         @param format String representing OGR driver to use
+        @param index PlusFlowIndex to search for upstream reaches instead of querying 
+        the PlusFlow table
+        @param processes Integer representing the number of processes to use to union
+        catchment features (see unionGeometries)
+        @param db NHDPlusDatabase to query; if None, the database shared by all callers 
+        in this process for the database named in config will be used
+        @param simplifyTolerances List of floats representing tolerances, in units of the 
+        spatial reference of the catchment features, at which to also write simplified 
+        catchment features (see writeSimplifiedCatchmentFeatures); if None, tolerances will
+        be read from config
         
         @return String representing the name of the dataset in outputDir created to hold
         the features
@@ -692,18 +1635,177 @@ def getCatchmentFeaturesForGage(config, outputDir,
         @raise IOError(errno.EACCESS) if outputDir is not writable
         @raise Exception if output format is not known
     """
-    nhddbPath = config.get('NHDPLUS2', 'PATH_OF_NHDPLUS2_DB')
-    if not os.access(nhddbPath, os.R_OK):
-        raise IOError(errno.EACCES, "The database at %s is not readable" %
-                      nhddbPath)
-    nhddbPath = os.path.abspath(nhddbPath)
-    
-    # Connect to DB
-    conn = sqlite3.connect(nhddbPath)
-    
-    comID = getComIdForStreamGage(conn, reachcode, measure)
+    db = _getNHDPlusDatabase(config, db)
+    with db.connection() as conn:
+        comID = getComIdForStreamGage(conn, reachcode, measure)
     #sys.stderr.write("Gage with reachcode %s, measure %f has ComID %d" % (reachcode, measure, comID))
     
     return getCatchmentFeaturesForComid(config, outputDir,
                                 catchmentFilename, comID,
-                                format)
+                                format, index, processes, db, simplifyTolerances)
+
+
+def getFlowlineFeaturesForReaches(config, outputDir, flowlineFilename, reaches,
+                                  format=OGR_GPKG_DRIVER_NAME):
+    """ Write flowline features for a set of NHD (National Hydrography Dataset) 
+        stream reaches.
+        
+        @note Features are streamed from the flowline feature DB to the output dataset;
+        at most FLOWLINE_WRITE_BATCH_SIZE features are held in an uncommitted transaction
+        at a time, so memory use does not grow with the number of reaches.
+        
+        @param config A Python ConfigParser containing the following
+        sections and options:
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_FLOWLINE' (absolute path to
+            NHD flowline SQLite3 spatial DB)
+        @param outputDir String representing the absolute/relative
+        path of the directory into which output features should be
+        written
+        @param flowlineFilename String representing name of file to
+        save flowline features to.  The appropriate extension will be added to the file name
+        @param reaches List representing ComIDs of flowlines to be written
+        @param format String representing OGR driver to use
+        
+        @return Tuple (string, int) representing the name of the dataset in outputDir 
+        created to hold the features, and the number of features written
+         
+        @raise ConfigParser.NoSectionError
+        @raise ConfigParser.NoOptionError
+        @raise IOError(errno.ENOTDIR) if outputDir is not a directory
+        @raise IOError(errno.EACCESS) if outputDir is not writable
+        @raise Exception if output format is not known
+    """
+    (name, flowlineFilepath) = _getCatchmentOutputPath(outputDir, flowlineFilename, format)
+    (poDS, poLayer) = openFlowlineLayer(config)
+    
+    # Create output data source
+    poDriver = ogr.GetDriverByName(format)
+    assert(poDriver)
+    poODS = poDriver.CreateDataSource(flowlineFilepath)
+    assert(poODS != None)
+    
+    poResult = _selectFeaturesForReaches(poDS, poLayer, reaches, 'comid')
+    poOLayer = poODS.CreateLayer("flowline", poLayer.GetSpatialRef(), poLayer.GetGeomType())
+    
+    # Create fields in output layer
+    layerDefn = poResult.GetLayerDefn()
+    i = 0
+    fieldCount = layerDefn.GetFieldCount()
+    while i < fieldCount:
+        fieldDefn = layerDefn.GetFieldDefn(i)
+        poOLayer.CreateField(fieldDefn)
+        i = i + 1
+    
+    # Copy features, committing a transaction every FLOWLINE_WRITE_BATCH_SIZE features
+    useTransactions = poOLayer.TestCapability(ogr.OLCTransactions)
+    if useTransactions:
+        poOLayer.StartTransaction()
+    outLayerDefn = poOLayer.GetLayerDefn()
+    numFeatures = 0
+    inFeature = poResult.GetNextFeature()
+    while inFeature:
+        outFeature = ogr.Feature(outLayerDefn)
+        outFeature.SetFrom(inFeature)
+        poOLayer.CreateFeature(outFeature)
+        outFeature.Destroy()
+        inFeature.Destroy()
+        numFeatures = numFeatures + 1
+        if useTransactions and numFeatures % FLOWLINE_WRITE_BATCH_SIZE == 0:
+            poOLayer.CommitTransaction()
+            poOLayer.StartTransaction()
+        inFeature = poResult.GetNextFeature()
+    if useTransactions:
+        poOLayer.CommitTransaction()
+    
+    poDS.ReleaseResultSet(poResult)
+    poODS.Destroy()
+    
+    return (name, numFeatures)
+
+
+def getFlowlineFeaturesForComid(config, outputDir, flowlineFilename, comID,
+                                format=OGR_GPKG_DRIVER_NAME, index=None, db=None):
+    """ Write flowline features for an NHD (National Hydrography Dataset) stream 
+        reach and all reaches upstream of it.
+        
+        @param config A Python ConfigParser containing the following
+        sections and options:
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_DB' (absolute path to
+            SQLite3 DB of NHDFlow data)
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_FLOWLINE' (absolute path to
+            NHD flowline SQLite3 spatial DB)
+        @param outputDir String representing the absolute/relative
+        path of the directory into which output features should be
+        written
+        @param flowlineFilename String representing name of file to
+        save flowline features to.  The appropriate extension will be added to the file name
+        @param comID String representing comid of the most downstream reach
+        @param format String representing OGR driver to use
+        @param index PlusFlowIndex to search for upstream reaches instead of querying 
+        the PlusFlow table.  If specified, the NHDPlus2 DB will not be opened.
+        @param db NHDPlusDatabase to query; if None, the database shared by all callers 
+        in this process for the database named in config will be used
+        
+        @return Tuple (string, int) representing the name of the dataset in outputDir 
+        created to hold the features, and the number of features written
+         
+        @raise ConfigParser.NoSectionError
+        @raise ConfigParser.NoOptionError
+        @raise IOError(errno.ENOTDIR) if outputDir is not a directory
+        @raise IOError(errno.EACCESS) if outputDir is not writable
+        @raise Exception if output format is not known
+    """
+    reaches = [comID]
+    if index is not None:
+        reaches.extend( getUpstreamReaches(None, comID, index) )
+    else:
+        db = _getNHDPlusDatabase(config, db)
+        with db.connection() as conn:
+            getUpstreamReachesSQL(conn, comID, reaches)
+    
+    return getFlowlineFeaturesForReaches(config, outputDir, flowlineFilename, reaches, format)
+
+
+def getFlowlineFeaturesForGage(config, outputDir, flowlineFilename, reachcode, measure,
+                               format=OGR_GPKG_DRIVER_NAME, index=None, db=None):
+    """ Write flowline features for the stream network upstream of a given NHD 
+        (National Hydrography Dataset) streamflow gage identified by a reach code 
+        and measure.
+        
+        @param config A Python ConfigParser containing the following
+        sections and options:
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_DB' (absolute path to
+            SQLite3 DB of NHDFlow data)
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_FLOWLINE' (absolute path to
+            NHD flowline SQLite3 spatial DB)
+        @param outputDir String representing the absolute/relative
+        path of the directory into which output features should be
+        written
+        @param flowlineFilename String representing name of file to
+        save flowline features to.  The appropriate extension will be added to the file name
+        @param reachcode String representing NHD streamflow gage 
+        @param measure Float representing the measure along reach
+        where Stream Gage is located in percent from downstream
+        end of the one or more NHDFlowline features that are
+        assigned to the ReachCode (see NHDPlusV21 GageLoc table)
+        @param format String representing OGR driver to use
+        @param index PlusFlowIndex to search for upstream reaches instead of querying 
+        the PlusFlow table
+        @param db NHDPlusDatabase to query; if None, the database shared by all callers 
+        in this process for the database named in config will be used
+        
+        @return Tuple (string, int) representing the name of the dataset in outputDir 
+        created to hold the features, and the number of features written
+         
+        @raise ConfigParser.NoSectionError
+        @raise ConfigParser.NoOptionError
+        @raise IOError(errno.ENOTDIR) if outputDir is not a directory
+        @raise IOError(errno.EACCESS) if outputDir is not writable
+        @raise Exception if output format is not known
+    """
+    db = _getNHDPlusDatabase(config, db)
+    with db.connection() as conn:
+        comID = getComIdForStreamGage(conn, reachcode, measure)
+    
+    return getFlowlineFeaturesForComid(config, outputDir, flowlineFilename, comID,
+                                       format, index, db)
@@ -0,0 +1,1022 @@
+"""@package ecohydrolib.nhdplus2.networkindex
+
+@brief Indices of the NHDPlus V2 flow network.  Indices are built once from the
+tables of an NHDPlus V2 database initialized using NHDPlusSetup.py, and allow
+network traversals to be performed without issuing an SQL query per reach.
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2013, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+@author Brian Miles <brian_miles@unc.edu>
+"""
+import os
+import errno
+import re
+import itertools
+import collections
+
+import numpy as np
+
+FETCH_SIZE = 65536
+# Maximum size of the arrays of ComIDs held by an UpstreamReachCache
+UPSTREAM_CACHE_MAX_BYTES = 32 * 1024 * 1024
+# PlusFlowlineVAA Divergence code of the minor path of a divergence
+DIVERGENCE_MINOR_PATH = 2
+# Routing of accumulated attributes at divergences, see PlusFlowIndex.accumulate
+DIVERGENCE_ROUTING_MAIN = 'main'
+DIVERGENCE_ROUTING_EQUAL = 'equal'
+DIVERGENCE_ROUTING_NONE = 'none'
+# Format version of network snapshots, see saveNetworkSnapshot
+SNAPSHOT_VERSION = 1
+SNAPSHOT_VERSION_FILENAME = 'VERSION'
+# Number of pairs of reaches whose distance is computed at once, see 
+#   DownstreamIndex.getNetworkDistances
+NETWORK_DISTANCE_BLOCK_SIZE = 1048576
+
+_indexIdentities = itertools.count()
+
+
+class UpstreamReachCache(object):
+    """ Least-recently-used cache of the reaches upstream of a reach, keyed by the 
+        network searched and the ComID of the reach.  Upstream reaches are stored as
+        numpy int64 arrays, and the size of the cache is bounded by the total size 
+        of the arrays stored across all entries.
+    """
+    def __init__(self, maxBytes=UPSTREAM_CACHE_MAX_BYTES):
+        """ Constructor for UpstreamReachCache
+        
+            @param maxBytes Integer representing the maximum number of bytes of upstream 
+            reaches to store before least-recently-used entries are evicted 
+        """
+        self.maxBytes = maxBytes
+        self.numBytes = 0
+        self._entries = collections.OrderedDict()
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def __contains__(self, key):
+        return key in self._entries
+    
+    def get(self, source, comID):
+        """ Get upstream reaches of a reach
+        
+            @param source Hashable identifying the network searched, e.g. the path of 
+            an NHDPlus2 DB or the identity of a PlusFlowIndex
+            @param comID Integer representing the ComID of the reach
+            
+            @return A read-only numpy int64 array of ComIDs of upstream reaches, or None
+            if comID is not cached
+        """
+        key = (source, comID)
+        upstreamReaches = self._entries.pop(key, None)
+        if upstreamReaches is not None:
+            self._entries[key] = upstreamReaches
+        return upstreamReaches
+    
+    def put(self, source, comID, upstreamReaches):
+        """ Store upstream reaches of a reach, evicting least-recently-used entries
+            as needed.  Entries larger than the cache will not be stored.
+        
+            @param source Hashable identifying the network searched
+            @param comID Integer representing the ComID of the reach
+            @param upstreamReaches Iterable of ComIDs of reaches upstream of comID
+        """
+        upstreamReaches = np.array(upstreamReaches, dtype=np.int64)
+        upstreamReaches.flags.writeable = False
+        if upstreamReaches.nbytes > self.maxBytes:
+            return
+        key = (source, comID)
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.numBytes -= old.nbytes
+        while self._entries and self.numBytes + upstreamReaches.nbytes > self.maxBytes:
+            (evicted, reaches) = self._entries.popitem(last=False)
+            self.numBytes -= reaches.nbytes
+        self._entries[key] = upstreamReaches
+        self.numBytes += upstreamReaches.nbytes
+    
+    def clear(self):
+        """ Remove all entries from the cache """
+        self._entries.clear()
+        self.numBytes = 0
+
+
+class PlusFlowIndex(object):
+    """ Compressed sparse row (CSR) adjacency index of the NHDPlus2 PlusFlow graph.
+        For each ComID in the network, stores offsets into an array of the rows of
+        its immediate predecessors (i.e. the FROMCOMIDs of PlusFlow records whose
+        TOCOMID is the ComID).
+
+        @code
+        import sqlite3
+        from ecohydrolib.nhdplus2.networkindex import PlusFlowIndex
+        conn = sqlite3.connect('/path/to/NHDPlusDB.sqlite')
+        index = PlusFlowIndex.fromDatabase(conn)
+        conn.close()
+        upstream = index.getUpstreamReaches(8888888)
+        @endcode
+    """
+    def __init__(self, comIDs, offsets, predecessors):
+        """ Constructor for PlusFlowIndex
+
+            @param comIDs Sorted numpy array of all ComIDs in the network.  The position
+            of a ComID in this array is its row in the index.
+            @param offsets Numpy array of length len(comIDs) + 1; the predecessors of
+            the ComID in row i are stored in predecessors[offsets[i]:offsets[i+1]]
+            @param predecessors Numpy array of rows of immediate predecessors
+        """
+        self.comIDs = comIDs
+        self.offsets = offsets
+        self.predecessors = predecessors
+        # Identifies this index among those built in this process, e.g. in cache keys
+        self.identity = next(_indexIdentities)
+
+    @classmethod
+    def fromDatabase(cls, conn):
+        """ Build index from the PlusFlow table of an NHDPlus2 database
+
+            @param conn A connection to an SQLite3 database that has the NHDPlus2 PlusFlow table
+
+            @return PlusFlowIndex
+        """
+        cursor = conn.cursor()
+        cursor.execute("""SELECT FROMCOMID,TOCOMID FROM PlusFlow WHERE FROMCOMID<>0 AND TOCOMID<>0""")
+        chunks = []
+        rows = cursor.fetchmany(FETCH_SIZE)
+        while rows:
+            chunks.append(np.array(rows, dtype=np.int64))
+            rows = cursor.fetchmany(FETCH_SIZE)
+        cursor.close()
+        if chunks:
+            edges = np.concatenate(chunks)
+        else:
+            edges = np.zeros((0, 2), dtype=np.int64)
+        return cls.fromEdges(edges[:,0], edges[:,1])
+
+    @classmethod
+    def fromEdges(cls, fromComIDs, toComIDs):
+        """ Build index from arrays of PlusFlow edges
+
+            @param fromComIDs Numpy array of FROMCOMIDs
+            @param toComIDs Numpy array of TOCOMIDs
+
+            @return PlusFlowIndex
+        """
+        fromComIDs = np.asarray(fromComIDs, dtype=np.int64)
+        toComIDs = np.asarray(toComIDs, dtype=np.int64)
+        comIDs = np.unique(np.concatenate((fromComIDs, toComIDs)))
+        fromRows = np.searchsorted(comIDs, fromComIDs)
+        toRows = np.searchsorted(comIDs, toComIDs)
+        # Group edges by downstream row
+        order = np.argsort(toRows, kind='mergesort')
+        predecessors = fromRows[order]
+        counts = np.bincount(toRows, minlength=len(comIDs))
+        offsets = np.zeros(len(comIDs) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return cls(comIDs, offsets, predecessors)
+
+    def __len__(self):
+        return len(self.comIDs)
+
+    def getRow(self, comID):
+        """ Get the row of a ComID in the index
+
+            @param comID Integer representing the ComID
+
+            @return Integer representing the row, or -1 if the ComID is not in the index
+        """
+        row = int(np.searchsorted(self.comIDs, comID))
+        if row < len(self.comIDs) and self.comIDs[row] == comID:
+            return row
+        return -1
+
+    def getPredecessors(self, comID):
+        """ Get the immediate predecessors of a reach
+
+            @param comID Integer representing the ComID of the reach
+
+            @return A list of ComIDs of immediate predecessor reaches; empty if the reach
+            is a headwater reach or is not in the index
+        """
+        row = self.getRow(comID)
+        if row < 0:
+            return []
+        rows = self.predecessors[self.offsets[row]:self.offsets[row+1]]
+        return [int(c) for c in self.comIDs[rows]]
+
+    def searchUpstreamRows(self, rows, stop=None):
+        """ Breadth-first search for the rows of all reaches upstream of a set of rows
+        
+            @param rows Numpy array of rows whose upstream reaches are to be discovered
+            @param stop Boolean numpy array indexed by row.  If specified, the search 
+            will not continue upstream of reaches whose rows are True in stop. 
+            
+            @return A tuple (upstream, stopped), where upstream is a numpy array of rows 
+            of upstream reaches, sorted, not including rows; and stopped is a numpy array 
+            of the rows in upstream at which the search was stopped 
+        """
+        visited = np.zeros(len(self.comIDs), dtype=np.bool_)
+        frontier = np.unique(np.asarray(rows, dtype=np.int64))
+        visited[frontier] = True
+        found = []
+        stopped = []
+        while len(frontier) > 0:
+            starts = self.offsets[frontier]
+            counts = self.offsets[frontier + 1] - starts
+            total = int(counts.sum())
+            if total == 0:
+                break
+            # Gather the predecessor slices of each frontier row
+            positions = np.repeat(starts - np.cumsum(counts) + counts, counts) + \
+                np.arange(total, dtype=np.int64)
+            candidates = np.unique(self.predecessors[positions])
+            frontier = candidates[~visited[candidates]]
+            visited[frontier] = True
+            found.append(frontier)
+            if stop is not None:
+                isStopped = stop[frontier]
+                stopped.append(frontier[isStopped])
+                frontier = frontier[~isStopped]
+        empty = np.zeros(0, dtype=np.int64)
+        if found:
+            found = np.sort(np.concatenate(found))
+        else:
+            found = empty
+        if stopped:
+            stopped = np.concatenate(stopped)
+        else:
+            stopped = empty
+        return (found, stopped)
+
+    def getUpstreamRows(self, rows):
+        """ Breadth-first search for the rows of all reaches upstream of a set of rows
+
+            @param rows Numpy array of rows whose upstream reaches are to be discovered
+
+            @return Numpy array of rows of upstream reaches, sorted, not including rows
+        """
+        return self.searchUpstreamRows(rows)[0]
+
+    def getUpstreamRowsForRows(self, rows):
+        """ Get the rows of all reaches upstream of each of a set of rows.  Searches 
+            stop at rows nested upstream of another row in the set, and the result for
+            the nested row is reused, so that reaches shared by nested rows are searched
+            only once.
+        
+            @param rows Iterable of rows whose upstream reaches are to be discovered
+            
+            @return A dict mapping each row to a sorted numpy array of the row and the 
+            rows of all reaches upstream of it
+        """
+        numRows = len(self.comIDs)
+        isTarget = np.zeros(numRows, dtype=np.bool_)
+        onStack = np.zeros(numRows, dtype=np.bool_)
+        targets = np.unique(np.asarray(list(rows), dtype=np.int64))
+        isTarget[targets] = True
+        
+        results = {}
+        for target in targets.tolist():
+            stack = [target]
+            onStack[target] = True
+            while stack:
+                r = stack[-1]
+                if r in results:
+                    onStack[r] = False
+                    stack.pop()
+                    continue
+                # Rows already on the stack are downstream of r, don't stop at them
+                (upstream, nested) = self.searchUpstreamRows(np.array([r]), isTarget & ~onStack)
+                pending = [n for n in nested.tolist() if n not in results]
+                if pending:
+                    # Search nested rows first so that their results can be reused
+                    stack.extend(pending)
+                    onStack[pending] = True
+                    continue
+                parts = [upstream, np.array([r], dtype=np.int64)]
+                parts.extend([results[n] for n in nested.tolist()])
+                results[r] = np.unique(np.concatenate(parts))
+                onStack[r] = False
+                stack.pop()
+        
+        return results
+
+    def getUpstreamReaches(self, comID):
+        """ Get all reaches upstream of a given reach
+
+            @param comID Integer representing the ComID of the reach whose upstream
+            reaches are to be discovered
+
+            @return Sorted numpy array of ComIDs of upstream reaches, not including comID
+        """
+        row = self.getRow(comID)
+        if row < 0:
+            return np.zeros(0, dtype=np.int64)
+        return self.comIDs[self.getUpstreamRows(np.array([row]))]
+
+    def getIntervals(self):
+        """ Label each row with a depth-first pre-order interval.  Depth-first search 
+            starts at each outlet (a reach with no successors) and proceeds upstream.  
+            The reaches in the subtree upstream of a reach in row r are those whose 
+            pre-order number lies in [pre[r], post[r]].  Where the network is not a 
+            tree (e.g. where divergences rejoin), the PlusFlow edges not followed by the 
+            search are returned as links; the upstream reaches of a link's FROMCOMID are
+            upstream of all reaches downstream of the link's TOCOMID.
+        
+            @return A tuple (pre, post, linkFrom, linkTo) of numpy arrays, where pre and
+            post are indexed by row, and linkFrom and linkTo are the rows of the 
+            non-tree edges.
+        """
+        numRows = len(self.comIDs)
+        offsets = self.offsets.tolist()
+        predecessors = self.predecessors.tolist()
+        pre = [-1] * numRows
+        post = [-1] * numRows
+        linkFrom = []
+        linkTo = []
+        
+        hasSuccessor = np.zeros(numRows, dtype=np.bool_)
+        hasSuccessor[self.predecessors] = True
+        # Start from outlets, then from any rows not reachable from an outlet
+        roots = np.flatnonzero(~hasSuccessor).tolist() + range(numRows)
+        
+        counter = 0
+        position = list(offsets[:-1])
+        for root in roots:
+            if pre[root] >= 0:
+                continue
+            pre[root] = counter
+            counter += 1
+            stack = [root]
+            while stack:
+                r = stack[-1]
+                p = position[r]
+                if p < offsets[r+1]:
+                    position[r] = p + 1
+                    u = predecessors[p]
+                    if pre[u] < 0:
+                        pre[u] = counter
+                        counter += 1
+                        stack.append(u)
+                    else:
+                        linkFrom.append(u)
+                        linkTo.append(r)
+                else:
+                    post[r] = counter - 1
+                    stack.pop()
+        
+        return (np.array(pre, dtype=np.int64), np.array(post, dtype=np.int64), 
+                np.array(linkFrom, dtype=np.int64), np.array(linkTo, dtype=np.int64))
+
+    def getEdges(self):
+        """ Get the PlusFlow edges of the index, in the order of predecessors
+        
+            @return A tuple (fromRows, toRows) of numpy arrays
+        """
+        toRows = np.repeat(np.arange(len(self.comIDs), dtype=np.int64), np.diff(self.offsets))
+        return (self.predecessors, toRows)
+
+    def getTopologicalLevels(self):
+        """ Label each row with its topological level: 0 for headwater reaches, 
+            otherwise one more than the greatest level of its immediate predecessors.  
+            Every reach is at a greater level than all reaches upstream of it.
+        
+            @return Numpy array of levels indexed by row
+            
+            @raise Exception if the network contains a cycle
+        """
+        numRows = len(self.comIDs)
+        (fromRows, toRows) = self.getEdges()
+        # Successors of each row, as a CSR index
+        order = np.argsort(fromRows, kind='mergesort')
+        successors = toRows[order]
+        successorOffsets = np.zeros(numRows + 1, dtype=np.int64)
+        np.cumsum(np.bincount(fromRows, minlength=numRows), out=successorOffsets[1:])
+        
+        indegree = np.diff(self.offsets)
+        levels = np.full(numRows, -1, dtype=np.int64)
+        frontier = np.flatnonzero(indegree == 0)
+        level = 0
+        numLabelled = 0
+        while len(frontier) > 0:
+            levels[frontier] = level
+            numLabelled += len(frontier)
+            starts = successorOffsets[frontier]
+            counts = successorOffsets[frontier + 1] - starts
+            total = int(counts.sum())
+            if total == 0:
+                break
+            # Gather the successor slices of each frontier row
+            positions = np.repeat(starts - np.cumsum(counts) + counts, counts) + \
+                np.arange(total, dtype=np.int64)
+            (targets, decrements) = np.unique(successors[positions], return_counts=True)
+            indegree[targets] -= decrements
+            frontier = targets[indegree[targets] == 0]
+            level += 1
+        if numLabelled < numRows:
+            raise Exception("PlusFlow network contains a cycle through %d reaches" % 
+                            (numRows - numLabelled,))
+        return levels
+
+    def getEqualDivergenceFractions(self):
+        """ Get fractions for accumulate that split flow equally among the 
+            immediate successors of each reach
+        
+            @return Numpy array of fractions, in the order of predecessors
+        """
+        fromRows = self.predecessors
+        outdegree = np.bincount(fromRows, minlength=len(self.comIDs))
+        return 1.0 / outdegree[fromRows]
+
+    def getMainPathDivergenceFractions(self, divergence):
+        """ Get fractions for accumulate that route all flow at a divergence to the 
+            main path, as is done for the divergence-routed attributes of PlusFlowlineVAA 
+            (e.g. DivDASqKM)
+        
+            @param divergence Numpy array, indexed by row, of the PlusFlowlineVAA 
+            Divergence code of each reach (0: not part of a divergence, 1: main path, 
+            2: minor path)
+        
+            @return Numpy array of fractions, in the order of predecessors
+        """
+        (fromRows, toRows) = self.getEdges()
+        isMain = (np.asarray(divergence)[toRows] != DIVERGENCE_MINOR_PATH).astype(np.float64)
+        numMain = np.bincount(fromRows, weights=isMain, minlength=len(self.comIDs))
+        fractions = np.zeros(len(fromRows), dtype=np.float64)
+        hasMain = numMain[fromRows] > 0
+        fractions[hasMain] = isMain[hasMain] / numMain[fromRows][hasMain]
+        return fractions
+
+    def accumulate(self, values, fractions=None):
+        """ Accumulate attributes of reaches downstream through the network in a single 
+            pass in topological order, i.e. for each reach, the sum of its own value 
+            and of the accumulated values of its immediate predecessors, each weighted 
+            by the fraction of the predecessor's flow routed to the reach.
+            
+            @note Where divergences rejoin, reaches upstream of the divergence contribute
+            to the reach where they rejoin through each path.  Fractions that sum to 1 
+            for the successors of each reach (see getEqualDivergenceFractions and 
+            getMainPathDivergenceFractions) ensure that they are counted once.
+        
+            @param values Numpy array, indexed by row, of the value of each reach.  May be 
+            two dimensional, of shape (len(index), k), to accumulate k attributes at once.
+            @param fractions Numpy array, in the order of predecessors, of the fraction 
+            of the flow of each edge's FROMCOMID routed to its TOCOMID.  If None, 
+            fractions of 1.0 are used.
+            
+            @return Numpy array, of the same shape as values, of accumulated values
+        """
+        accumulated = np.array(values, dtype=np.float64)
+        assert(accumulated.shape[0] == len(self.comIDs))
+        (fromRows, toRows) = self.getEdges()
+        if fractions is None:
+            fractions = np.ones(len(fromRows), dtype=np.float64)
+        fractions = np.asarray(fractions, dtype=np.float64)
+        assert(len(fractions) == len(fromRows))
+        if len(fromRows) == 0:
+            return accumulated
+        
+        # Group edges by level of their downstream row, then by downstream row
+        levels = self.getTopologicalLevels()
+        edgeLevels = levels[toRows]
+        order = np.lexsort((toRows, edgeLevels))
+        fromRows = fromRows[order]
+        toRows = toRows[order]
+        fractions = fractions[order]
+        if accumulated.ndim > 1:
+            fractions = fractions.reshape((-1,) + (1,) * (accumulated.ndim - 1))
+        levelBounds = np.searchsorted(edgeLevels[order], np.arange(1, levels.max() + 2))
+        
+        for i in xrange(len(levelBounds) - 1):
+            (start, end) = (levelBounds[i], levelBounds[i+1])
+            if start == end:
+                continue
+            # Predecessors are at lower levels, so their values are final
+            contributions = accumulated[fromRows[start:end]] * fractions[start:end]
+            targets = toRows[start:end]
+            isFirst = np.ones(len(targets), dtype=np.bool_)
+            isFirst[1:] = targets[1:] != targets[:-1]
+            firsts = np.flatnonzero(isFirst)
+            accumulated[targets[firsts]] += np.add.reduceat(contributions, firsts, axis=0)
+        
+        return accumulated
+
+
+class DownstreamIndex(object):
+    """ Index of the mainstem downstream reach of each reach in the NHDPlus2 network, 
+        built from the Hydroseq, DnHydroseq and LengthKM attributes of PlusFlowlineVAA.
+        At divergences, only the main path (DnHydroseq) is followed.
+        
+        @code
+        import sqlite3
+        from ecohydrolib.nhdplus2.networkindex import DownstreamIndex
+        conn = sqlite3.connect('/path/to/NHDPlusDB.sqlite')
+        index = DownstreamIndex.fromDatabase(conn)
+        conn.close()
+        (path, lengths) = index.getDownstreamPath(8888888)
+        @endcode
+    """
+    def __init__(self, comIDs, downstream, lengthsKM):
+        """ Constructor for DownstreamIndex
+        
+            @param comIDs Sorted numpy array of all ComIDs in the network.  The position
+            of a ComID in this array is its row in the index.
+            @param downstream Numpy array of the row of the downstream reach of each 
+            row; -1 for terminal reaches
+            @param lengthsKM Numpy array of the length, in kilometers, of each row
+        """
+        self.comIDs = comIDs
+        self.downstream = downstream
+        self.lengthsKM = lengthsKM
+    
+    @classmethod
+    def fromDatabase(cls, conn):
+        """ Build index from the PlusFlowlineVAA table of an NHDPlus2 database
+        
+            @param conn A connection to an SQLite3 database that has the NHDPlus2 
+            PlusFlowlineVAA table
+            
+            @return DownstreamIndex
+        """
+        cursor = conn.cursor()
+        cursor.execute("""SELECT ComID,Hydroseq,DnHydroseq,LengthKM FROM PlusFlowlineVAA""")
+        chunks = []
+        rows = cursor.fetchmany(FETCH_SIZE)
+        while rows:
+            chunks.append(np.array(rows, dtype=np.float64))
+            rows = cursor.fetchmany(FETCH_SIZE)
+        cursor.close()
+        if chunks:
+            attributes = np.concatenate(chunks)
+        else:
+            attributes = np.zeros((0, 4), dtype=np.float64)
+        return cls.fromAttributes(attributes[:,0], attributes[:,1], 
+                                  attributes[:,2], attributes[:,3])
+    
+    @classmethod
+    def fromAttributes(cls, comIDs, hydroseqs, dnHydroseqs, lengthsKM):
+        """ Build index from arrays of flowline value added attributes
+        
+            @param comIDs Numpy array of ComIDs
+            @param hydroseqs Numpy array of Hydroseq of each ComID
+            @param dnHydroseqs Numpy array of DnHydroseq of each ComID; 0 for terminal reaches
+            @param lengthsKM Numpy array of LengthKM of each ComID
+            
+            @return DownstreamIndex
+        """
+        comIDs = np.asarray(comIDs, dtype=np.int64)
+        hydroseqs = np.asarray(hydroseqs, dtype=np.int64)
+        dnHydroseqs = np.asarray(dnHydroseqs, dtype=np.int64)
+        lengthsKM = np.asarray(lengthsKM, dtype=np.float64)
+        
+        order = np.argsort(comIDs, kind='mergesort')
+        comIDs = comIDs[order]
+        hydroseqs = hydroseqs[order]
+        dnHydroseqs = dnHydroseqs[order]
+        lengthsKM = lengthsKM[order]
+        
+        # Map DnHydroseq to the row of the reach with that Hydroseq
+        byHydroseq = np.argsort(hydroseqs, kind='mergesort')
+        sortedHydroseqs = hydroseqs[byHydroseq]
+        positions = np.searchsorted(sortedHydroseqs, dnHydroseqs)
+        positions = np.minimum(positions, max(len(comIDs) - 1, 0))
+        downstream = np.full(len(comIDs), -1, dtype=np.int64)
+        if len(comIDs) > 0:
+            # Hydroseq decreases downstream; anything else (e.g. DnHydroseq of 0, or of a 
+            #   reach not in the network) terminates the path
+            found = (sortedHydroseqs[positions] == dnHydroseqs) & (dnHydroseqs < hydroseqs)
+            downstream[found] = byHydroseq[positions[found]]
+        return cls(comIDs, downstream, lengthsKM)
+    
+    def __len__(self):
+        return len(self.comIDs)
+    
+    def getRow(self, comID):
+        """ Get the row of a ComID in the index
+        
+            @param comID Integer representing the ComID
+            
+            @return Integer representing the row, or -1 if the ComID is not in the index
+        """
+        row = int(np.searchsorted(self.comIDs, comID))
+        if row < len(self.comIDs) and self.comIDs[row] == comID:
+            return row
+        return -1
+    
+    def getDownstreamRows(self, row):
+        """ Get the rows of the flow path from a row to its terminal reach
+        
+            @param row Integer representing the row of the origin reach
+            
+            @return Numpy array of rows, starting with row and ending with the terminal reach
+        """
+        return self.getDownstreamRowsForRows([row])[0]
+    
+    def getDownstreamRowsForRows(self, rows):
+        """ Get the flow paths from many rows to their terminal reaches.  Paths are 
+            traced once; a path that joins a previously traced path re-uses the remainder
+            of that path.
+        
+            @param rows Iterable of integers representing rows of origin reaches
+            
+            @return List, in the same order as rows, of numpy arrays of rows, each starting
+            with the origin row and ending with the terminal reach
+        """
+        downstream = self.downstream
+        # Position of each traced row in its path: row -> (path number, position)
+        traced = {}
+        paths = []
+        for row in rows:
+            row = int(row)
+            path = []
+            r = row
+            while r >= 0 and r not in traced:
+                path.append(r)
+                r = int(downstream[r])
+                if len(path) > len(downstream):
+                    raise Exception("Cycle detected in flow path of row %d" % (row,))
+            path = np.array(path, dtype=np.int64)
+            if r >= 0:
+                (i, position) = traced[r]
+                path = np.concatenate( (path, paths[i][position:]) )
+            # Paths sharing a suffix share the positions of that suffix
+            for (position, p) in enumerate(path):
+                if p in traced:
+                    break
+                traced[int(p)] = (len(paths), position)
+            paths.append(path)
+        return paths
+    
+    def getDownstreamPath(self, comID):
+        """ Get the flow path from a reach to its terminal reach
+        
+            @param comID Integer representing the ComID of the origin reach
+            
+            @return A tuple of numpy arrays (ComIDs, lengths).  ComIDs are ordered from the 
+            origin reach to the terminal reach; lengths[i] is the cumulative length, in 
+            kilometers, of reaches 0 through i.  Both arrays are empty if the reach is not
+            in the index.
+        """
+        return self.getDownstreamPaths([comID])[0]
+    
+    def getDownstreamPaths(self, comIDs):
+        """ Get the flow paths from many reaches to their terminal reaches
+        
+            @param comIDs Iterable of integers representing ComIDs of origin reaches
+            
+            @return List, in the same order as comIDs, of tuples of numpy arrays (ComIDs, 
+            lengths), see getDownstreamPath
+        """
+        comIDs = list(comIDs)
+        rows = [self.getRow(comID) for comID in comIDs]
+        paths = self.getDownstreamRowsForRows([r for r in rows if r >= 0])
+        paths.reverse()
+        
+        results = []
+        for row in rows:
+            if row < 0:
+                results.append( (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)) )
+                continue
+            path = paths.pop()
+            results.append( (self.comIDs[path], np.cumsum(self.lengthsKM[path])) )
+        return results
+    
+    def getNetworkDistance(self, comID, otherComID):
+        """ Get the in-channel distance between two reaches, measured between the 
+            downstream ends of the reaches along their flow paths to the confluence
+            where the paths meet, or to the other reach if one reach lies on the 
+            flow path of the other.
+        
+            @param comID Integer representing the ComID of a reach
+            @param otherComID Integer representing the ComID of another reach
+            
+            @return Float representing the distance in kilometers, or None if the reaches
+            do not share a flow path.  The distance is 0.0 if comID equals otherComID.
+        """
+        distance = self.getNetworkDistances([comID, otherComID])[0,1]
+        if np.isnan(distance):
+            return None
+        return float(distance)
+    
+    def getNetworkDistances(self, comIDs):
+        """ Get the in-channel distances between each pair of reaches.  Flow paths form a 
+            tree rooted at each terminal reach, so paths meet at the lowest common 
+            ancestor of their origins.  Common ancestors of all pairs are found at once
+            by binary lifting over the reaches of the flow paths of comIDs.
+        
+            @param comIDs Iterable of integers representing ComIDs of reaches
+            
+            @return Symmetric numpy array of shape (n, n) of distances in kilometers 
+            (see getNetworkDistance).  Distances between reaches that do not share a flow 
+            path are NaN.
+        """
+        rows = np.array([self.getRow(comID) for comID in comIDs], dtype=np.int64)
+        numReaches = len(rows)
+        distances = np.full((numReaches, numReaches), np.nan)
+        valid = np.flatnonzero(rows >= 0)
+        if len(valid) == 0:
+            return distances
+        paths = self.getDownstreamRowsForRows(rows[valid])
+        
+        # Nodes are the reaches on any of the flow paths
+        pathRows = np.concatenate(paths)
+        nodes = np.unique(pathRows)
+        lengths = self.lengthsKM[nodes]
+        parents = self.downstream[nodes]
+        terminal = parents < 0
+        parents = np.searchsorted(nodes, parents)
+        parents[terminal] = np.flatnonzero(terminal)
+        # Number of reaches downstream of, and distance from the downstream end to the 
+        #   terminal reach of, each node
+        pathLengths = np.array([len(path) for path in paths], dtype=np.int64)
+        pathStarts = np.cumsum(pathLengths) - pathLengths
+        positions = np.arange(len(pathRows)) - np.repeat(pathStarts, pathLengths)
+        cumLengths = np.cumsum(self.lengthsKM[pathRows])
+        pathTotals = cumLengths[pathStarts + pathLengths - 1]
+        pathNodes = np.searchsorted(nodes, pathRows)
+        depths = np.zeros(len(nodes), dtype=np.int64)
+        depths[pathNodes] = np.repeat(pathLengths, pathLengths) - 1 - positions
+        toTerminal = np.zeros(len(nodes), dtype=np.float64)
+        toTerminal[pathNodes] = np.repeat(pathTotals, pathLengths) - cumLengths
+        roots = np.zeros(len(nodes), dtype=np.int64)
+        roots[pathNodes] = np.repeat(pathNodes[pathStarts + pathLengths - 1], pathLengths)
+        # ancestors[k][n] is the node 2**k reaches downstream of node n, or the terminal node
+        ancestors = [parents]
+        for k in xrange(1, max(int(depths.max()).bit_length(), 1)):
+            ancestors.append(ancestors[-1][ancestors[-1]])
+        
+        origins = pathNodes[pathStarts]
+        blockSize = max(NETWORK_DISTANCE_BLOCK_SIZE // len(origins), 1)
+        for start in xrange(0, len(origins), blockSize):
+            end = min(start + blockSize, len(origins))
+            a = np.repeat(origins[start:end], len(origins))
+            b = np.tile(origins, end - start)
+            # Lift the deeper origin of each pair to the depth of the other
+            deeper = depths[a] < depths[b]
+            (a[deeper], b[deeper]) = (b[deeper], a[deeper])
+            (x, y) = (a.copy(), b.copy())
+            lift = depths[x] - depths[y]
+            for k in xrange(len(ancestors)):
+                move = ((lift >> k) & 1).astype(np.bool_)
+                x[move] = ancestors[k][x[move]]
+            # Lift both to just upstream of their common ancestor
+            for k in xrange(len(ancestors) - 1, -1, -1):
+                (ux, uy) = (ancestors[k][x], ancestors[k][y])
+                move = ux != uy
+                x[move] = ux[move]
+                y[move] = uy[move]
+            common = np.where(x == y, x, parents[x])
+            # If y is on the flow path of x, measure to its downstream end; otherwise the
+            #   paths meet at the upstream end of the common reach
+            block = np.where(common == b, toTerminal[a] - toTerminal[b],
+                             toTerminal[a] + toTerminal[b] - 2 * (toTerminal[common] + lengths[common]))
+            block[roots[a] != roots[b]] = np.nan
+            distances[np.ix_(valid[start:end], valid)] = block.reshape((end - start, len(origins)))
+        return distances
+
+
+def createPlusFlowIntervalTables(conn, index):
+    """ Store depth-first interval labels of the PlusFlow graph in the NHDPlus2 DB
+        (see PlusFlowIndex.getIntervals).  Any existing labels will be replaced.
+    
+        @note Labels are stored in tables PlusFlowInterval (ComID, Pre, Post) 
+        and PlusFlowIntervalLink (FromComID, ToComID, ToPre)
+    
+        @param conn A connection to an SQLite3 database that has the NHDPlus2 tables
+        @param index PlusFlowIndex built from the PlusFlow table of the database
+    """
+    (pre, post, linkFrom, linkTo) = index.getIntervals()
+    comIDs = index.comIDs.tolist()
+    
+    cursor = conn.cursor()
+    cursor.execute("""DROP TABLE IF EXISTS PlusFlowInterval""")
+    cursor.execute("""DROP TABLE IF EXISTS PlusFlowIntervalLink""")
+    cursor.execute("""CREATE TABLE PlusFlowInterval
+    (ComID INTEGER PRIMARY KEY,
+    Pre INTEGER,
+    Post INTEGER)
+    """)
+    cursor.execute("""CREATE TABLE PlusFlowIntervalLink
+    (FromComID INTEGER,
+    ToComID INTEGER,
+    ToPre INTEGER)
+    """)
+    cursor.executemany("""INSERT INTO PlusFlowInterval (ComID,Pre,Post) VALUES (?,?,?)""",
+                       itertools.izip(comIDs, pre.tolist(), post.tolist()))
+    cursor.executemany("""INSERT INTO PlusFlowIntervalLink (FromComID,ToComID,ToPre) VALUES (?,?,?)""",
+                       itertools.izip(index.comIDs[linkFrom].tolist(), index.comIDs[linkTo].tolist(), 
+                                      pre[linkTo].tolist()))
+    cursor.execute("""CREATE UNIQUE INDEX IF NOT EXISTS PlusFlowInterval_Pre_idx ON PlusFlowInterval (Pre)""")
+    cursor.execute("""CREATE INDEX IF NOT EXISTS PlusFlowIntervalLink_ToPre_idx ON PlusFlowIntervalLink (ToPre)""")
+    conn.commit()
+    cursor.close()
+
+
+def getUpstreamIntervals(conn, comID):
+    """ Get the pre-order intervals containing a reach and all reaches upstream of it
+    
+        @param conn A connection to an SQLite3 database that has PlusFlowInterval and 
+        PlusFlowIntervalLink tables (see createPlusFlowIntervalTables)
+        @param comID Integer representing the ComID of the reach 
+        
+        @return A list of disjoint (pre, post) tuples; empty if comID was not found
+    """
+    cursor = conn.cursor()
+    cursor.execute("""SELECT Pre,Post FROM PlusFlowInterval WHERE ComID=?""", (comID,))
+    result = cursor.fetchone()
+    if None == result:
+        return []
+    
+    intervals = [result]
+    pending = [result]
+    while pending:
+        (lo, hi) = pending.pop()
+        cursor.execute("""SELECT i.Pre,i.Post FROM PlusFlowIntervalLink AS l
+JOIN PlusFlowInterval AS i ON l.FromComID=i.ComID
+WHERE l.ToPre BETWEEN ? AND ?""", (lo, hi))
+        for (p, q) in cursor.fetchall():
+            # Intervals are either nested or disjoint
+            if [i for i in intervals if i[0] <= p and q <= i[1]]:
+                continue
+            intervals = [i for i in intervals if not (p <= i[0] and i[1] <= q)]
+            intervals.append((p, q))
+            pending.append((p, q))
+    cursor.close()
+    
+    return intervals
+
+
+def getUpstreamReachesByInterval(conn, comID):
+    """ Get all reaches upstream of a given reach using range queries on the
+        PlusFlowInterval table
+    
+        @param conn A connection to an SQLite3 database that has PlusFlowInterval and 
+        PlusFlowIntervalLink tables (see createPlusFlowIntervalTables)
+        @param comID Integer representing the ComID of the reach whose upstream reaches are
+        to be discovered
+        
+        @return A list containing integers representing ComIDs of upstream reaches, 
+        not including comID
+    """
+    upstreamReaches = []
+    cursor = conn.cursor()
+    for (lo, hi) in getUpstreamIntervals(conn, comID):
+        cursor.execute("""SELECT ComID FROM PlusFlowInterval WHERE Pre BETWEEN ? AND ?""", (lo, hi))
+        upstreamReaches.extend([row[0] for row in cursor if row[0] != comID])
+    cursor.close()
+    
+    return upstreamReaches
+
+
+def isUpstreamReach(conn, comID, upstreamComID):
+    """ Determine whether a reach is upstream of another reach using the PlusFlowInterval 
+        table
+    
+        @param conn A connection to an SQLite3 database that has PlusFlowInterval and 
+        PlusFlowIntervalLink tables (see createPlusFlowIntervalTables)
+        @param comID Integer representing the ComID of the downstream reach
+        @param upstreamComID Integer representing the ComID of the candidate upstream reach
+        
+        @return True if upstreamComID is upstream of comID
+    """
+    if comID == upstreamComID:
+        return False
+    cursor = conn.cursor()
+    cursor.execute("""SELECT Pre FROM PlusFlowInterval WHERE ComID=?""", (upstreamComID,))
+    result = cursor.fetchone()
+    cursor.close()
+    if None == result:
+        return False
+    pre = result[0]
+    for (lo, hi) in getUpstreamIntervals(conn, comID):
+        if lo <= pre and pre <= hi:
+            return True
+    return False
+
+
+def getFlowlineAttributes(conn, index, columns):
+    """ Read numeric PlusFlowlineVAA attributes of the reaches in an index
+    
+        @param conn A connection to an SQLite3 database that has the NHDPlus2 
+        PlusFlowlineVAA table
+        @param index PlusFlowIndex or DownstreamIndex of reaches whose attributes are to be read
+        @param columns List of strings representing names of PlusFlowlineVAA columns
+        
+        @return Numpy array of shape (len(index), len(columns)), indexed by row.  
+        Attributes of reaches not in PlusFlowlineVAA, and NULL attributes, are 0.0. 
+        
+        @raise ValueError if a column name is not valid
+    """
+    for column in columns:
+        if not re.match(r'^\w+$', column):
+            raise ValueError("Invalid PlusFlowlineVAA column name %s" % (column,))
+    attributes = np.zeros((len(index), len(columns)), dtype=np.float64)
+    
+    cursor = conn.cursor()
+    cursor.execute("""SELECT ComID,%s FROM PlusFlowlineVAA""" % \
+                   ','.join(["IFNULL(%s,0)" % (column,) for column in columns]))
+    rows = cursor.fetchmany(FETCH_SIZE)
+    while rows:
+        chunk = np.array(rows, dtype=np.float64)
+        comIDs = chunk[:,0].astype(np.int64)
+        positions = np.minimum(np.searchsorted(index.comIDs, comIDs), max(len(index) - 1, 0))
+        if len(index) > 0:
+            found = index.comIDs[positions] == comIDs
+            attributes[positions[found]] = chunk[found,1:]
+        rows = cursor.fetchmany(FETCH_SIZE)
+    cursor.close()
+    
+    return attributes
+
+
+def saveNetworkSnapshot(path, plusFlowIndex, downstreamIndex):
+    """ Save a binary snapshot of network indices to a directory of numpy .npy files,
+        which can be memory mapped by loadNetworkSnapshot
+    
+        @param path String representing the path of the snapshot directory, which will
+        be created if it does not exist.  Existing snapshot files will be replaced.
+        @param plusFlowIndex PlusFlowIndex to save
+        @param downstreamIndex DownstreamIndex to save
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    arrays = {'plusflow_comids': plusFlowIndex.comIDs,
+              'plusflow_offsets': plusFlowIndex.offsets,
+              'plusflow_predecessors': plusFlowIndex.predecessors,
+              'downstream_comids': downstreamIndex.comIDs,
+              'downstream_rows': downstreamIndex.downstream,
+              'downstream_lengthkm': downstreamIndex.lengthsKM}
+    # Remove version first so that a partially written snapshot will not be loaded
+    versionPath = os.path.join(path, SNAPSHOT_VERSION_FILENAME)
+    if os.path.exists(versionPath):
+        os.unlink(versionPath)
+    for (name, array) in arrays.iteritems():
+        np.save(os.path.join(path, name + os.extsep + 'npy'), np.ascontiguousarray(array))
+    versionFile = open(versionPath, 'w')
+    versionFile.write("%d\n" % (SNAPSHOT_VERSION,))
+    versionFile.close()
+
+
+def loadNetworkSnapshot(path, mmap=True):
+    """ Load network indices from a snapshot saved by saveNetworkSnapshot.  Memory mapped
+        snapshots are opened read-only, so that processes using the same snapshot share
+        a single copy in the operating system's page cache.
+    
+        @param path String representing the path of the snapshot directory
+        @param mmap Boolean, True if arrays should be memory mapped rather than read
+        
+        @return A tuple (PlusFlowIndex, DownstreamIndex)
+        
+        @raise IOError(errno.EACCES) if the snapshot is not readable
+        @raise IOError(errno.ENOENT) if the snapshot is incomplete or is of a different 
+        version
+    """
+    if not os.access(path, os.R_OK):
+        raise IOError(errno.EACCES, "The network snapshot at %s is not readable" %
+                      path)
+    versionPath = os.path.join(path, SNAPSHOT_VERSION_FILENAME)
+    version = None
+    if os.path.exists(versionPath):
+        versionFile = open(versionPath, 'r')
+        version = versionFile.read().strip()
+        versionFile.close()
+    if version != str(SNAPSHOT_VERSION):
+        raise IOError(errno.ENOENT, "No network snapshot of version %d found at %s" %
+                      (SNAPSHOT_VERSION, path))
+    
+    mmapMode = None
+    if mmap:
+        mmapMode = 'r'
+    def load(name):
+        return np.load(os.path.join(path, name + os.extsep + 'npy'), mmap_mode=mmapMode)
+    plusFlowIndex = PlusFlowIndex(load('plusflow_comids'), load('plusflow_offsets'),
+                                  load('plusflow_predecessors'))
+    downstreamIndex = DownstreamIndex(load('downstream_comids'), load('downstream_rows'),
+                                      load('downstream_lengthkm'))
+    return (plusFlowIndex, downstreamIndex)
@@ -0,0 +1,260 @@
+"""@package ecohydrolib.nhdplus2.setupmanifest
+
+@brief Record completed steps of NHDPlusV2Setup so that unchanged work can be skipped
+
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2013, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+@author Brian Miles <brian_miles@unc.edu>
+"""
+import os
+import errno
+import sqlite3
+import hashlib
+import subprocess
+import traceback
+
+MANIFEST_FILENAME = 'NHDPlusV2Setup.manifest.sqlite'
+# Size, in bytes, of blocks read when computing checksums
+CHECKSUM_BLOCK_SIZE = 1024 * 1024
+SHAPEFILE_EXTENSIONS = ['shp', 'shx', 'dbf', 'prj']
+
+
+class SetupManifest(object):
+    """ Persistent record of the inputs of each completed step of NHDPlus V2 setup.
+    
+        A step is identified by a stage name and a key (for example an archive 
+        name), and is recorded along with the checksum of its inputs.  A step 
+        need only be re-run if it has not been recorded as complete, or if the 
+        checksum of its inputs has changed since it was.
+        
+        Checksums of files are cached by size and modification time, so files are 
+        only read when they have changed.
+        
+        @code
+        manifest = SetupManifest.fromOutputDir(outputDir)
+        checksum = manifest.getChecksum(archive)
+        if not manifest.isComplete('unzip', archive, checksum):
+            ...
+            manifest.markComplete('unzip', archive, checksum)
+        @endcode
+    """
+    def __init__(self, path):
+        """ Constructor for SetupManifest.  Creates manifest database if it does not exist.
+        
+            @param path String representing the path of the manifest SQLite3 database
+        """
+        self.path = os.path.abspath(path)
+        self._conn = sqlite3.connect(self.path)
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS step
+        (stage TEXT,
+        key TEXT,
+        checksum TEXT,
+        PRIMARY KEY (stage, key))""")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS file_checksum
+        (path TEXT PRIMARY KEY,
+        size INTEGER,
+        mtime REAL,
+        checksum TEXT)""")
+        self._conn.commit()
+    
+    @classmethod
+    def fromOutputDir(cls, outputDir):
+        """ Open the manifest stored in the NHDPlusV2Setup output directory
+        
+            @param outputDir String representing the NHDPlusV2Setup output directory
+            
+            @return SetupManifest
+            
+            @raise IOError(errno.EACCES) if outputDir is not writable
+        """
+        if not os.access(outputDir, os.W_OK):
+            raise IOError(errno.EACCES, "Not allowed to write to output directory %s" %
+                          outputDir)
+        return cls(os.path.join(outputDir, MANIFEST_FILENAME))
+    
+    def getChecksum(self, path):
+        """ Get the MD5 checksum of a file.  The checksum is only re-computed if the
+            size or modification time of the file has changed since it was last computed.
+        
+            @param path String representing the path of the file
+            
+            @return String representing the hexadecimal digest of the file
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        row = self._conn.execute("SELECT size, mtime, checksum FROM file_checksum WHERE path=?", 
+                                 (path,)).fetchone()
+        if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime:
+            return row[2]
+        
+        md5 = hashlib.md5()
+        f = open(path, 'rb')
+        try:
+            block = f.read(CHECKSUM_BLOCK_SIZE)
+            while block:
+                md5.update(block)
+                block = f.read(CHECKSUM_BLOCK_SIZE)
+        finally:
+            f.close()
+        checksum = md5.hexdigest()
+        self._conn.execute("INSERT OR REPLACE INTO file_checksum (path, size, mtime, checksum) VALUES (?,?,?,?)",
+                           (path, stat.st_size, stat.st_mtime, checksum))
+        self._conn.commit()
+        return checksum
+    
+    def getCombinedChecksum(self, paths):
+        """ Get a checksum of a set of files.  The checksum changes if any file is 
+            added, removed, renamed, or modified.
+        
+            @param paths List of strings representing the paths of the files
+            
+            @return String representing the hexadecimal digest of the files
+        """
+        md5 = hashlib.md5()
+        for path in sorted([os.path.abspath(p) for p in paths]):
+            md5.update(path)
+            md5.update(self.getChecksum(path))
+        return md5.hexdigest()
+    
+    def isComplete(self, stage, key, checksum):
+        """ Determine whether a step has been completed for inputs with a given checksum
+        
+            @param stage String representing the name of the stage
+            @param key String identifying the step within the stage
+            @param checksum String representing the checksum of the inputs of the step
+            
+            @return True if the step was completed with inputs with the same checksum
+        """
+        row = self._conn.execute("SELECT checksum FROM step WHERE stage=? AND key=?", 
+                                 (stage, key)).fetchone()
+        return row is not None and row[0] == checksum
+    
+    def markComplete(self, stage, key, checksum):
+        """ Record that a step has been completed
+        
+            @param stage String representing the name of the stage
+            @param key String identifying the step within the stage
+            @param checksum String representing the checksum of the inputs of the step
+        """
+        self._conn.execute("INSERT OR REPLACE INTO step (stage, key, checksum) VALUES (?,?,?)",
+                           (stage, key, checksum))
+        self._conn.commit()
+    
+    def clear(self, stage, key=None):
+        """ Forget completion of a step, or of all steps of a stage.  Should be called 
+            before the outputs of a step are removed or overwritten.
+        
+            @param stage String representing the name of the stage
+            @param key String identifying the step within the stage; if None, all
+            steps of the stage will be forgotten
+        """
+        if key is None:
+            self._conn.execute("DELETE FROM step WHERE stage=?", (stage,))
+        else:
+            self._conn.execute("DELETE FROM step WHERE stage=? AND key=?", (stage, key))
+        self._conn.commit()
+    
+    def close(self):
+        self._conn.close()
+
+
+def getShapefileComponents(shapefile):
+    """ Get the paths of the component files of a shapefile that are present
+    
+        @param shapefile String representing the path of the .shp file
+        
+        @return List of strings representing paths of the .shp, .shx, .dbf, and .prj 
+        files of the shapefile
+    """
+    (root, ext) = os.path.splitext(shapefile)
+    components = []
+    for extension in SHAPEFILE_EXTENSIONS:
+        for candidate in [extension, extension.upper()]:
+            path = "%s%s%s" % (root, os.extsep, candidate)
+            if os.access(path, os.F_OK):
+                components.append(path)
+                break
+    return components
+
+
+def runCommand(command):
+    """ Run a shell command
+    
+        @param command String representing the command to run
+        
+        @raise Exception if the command exits with a non-zero status
+    """
+    returnCode = subprocess.call(command, shell=True)
+    if returnCode != 0:
+        raise Exception("Command '%s' failed with exit status %d" % (command, returnCode))
+
+
+def runStep(step):
+    """ Run a step of setup, for use with multiprocessing.Pool.imap_unordered.
+        Exceptions are returned rather than raised so that the completion of other 
+        steps can still be recorded.
+        
+        @param step Tuple of the form (key, function, args); function must be 
+        defined at the top level of a module
+        
+        @return Tuple of the form (key, error), where error is None if the 
+        step succeeded, or a string containing the traceback of the failure
+    """
+    (key, function, args) = step
+    try:
+        function(*args)
+    except Exception:
+        return (key, traceback.format_exc())
+    return (key, None)
+
+
+def runSteps(manifest, stage, steps, pool):
+    """ Run steps of a stage in a process pool, recording the completion of each
+        step in the manifest as soon as it completes
+        
+        @param manifest SetupManifest in which to record completed steps
+        @param stage String representing the name of the stage
+        @param steps List of tuples of the form (key, checksum, function, args); function 
+        must be defined at the top level of a module
+        @param pool multiprocessing.Pool in which to run steps
+        
+        @return Dict mapping the key of each failed step to a string containing the
+        traceback of the failure
+    """
+    checksums = dict([(step[0], step[1]) for step in steps])
+    failures = {}
+    tasks = [(key, function, args) for (key, checksum, function, args) in steps]
+    for (key, error) in pool.imap_unordered(runStep, tasks):
+        if error is None:
+            manifest.markComplete(stage, key, checksums[key])
+        else:
+            failures[key] = error
+    return failures
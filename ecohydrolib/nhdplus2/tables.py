@@ -0,0 +1,362 @@
+"""@package ecohydrolib.nhdplus2.tables
+
+@brief Declarative specification of the NHDPlus V2 tables stored in the NHDPlus SQLite 
+database, and a bulk loader that fills them from NHDPlus V2 DBF files
+
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2013, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+@author Brian Miles <brian_miles@unc.edu>
+"""
+import collections
+
+from ecohydrolib.dbf import dbfheader
+from ecohydrolib.dbf import dbfchunks
+
+INTEGER = 'INTEGER'
+REAL = 'REAL'
+TEXT = 'TEXT'
+DATETIME = 'DATETIME'
+
+# Number of DBF records to insert per executemany call
+LOAD_CHUNK_SIZE = 10000
+
+# PRAGMAs applied while loading a newly created database.  The database is rebuilt
+#   from scratch if loading fails, so durability is not needed.
+BULK_LOAD_PRAGMAS = ['PRAGMA journal_mode=OFF',
+                     'PRAGMA synchronous=OFF',
+                     'PRAGMA temp_store=MEMORY',
+                     'PRAGMA cache_size=-262144']
+
+# Column of an NHDPlus table.  The value of the column is read from the DBF field 
+#   of the same name (compared without regard to case); if the DBF file lacks the field 
+#   and default is not None, default will be stored instead.
+Column = collections.namedtuple('Column', ['name', 'type', 'default'])
+Column.__new__.__defaults__ = (None,)
+
+
+def _toText(value):
+    return unicode(value, errors='replace')
+
+def _toDatetime(value):
+    return value.strftime("%Y-%m-%d %H:%M:%S")
+
+def _getConverter(fieldSpec):
+    """ Get function converting values of a DBF field, as returned by dbfreader, 
+        to values that can be bound to SQLite parameters, or None if no conversion 
+        is needed
+    """
+    (typ, size, deci) = fieldSpec
+    if typ == 'C':
+        return _toText
+    elif typ == 'D':
+        return _toDatetime
+    elif typ == 'N' and deci:
+        # dbfreader returns decimal.Decimal
+        return float
+    return None
+
+
+class TableSpec(object):
+    """ Specification of an NHDPlus table: its columns, and the indices to build on it.
+    """
+    def __init__(self, name, columns, indices=None, uniqueIndices=None):
+        """ Constructor for TableSpec
+        
+            @param name String representing the name of the table
+            @param columns List of Column
+            @param indices List of tuples of the form (indexName, [columnName, ...])
+            @param uniqueIndices List of tuples of the form (indexName, [columnName, ...])
+        """
+        self.name = name
+        self.columns = columns
+        self.indices = indices or []
+        self.uniqueIndices = uniqueIndices or []
+    
+    def getCreateTableSQL(self):
+        columns = ",\n    ".join(["%s %s" % (column.name, column.type) for column in self.columns])
+        return "CREATE TABLE IF NOT EXISTS %s\n    (%s)" % (self.name, columns)
+    
+    def getCreateIndexSQL(self):
+        sql = []
+        for (unique, indices) in [('', self.indices), ('UNIQUE ', self.uniqueIndices)]:
+            for (indexName, columnNames) in indices:
+                sql.append("CREATE %sINDEX IF NOT EXISTS %s ON %s (%s)" % \
+                           (unique, indexName, self.name, ','.join(columnNames)))
+        return sql
+    
+    def getInsertSQL(self):
+        return "INSERT INTO %s (%s) VALUES (%s)" % \
+            (self.name, ','.join([column.name for column in self.columns]), 
+             ','.join(['?'] * len(self.columns)))
+    
+    def getRowConverter(self, fieldNames, fieldSpecs):
+        """ Get a function that converts DBF records to rows of this table
+        
+            @param fieldNames List of strings representing the field names of the DBF file
+            @param fieldSpecs List of tuples of the form (type, size, deci) representing 
+            the field specifications of the DBF file
+            
+            @return Function taking a DBF record (a list, as returned by dbfreader) and 
+            returning a tuple of column values in the order of self.columns
+            
+            @raise KeyError if the DBF file lacks a field needed by a column with no default
+        """
+        fieldIndex = dict([(name.upper(), i) for (i, name) in enumerate(fieldNames)])
+        getters = []
+        for column in self.columns:
+            try:
+                i = fieldIndex[column.name.upper()]
+            except KeyError:
+                if column.default is None:
+                    raise KeyError("DBF file for table %s lacks field %s; fields are: %s" % \
+                                   (self.name, column.name, ', '.join(fieldNames)))
+                getters.append( (None, None, column.default) )
+                continue
+            getters.append( (i, _getConverter(fieldSpecs[i]), None) )
+        
+        def convert(record):
+            row = []
+            for (i, converter, default) in getters:
+                if i is None:
+                    row.append(default)
+                elif converter is None:
+                    row.append(record[i])
+                else:
+                    row.append(converter(record[i]))
+            return tuple(row)
+        return convert
+
+
+PLUSFLOWLINEVAA = TableSpec('PlusFlowlineVAA',
+    [Column('ComID', INTEGER),
+     Column('Fdate', DATETIME),
+     Column('StreamLeve', INTEGER),
+     Column('StreamOrde', INTEGER),
+     Column('StreamCalc', INTEGER),
+     Column('FromNode', INTEGER),
+     Column('ToNode', INTEGER),
+     Column('Hydroseq', INTEGER),
+     Column('LevelPathI', INTEGER),
+     Column('Pathlength', REAL),
+     Column('TerminalPa', INTEGER),
+     Column('ArbolateSu', REAL),
+     Column('Divergence', INTEGER),
+     Column('StartFlag', INTEGER),
+     Column('TerminalFl', INTEGER),
+     Column('DnLevel', INTEGER),
+     Column('ThinnerCod', INTEGER),
+     Column('UpLevelPat', INTEGER),
+     Column('UpHydroseq', INTEGER),
+     Column('DnLevelPat', INTEGER),
+     Column('DnMinorHyd', INTEGER),
+     Column('DnDrainCou', INTEGER),
+     Column('DnHydroseq', INTEGER),
+     Column('FromMeas', REAL),
+     Column('ToMeas', REAL),
+     Column('ReachCode', TEXT),
+     Column('LengthKM', REAL),
+     Column('Fcode', INTEGER),
+     Column('RtnDiv', INTEGER),
+     Column('OutDiv', INTEGER),
+     Column('DivEffect', INTEGER),
+     Column('VPUIn', INTEGER),
+     Column('VPUOut', INTEGER),
+     Column('TravTime', INTEGER),
+     Column('PathTime', INTEGER),
+     Column('AreaSqKM', REAL),
+     Column('TotDASqKM', REAL),
+     Column('DivDASqKM', REAL)],
+    indices=[('PlusFlowlineVAA_Comid_idx', ['ComID']),
+             ('PlusFlowlineVAA_Reachcode_idx', ['ReachCode']),
+             ('PlusFlowlineVAA_FromMeas_idx', ['FromMeas']),
+             ('PlusFlowlineVAA_ToMeas_idx', ['ToMeas'])])
+
+PLUSFLOW = TableSpec('PlusFlow',
+    [Column('FROMCOMID', INTEGER),
+     Column('FROMHYDSEQ', INTEGER),
+     Column('FROMLVLPAT', INTEGER),
+     Column('TOCOMID', INTEGER),
+     Column('TOHYDSEQ', INTEGER),
+     Column('TOLVLPAT', INTEGER),
+     Column('NODENUMBER', INTEGER),
+     Column('DELTALEVEL', INTEGER),
+     Column('DIRECTION', INTEGER),
+     Column('GAPDISTKM', REAL),
+     Column('HasGeo', TEXT),
+     Column('TotDASqKM', REAL),
+     Column('DivDASqKM', REAL)],
+    indices=[('plusflow_from_idx', ['FROMCOMID']),
+             ('plusflow_to_idx', ['TOCOMID'])])
+
+NHDREACHCODE_COMID = TableSpec('NHDReachCode_Comid',
+    [Column('COMID', INTEGER),
+     Column('REACHCODE', TEXT),
+     Column('REACHSMDAT', DATETIME),
+     Column('RESOLUTION', TEXT),
+     Column('GNIS_ID', INTEGER),
+     Column('GNIS_NAME', TEXT)],
+    indices=[('NHDReachCode_Comid_Comid_idx', ['COMID']),
+             ('NHDReachCode_Comid_Reachcode_idx', ['REACHCODE'])])
+
+NHDFLOWLINE = TableSpec('NHDFlowline',
+    [Column('COMID', INTEGER),
+     Column('FDATE', DATETIME),
+     Column('RESOLUTION', TEXT),
+     Column('GNIS_ID', INTEGER),
+     Column('GNIS_NAME', TEXT),
+     Column('LENGTHKM', REAL),
+     Column('REACHCODE', TEXT),
+     Column('FLOWDIR', TEXT),
+     Column('WBAREACOMI', INTEGER),
+     Column('FTYPE', TEXT),
+     Column('FCODE', INTEGER),
+     Column('SHAPE_LENG', REAL),
+     Column('ENABLED', TEXT),
+     # Some NHDFlowline DBF files lack GNIS_NBR
+     Column('GNIS_NBR', INTEGER, 0)],
+    indices=[('NHDFlowline_Comid_idx', ['COMID']),
+             ('NHDFlowline_Reachcode_idx', ['REACHCODE'])])
+
+GAGE_LOC = TableSpec('Gage_Loc',
+    [Column('ComID', INTEGER),
+     Column('EventDate', DATETIME),
+     Column('ReachCode', TEXT),
+     Column('ReachSMDat', INTEGER),
+     Column('Reachresol', TEXT),
+     Column('FeatureCom', INTEGER),
+     Column('FeatureCla', INTEGER),
+     Column('Source_Ori', TEXT),
+     Column('Source_Dat', TEXT),
+     Column('Source_Fea', TEXT),
+     Column('Featuredet', TEXT),
+     Column('Measure', REAL),
+     Column('Offset', INTEGER),
+     Column('EventType', TEXT)],
+    indices=[('gage_loc_source_fea_idx', ['Source_Fea']),
+             ('reachcode_measure_idx', ['ReachCode', 'Measure'])])
+
+# Gage_Info.GageID maps to Gage_Loc.Source_Fea.  Fields are read by name, so the
+#   undocumented NHD2DAGE_D field present in some GageInfo DBF files is ignored.
+GAGE_INFO = TableSpec('Gage_Info',
+    [Column('GageID', TEXT),
+     Column('Agency_cd', TEXT),
+     Column('Station_NM', TEXT),
+     Column('State_CD', TEXT),
+     Column('State', TEXT),
+     Column('SiteStatus', TEXT),
+     Column('DA_SQ_Mile', REAL),
+     Column('Lon_Site', REAL),
+     Column('Lat_Site', REAL),
+     Column('Lon_NHD', REAL),
+     Column('Lat_NHD', REAL),
+     Column('Reviewed', TEXT)],
+    indices=[('gage_info_gageID_idx', ['GageID'])])
+
+# Gage_Smooth.SITE_NO maps to Gage_Info.GageID
+GAGE_SMOOTH = TableSpec('Gage_Smooth',
+    [Column('SITE_NO', TEXT),
+     Column('YEAR', INTEGER),
+     Column('MO', INTEGER),
+     Column('AVE', REAL),
+     Column('COMPLETERE', REAL)],
+    uniqueIndices=[('gage_smooth_idx', ['SITE_NO', 'YEAR', 'MO'])])
+
+# NHDPlus V2 DBF files, and the table each is loaded into, in load order
+NHDPLUS_DBF_TABLES = [('PlusFlowlineVAA.dbf', PLUSFLOWLINEVAA),
+                      ('PlusFlow.dbf', PLUSFLOW),
+                      ('NHDReachCode_Comid.dbf', NHDREACHCODE_COMID),
+                      ('NHDFlowline.dbf', NHDFLOWLINE),
+                      ('GageLoc.dbf', GAGE_LOC),
+                      ('GageInfo.dbf', GAGE_INFO),
+                      ('Gage_Smooth.DBF', GAGE_SMOOTH)]
+
+
+def beginBulkLoad(conn, tables):
+    """ Prepare a newly created database for bulk loading: apply BULK_LOAD_PRAGMAS 
+        and create tables without indices
+        
+        @param conn sqlite3.Connection to the database
+        @param tables List of TableSpec
+    """
+    for pragma in BULK_LOAD_PRAGMAS:
+        conn.execute(pragma)
+    for table in tables:
+        conn.execute(table.getCreateTableSQL())
+    conn.commit()
+
+
+def loadDBF(conn, table, dbfPath, chunkSize=LOAD_CHUNK_SIZE):
+    """ Insert records of a DBF file into a table.  Records are streamed from the 
+        DBF file and inserted chunkSize records at a time; only fields stored in the 
+        table are decoded.  Records are not committed;
+        call conn.commit() after the last DBF file has been loaded.
+        
+        @param conn sqlite3.Connection to the database
+        @param table TableSpec of the table to insert records into
+        @param dbfPath String representing the path of the DBF file
+        @param chunkSize Integer representing the number of records to insert per
+        executemany call
+        
+        @return Integer representing the number of records inserted
+        
+        @raise KeyError if the DBF file lacks a field needed by the table
+    """
+    insertSQL = table.getInsertSQL()
+    numRecords = 0
+    f = open(dbfPath, 'rb')
+    try:
+        # Only decode fields stored in the table
+        columnNames = set([column.name.upper() for column in table.columns])
+        fieldNames = [field[0] for field in dbfheader(f)[3] if field[0].upper() in columnNames]
+        f.seek(0)
+        chunks = dbfchunks(f, chunkSize, fieldNames)
+        fieldNames = chunks.next()
+        fieldSpecs = chunks.next()
+        convert = table.getRowConverter(fieldNames, fieldSpecs)
+        for chunk in chunks:
+            conn.executemany(insertSQL, [convert(record) for record in chunk])
+            numRecords += len(chunk)
+    finally:
+        f.close()
+    return numRecords
+
+
+def endBulkLoad(conn, tables):
+    """ Commit loaded records and build the indices of tables
+        
+        @param conn sqlite3.Connection to the database
+        @param tables List of TableSpec
+    """
+    conn.commit()
+    for table in tables:
+        for sql in table.getCreateIndexSQL():
+            conn.execute(sql)
+    conn.commit()
@@ -71,8 +71,10 @@ BBOX_TILE_DIVISOR = 1.0
 
 OGR_SHAPEFILE_DRIVER_NAME = 'ESRI Shapefile'
 OGR_GEOJSON_DRIVER_NAME = 'GeoJSON'
+OGR_GPKG_DRIVER_NAME = 'GPKG'
 OGR_DRIVERS = {OGR_SHAPEFILE_DRIVER_NAME: 'shp', 
-               OGR_GEOJSON_DRIVER_NAME: 'geojson'}
+               OGR_GEOJSON_DRIVER_NAME: 'geojson',
+               OGR_GPKG_DRIVER_NAME: 'gpkg'}
 
 EPSG_RE = re.compile('^epsg:\d+$')
 GDAL_VERSION_RE = re.compile('^GDAL\s(\d{1,2})\.(\d{1,2})\.(\d{1,2}),\sreleased\s\d{4}/\d{2}/\d{2}\s*$')
@@ -584,15 +586,8 @@ def mergeFeatureLayers(config, outputDir, featureFilepaths, outLayerName,
     vFeatureFilename = 'mergeFeatureLayersToGeoJSON.vrt'
     vFeatureFilepath = os.path.join(outputDir, vFeatureFilename)
     
-    f = open(vFeatureFilepath, 'w')
-    f.write('<OGRVRTDataSource>\n\t<OGRVRTUnionLayer name="unionLayer">\n')
-    for feature in featureFilepaths:
-        if not os.access(feature, os.R_OK):
-            raise IOError(errno.EACCES, "Not allowed to read feature %s" % (feature,))
-        f.write('\t\t<OGRVRTLayer name="OGRGeoJSON">\n')
-        f.write('\t\t\t<SrcDataSource>{0}</SrcDataSource>\n\t\t</OGRVRTLayer>\n'.format(feature))
-    f.write('\t</OGRVRTUnionLayer>\n</OGRVRTDataSource>\n')
-    f.close()
+    writeUnionVRT(vFeatureFilepath, 'unionLayer', 
+                  [(feature, 'OGRGeoJSON') for feature in featureFilepaths])
         
     # Merge to a single output feature
     outExt = OGR_DRIVERS[outFormat]
@@ -615,6 +610,29 @@ def mergeFeatureLayers(config, outputDir, featureFilepaths, outLayerName,
     return outPath
 
 
+def writeUnionVRT(vrtFilepath, unionLayerName, layers):
+    """ Write an OGR virtual data source with a single layer that is the union of 
+        a set of feature layers (requires GDAL 1.10).  Allows many feature layers 
+        to be read, or converted by ogr2ogr, in one pass.
+    
+        @param vrtFilepath String representing the path of the VRT file to write
+        @param unionLayerName String representing the name of the union layer
+        @param layers List of tuples of the form (srcDataSource, srcLayerName) representing
+        the path of each feature file and the name of its layer to include in the union
+        
+        @exception IOError(errno.EACCES) if a feature file is not readable
+    """
+    f = open(vrtFilepath, 'w')
+    f.write('<OGRVRTDataSource>\n\t<OGRVRTUnionLayer name="{0}">\n'.format(unionLayerName))
+    for (feature, layerName) in layers:
+        if not os.access(feature, os.R_OK):
+            raise IOError(errno.EACCES, "Not allowed to read feature %s" % (feature,))
+        f.write('\t\t<OGRVRTLayer name="{0}">\n'.format(layerName))
+        f.write('\t\t\t<SrcDataSource>{0}</SrcDataSource>\n\t\t</OGRVRTLayer>\n'.format(feature))
+    f.write('\t</OGRVRTUnionLayer>\n</OGRVRTDataSource>\n')
+    f.close()
+
+
 def convertFeatureLayerToShapefile(config, outputDir, featureFilepath, shapefileName, layerName=None, t_srs='EPSG:4326', overwrite=False):
     """ Convert a vector feature file readible by OGR to a shapefile.  
         Will silently exit if output shapefile already exists
@@ -901,14 +919,28 @@ def getBoundingBoxForShapefile(shapefileName, buffer=0.0):
     assert(poDS.GetLayerCount() > 0)
     poLayer = poDS.GetLayer(0)
     assert(poLayer)
-    srs_proj4 = poLayer.GetSpatialRef().ExportToProj4()
+    
+    # Get bounding box for shapefile
+    return getBoundingBoxForExtent(poLayer.GetExtent(), poLayer.GetSpatialRef(), buffer)
+
+
+def getBoundingBoxForExtent(extent, srs, buffer=0.0):
+    """ Return the bounding box, in WGS84 (EPSG:4326) coordinates, for an extent.
+    
+        @param extent Tuple of the form (minX, maxX, minY, maxY), as returned by ogr.Layer.GetExtent()
+        @param srs osr.SpatialReference of the extent
+        @param buffer Float >= 0.0 representing number of degrees by which to buffer the bounding box; 0.0 = no buffer, 
+        0.01 = 0.01 degree buffer
+        
+        @return A dict containing keys: minX, minY, maxX, maxY, srs, where srs='EPSG:4326'
+    """
+    assert(buffer >= 0.0)
     
     # Setup Proj to convert to EPSG:4326 (WGS84)
-    p_in = Proj(srs_proj4)
+    p_in = Proj(srs.ExportToProj4())
     p_out = Proj(init="EPSG:4326")
     
-    # Get bounding box for shapefile
-    (minX, maxX, minY, maxY) = poLayer.GetExtent()
+    (minX, maxX, minY, maxY) = extent
     # Convert coordinates to EPSG:4326 (WGS84)
     (minX, minY) = transform(p_in, p_out, minX, minY)
     (maxX, maxY) = transform(p_in, p_out, maxX, maxY)
@@ -0,0 +1,108 @@
+"""@package ecohydrolib.tests.test_columnar
+    
+    @brief Test methods for ecohydrolib.nhdplus2.columnar
+    
+    This software is provided free of charge under the New BSD License. Please see
+    the following license information:
+    
+    Copyright (c) 2013, University of North Carolina at Chapel Hill
+    All rights reserved.
+    
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+        * Redistributions of source code must retain the above copyright
+          notice, this list of conditions and the following disclaimer.
+        * Redistributions in binary form must reproduce the above copyright
+          notice, this list of conditions and the following disclaimer in the
+          documentation and/or other materials provided with the distribution.
+        * Neither the name of the University of North Carolina at Chapel Hill nor the
+          names of its contributors may be used to endorse or promote products
+          derived from this software without specific prior written permission.
+    
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+    ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+    WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+    DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+    BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR 
+    CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+    GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+    HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT 
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+    OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+    @author Brian Miles <brian_miles@unc.edu>
+    
+    
+    Usage: 
+    @code
+    python -m unittest test_columnar
+    @endcode
+    
+""" 
+import os
+import shutil
+import tempfile
+import unittest
+import sqlite3
+
+import numpy as np
+
+from ecohydrolib.nhdplus2.tables import Column
+from ecohydrolib.nhdplus2.tables import TableSpec
+from ecohydrolib.nhdplus2.tables import INTEGER
+from ecohydrolib.nhdplus2.tables import REAL
+from ecohydrolib.nhdplus2.tables import TEXT
+from ecohydrolib.nhdplus2.tables import DATETIME
+from ecohydrolib.nhdplus2.columnar import exportTableColumns
+from ecohydrolib.nhdplus2.columnar import ColumnTable
+
+TABLE = TableSpec('PlusFlowlineVAA',
+                  [Column('ComID', INTEGER),
+                   Column('LengthKM', REAL),
+                   Column('ReachCode', TEXT),
+                   Column('FDate', DATETIME)])
+ROWS = [(101, 1.5, '01010001000001', '2012-01-02 00:00:00'),
+        (102, None, None, None),
+        (103, -0.25, 'abc', '1999-12-31 12:30:00')]
+
+
+class TestColumnar(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.execute(TABLE.getCreateTableSQL())
+        self.path = tempfile.mkdtemp()
+        
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(self.path)
+
+    def testExportTableColumns(self):
+        self.conn.executemany(TABLE.getInsertSQL(), ROWS)
+        self.assertEqual(exportTableColumns(self.conn, TABLE, self.path), 3)
+        for mmap in (True, False):
+            table = ColumnTable.open(self.path, 'PlusFlowlineVAA', mmap)
+            self.assertEqual(table.getColumnNames(), ['ComID', 'FDate', 'LengthKM', 'ReachCode'])
+            self.assertEqual(len(table), 3)
+            # NULLs are stored as 0, 0.0, '' and NaT
+            self.assertEqual(list(table['comid']), [101, 102, 103])
+            self.assertEqual(list(table['LengthKM']), [1.5, 0.0, -0.25])
+            self.assertEqual(list(table['ReachCode']), ['01010001000001', '', 'abc'])
+            self.assertEqual(str(table['FDate'][2]), '1999-12-31T12:30:00')
+            self.assertTrue(np.isnat(table['FDate'][1]))
+            selected = table.select(table['LengthKM'] > 0, ['ComID'])
+            self.assertEqual(list(selected['ComID']), [101])
+            self.assertRaises(KeyError, table.__getitem__, 'Hydroseq')
+
+    def testExportEmptyTable(self):
+        self.assertEqual(exportTableColumns(self.conn, TABLE, self.path), 0)
+        table = ColumnTable.open(self.path, 'PlusFlowlineVAA')
+        self.assertEqual(len(table), 0)
+        self.assertEqual(table['ComID'].dtype, np.int64)
+
+    def testIncompleteTable(self):
+        self.conn.executemany(TABLE.getInsertSQL(), ROWS)
+        exportTableColumns(self.conn, TABLE, self.path)
+        os.unlink(os.path.join(self.path, 'PlusFlowlineVAA', 'VERSION'))
+        self.assertRaises(IOError, ColumnTable.open, self.path, 'PlusFlowlineVAA')
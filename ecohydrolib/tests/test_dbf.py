@@ -0,0 +1,127 @@
+"""@package ecohydrolib.tests.test_dbf
+    
+    @brief Test methods for ecohydrolib.dbf
+    
+    This software is provided free of charge under the New BSD License. Please see
+    the following license information:
+    
+    Copyright (c) 2013, University of North Carolina at Chapel Hill
+    All rights reserved.
+    
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+        * Redistributions of source code must retain the above copyright
+          notice, this list of conditions and the following disclaimer.
+        * Redistributions in binary form must reproduce the above copyright
+          notice, this list of conditions and the following disclaimer in the
+          documentation and/or other materials provided with the distribution.
+        * Neither the name of the University of North Carolina at Chapel Hill nor the
+          names of its contributors may be used to endorse or promote products
+          derived from this software without specific prior written permission.
+    
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+    ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+    WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+    DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+    BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR 
+    CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+    GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+    HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT 
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+    OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+    @author Brian Miles <brian_miles@unc.edu>
+    
+    Usage: 
+    @code
+    python -m unittest test_dbf
+    @endcode
+    
+""" 
+import unittest
+import datetime
+import decimal
+from cStringIO import StringIO
+
+import numpy as np
+
+from ecohydrolib.dbf import dbfreader
+from ecohydrolib.dbf import dbfwriter
+from ecohydrolib.dbf import dbfarray
+from ecohydrolib.dbf import dbfchunks
+from ecohydrolib.dbf import dbfranges
+from ecohydrolib.dbf import dbfwritearrays
+
+FIELDNAMES = ['COMID', 'FDATE', 'REACHCODE', 'LENGTHKM', 'ENABLED']
+FIELDSPECS = [('N', 9, 0), ('D', 8, 0), ('C', 14, 0), ('N', 10, 3), ('L', 1, 0)]
+RECORDS = [[101, datetime.date(2012, 1, 2), '01010001000001', decimal.Decimal('1.250'), 'T'],
+           [-102, datetime.date(1999, 12, 31), 'abc', decimal.Decimal('-0.500'), 'F'],
+           [103, datetime.date(2000, 2, 29), '', decimal.Decimal('0.000'), '?']]
+
+
+class TestDBF(unittest.TestCase):
+
+    def setUp(self):
+        self.dbf = StringIO()
+        dbfwriter(self.dbf, FIELDNAMES, FIELDSPECS, RECORDS)
+        self.dbf.seek(0)
+        
+    def testDBFArray(self):
+        reference = list(dbfreader(self.dbf))[2:]
+        (fieldspecs, records) = dbfarray(self.dbf, mmap=False, chunksize=2)
+        self.assertEqual(fieldspecs, FIELDSPECS)
+        self.assertEqual(len(records), len(reference))
+        for (expected, record) in zip(reference, records):
+            self.assertEqual(record['COMID'], expected[0])
+            self.assertEqual(record['FDATE'], np.datetime64(expected[1]))
+            self.assertEqual(record['REACHCODE'], expected[2])
+            self.assertAlmostEqual(record['LENGTHKM'], float(expected[3]))
+            self.assertEqual(record['ENABLED'], expected[4])
+    
+    def testDBFArrayFields(self):
+        (fieldspecs, records) = dbfarray(self.dbf, ['LENGTHKM', 'COMID'], mmap=False)
+        self.assertEqual(records.dtype.names, ('LENGTHKM', 'COMID'))
+        self.assertEqual(list(records['COMID']), [101, -102, 103])
+        self.assertRaises(KeyError, dbfarray, self.dbf, ['GNIS_NBR'], False)
+    
+    def testDBFReaderFields(self):
+        records = list(dbfreader(self.dbf, ['REACHCODE', 'COMID'], start=1))
+        self.assertEqual(records[0], ['REACHCODE', 'COMID'])
+        self.assertEqual(records[1], [('C', 14, 0), ('N', 9, 0)])
+        self.assertEqual(records[2:], [['abc', -102], ['', 103]])
+    
+    def testDBFRanges(self):
+        ranges = dbfranges(self.dbf, 2)
+        self.assertEqual(ranges, [(0, 1), (1, 3)])
+        records = []
+        for (start, stop) in ranges:
+            self.dbf.seek(0)
+            chunks = list(dbfchunks(self.dbf, 1, start=start, stop=stop))
+            for chunk in chunks[2:]:
+                self.assertEqual(len(chunk), 1)
+                records.extend(chunk)
+        self.dbf.seek(0)
+        self.assertEqual(records, list(dbfreader(self.dbf))[2:])
+    
+    def testDBFWriterIterator(self):
+        dbf = StringIO()
+        dbfwriter(dbf, FIELDNAMES, FIELDSPECS, iter(RECORDS))
+        self.assertEqual(dbf.getvalue(), self.dbf.getvalue())
+    
+    def testDBFWriteArrays(self):
+        columns = [np.array([101, -102, 103]),
+                   np.array(['2012-01-02', '1999-12-31', '2000-02-29'], dtype='datetime64[D]'),
+                   np.array(['01010001000001', 'abc', '']),
+                   np.array([1.25, -0.5, 0.0]),
+                   np.array(['t', 'F', '?'])]
+        dbf = StringIO()
+        dbfwritearrays(dbf, FIELDNAMES, FIELDSPECS, columns)
+        self.assertEqual(dbf.getvalue(), self.dbf.getvalue())
+        self.assertRaises(ValueError, dbfwritearrays, StringIO(), ['COMID'], [('N', 2, 0)], 
+                          [np.array([100])])
+        self.assertRaises(ValueError, dbfwritearrays, StringIO(), ['COMID'], [('N', 2, 0)], 
+                          [np.array([1.9])])
+        dbf = StringIO()
+        dbfwritearrays(dbf, ['COMID'], [('N', 2, 0)], [np.array([-1.0, 12.0])])
+        self.assertEqual(dbf.getvalue()[-7:], ' -1 12\x1a')
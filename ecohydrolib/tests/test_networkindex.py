@@ -0,0 +1,204 @@
+"""@package ecohydrolib.tests.test_networkindex
+    
+    @brief Test methods for ecohydrolib.nhdplus2.networkindex
+    
+    This software is provided free of charge under the New BSD License. Please see
+    the following license information:
+    
+    Copyright (c) 2013, University of North Carolina at Chapel Hill
+    All rights reserved.
+    
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+        * Redistributions of source code must retain the above copyright
+          notice, this list of conditions and the following disclaimer.
+        * Redistributions in binary form must reproduce the above copyright
+          notice, this list of conditions and the following disclaimer in the
+          documentation and/or other materials provided with the distribution.
+        * Neither the name of the University of North Carolina at Chapel Hill nor the
+          names of its contributors may be used to endorse or promote products
+          derived from this software without specific prior written permission.
+    
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+    ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+    WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+    DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+    BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR 
+    CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+    GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+    HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT 
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+    OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+    @author Brian Miles <brian_miles@unc.edu>
+    
+    Usage: 
+    @code
+    python -m unittest test_networkindex
+    @endcode
+    
+""" 
+import unittest
+import sqlite3
+
+import numpy as np
+
+from ecohydrolib.nhdplus2.networkindex import PlusFlowIndex
+from ecohydrolib.nhdplus2.networkindex import UpstreamReachCache
+from ecohydrolib.nhdplus2.networkindex import DownstreamIndex
+from ecohydrolib.nhdplus2.networkindex import createPlusFlowIntervalTables
+from ecohydrolib.nhdplus2.networkindex import getUpstreamReachesByInterval
+from ecohydrolib.nhdplus2.networkindex import isUpstreamReach
+
+# A small network with a divergence (3 -> 4, 3 -> 5) that rejoins at 6:
+#
+#   1   2
+#    \ /
+#     3
+#    / \
+#   4   5   7
+#    \  |  /
+#       6
+#       |
+#       8
+PLUSFLOW = [(0, 1), (0, 2), (0, 7), (1, 3), (2, 3), (3, 4), (3, 5),
+            (4, 6), (5, 6), (7, 6), (6, 8), (8, 0)]
+
+# (ComID, Hydroseq, DnHydroseq, LengthKM) of the same network; the main path 
+#   of the divergence at 3 is 4
+PLUSFLOWLINEVAA = [(1, 90, 70, 1.0), (2, 80, 70, 2.0), (3, 70, 50, 3.0), (4, 50, 30, 4.0),
+                   (5, 60, 30, 5.0), (6, 30, 20, 6.0), (7, 40, 30, 7.0), (8, 20, 0, 8.0)]
+
+def createPlusFlowDB():
+    conn = sqlite3.connect(':memory:')
+    cursor = conn.cursor()
+    cursor.execute("""CREATE TABLE PlusFlow (FROMCOMID INTEGER, TOCOMID INTEGER)""")
+    cursor.executemany("""INSERT INTO PlusFlow (FROMCOMID,TOCOMID) VALUES (?,?)""", PLUSFLOW)
+    cursor.execute("""CREATE TABLE PlusFlowlineVAA (ComID INTEGER, Hydroseq INTEGER, 
+    DnHydroseq INTEGER, LengthKM REAL)""")
+    cursor.executemany("""INSERT INTO PlusFlowlineVAA (ComID,Hydroseq,DnHydroseq,LengthKM) 
+    VALUES (?,?,?,?)""", PLUSFLOWLINEVAA)
+    conn.commit()
+    return conn
+
+
+class TestNetworkIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = createPlusFlowDB()
+        self.index = PlusFlowIndex.fromDatabase(self.conn)
+        
+    def tearDown(self):
+        self.conn.close()
+
+    def testPredecessors(self):
+        self.assertEqual(sorted(self.index.getPredecessors(6)), [4, 5, 7])
+        self.assertEqual(sorted(self.index.getPredecessors(3)), [1, 2])
+        # Headwater and unknown reaches have no predecessors
+        self.assertEqual(self.index.getPredecessors(1), [])
+        self.assertEqual(self.index.getPredecessors(12345), [])
+
+    def testUpstreamReaches(self):
+        self.assertEqual(list(self.index.getUpstreamReaches(8)), [1, 2, 3, 4, 5, 6, 7])
+        self.assertEqual(list(self.index.getUpstreamReaches(4)), [1, 2, 3])
+        self.assertEqual(list(self.index.getUpstreamReaches(1)), [])
+        self.assertEqual(list(self.index.getUpstreamReaches(12345)), [])
+
+    def testUpstreamReachesByInterval(self):
+        createPlusFlowIntervalTables(self.conn, self.index)
+        for comID in [1, 3, 4, 5, 6, 8, 12345]:
+            self.assertEqual(sorted(getUpstreamReachesByInterval(self.conn, comID)),
+                             list(self.index.getUpstreamReaches(comID)))
+
+    def testIsUpstreamReach(self):
+        createPlusFlowIntervalTables(self.conn, self.index)
+        # Reaches above the divergence are upstream of both of its branches
+        self.assertTrue(isUpstreamReach(self.conn, 4, 1))
+        self.assertTrue(isUpstreamReach(self.conn, 5, 1))
+        self.assertTrue(isUpstreamReach(self.conn, 8, 7))
+        self.assertFalse(isUpstreamReach(self.conn, 4, 5))
+        self.assertFalse(isUpstreamReach(self.conn, 1, 8))
+        self.assertFalse(isUpstreamReach(self.conn, 6, 6))
+
+    def testUpstreamRowsForRows(self):
+        comIDs = [8, 6, 4, 1, 7]
+        rows = [self.index.getRow(c) for c in comIDs]
+        results = self.index.getUpstreamRowsForRows(rows)
+        for (comID, row) in zip(comIDs, rows):
+            expected = sorted([comID] + list(self.index.getUpstreamReaches(comID)))
+            self.assertEqual(list(self.index.comIDs[results[row]]), expected)
+
+    def testUpstreamReachCache(self):
+        cache = UpstreamReachCache(maxBytes=40)
+        cache.put('a', 3, [1, 2])
+        cache.put('a', 4, [1, 2, 3])
+        self.assertEqual(list(cache.get('a', 3)), [1, 2])
+        # Entries are keyed by network
+        self.assertEqual(cache.get('b', 3), None)
+        # Least-recently-used entry is evicted
+        cache.put('a', 7, [])
+        cache.put('a', 5, [1, 2, 3])
+        self.assertTrue(('a', 4) not in cache)
+        self.assertEqual(list(cache.get('a', 5)), [1, 2, 3])
+        self.assertEqual(cache.numBytes, 40)
+        # Entries larger than the cache are not stored
+        cache.put('a', 8, range(7))
+        self.assertTrue(('a', 8) not in cache)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    def testDownstreamPaths(self):
+        index = DownstreamIndex.fromDatabase(self.conn)
+        paths = index.getDownstreamPaths([1, 5, 8, 12345])
+        self.assertEqual(list(paths[0][0]), [1, 3, 4, 6, 8])
+        self.assertEqual(list(paths[0][1]), [1.0, 4.0, 8.0, 14.0, 22.0])
+        self.assertEqual(list(paths[1][0]), [5, 6, 8])
+        self.assertEqual(list(paths[1][1]), [5.0, 11.0, 19.0])
+        self.assertEqual(list(paths[2][0]), [8])
+        self.assertEqual(len(paths[3][0]), 0)
+
+    def testNetworkDistance(self):
+        index = DownstreamIndex.fromDatabase(self.conn)
+        self.assertEqual(index.getNetworkDistance(1, 8), 21.0)
+        # Paths 1-3-4-6-8 and 7-6-8 meet at the upstream end of reach 6
+        self.assertEqual(index.getNetworkDistance(1, 7), 7.0)
+        self.assertEqual(index.getNetworkDistance(7, 1), 7.0)
+        self.assertEqual(index.getNetworkDistance(5, 1), 7.0)
+        self.assertEqual(index.getNetworkDistance(3, 3), 0.0)
+        self.assertEqual(index.getNetworkDistance(1, 12345), None)
+
+    def testNetworkDistances(self):
+        index = DownstreamIndex.fromDatabase(self.conn)
+        # 1, 2, 5 and 7 share the path 6-8; 1 and 2 also share 3-4
+        distances = index.getNetworkDistances([1, 2, 5, 7, 8, 12345])
+        nan = float('nan')
+        expected = [[0.0, 0.0, 7.0, 7.0, 21.0, nan],
+                    [0.0, 0.0, 7.0, 7.0, 21.0, nan],
+                    [7.0, 7.0, 0.0, 0.0, 14.0, nan],
+                    [7.0, 7.0, 0.0, 0.0, 14.0, nan],
+                    [21.0, 21.0, 14.0, 14.0, 0.0, nan],
+                    [nan, nan, nan, nan, nan, nan]]
+        self.assertTrue(np.array_equal(np.isnan(distances), np.isnan(expected)))
+        self.assertTrue(np.allclose(distances[:5,:5], np.array(expected)[:5,:5]))
+
+    def testAccumulate(self):
+        comIDs = self.index.comIDs
+        values = comIDs.astype(np.float64)
+        # 4 is the main path and 5 the minor path of the divergence at 3
+        divergence = np.zeros(len(comIDs))
+        divergence[self.index.getRow(4)] = 1
+        divergence[self.index.getRow(5)] = 2
+        accumulated = dict(zip(comIDs.tolist(), self.index.accumulate(values, 
+                                    self.index.getMainPathDivergenceFractions(divergence))))
+        self.assertEqual(accumulated[4], 10.0)
+        self.assertEqual(accumulated[5], 5.0)
+        self.assertEqual(accumulated[8], 36.0)
+        accumulated = dict(zip(comIDs.tolist(), self.index.accumulate(values, 
+                                    self.index.getEqualDivergenceFractions())))
+        self.assertEqual(accumulated[4], 7.0)
+        self.assertEqual(accumulated[5], 8.0)
+        self.assertEqual(accumulated[8], 36.0)
+        # Without fractions, reaches upstream of the divergence are counted through both paths
+        accumulated = self.index.accumulate(np.column_stack((values, values)))
+        self.assertEqual(list(accumulated[self.index.getRow(8)]), [42.0, 42.0])
@@ -47,7 +47,8 @@ setup(name='ecohydrolib',
         'hs_restclient>=1.1.0',
         'clint'
       ],
-      scripts=['bin/CreateHydroShareResource.py',
+      scripts=['bin/BuildNHDStreamflowGageCatchmentGeoPackage.py',
+               'bin/CreateHydroShareResource.py',
                'bin/DumpClimateStationInfo.py',
                'bin/DumpMetadataToiRODSXML.py',
                'bin/GenerateSoilPropertyRastersFromSOLIM.py',